@@ -0,0 +1,268 @@
+# -*- coding: latin-1 -*-
+
+# 2011 - Direccin General Impositiva, Uruguay.
+# Todos los derechos reservados.
+# All rights reserved.
+
+# Runs the stages of the game without window and sound for a fixed number
+# of frames and reports the time spent per frame. Usage:
+#
+#   python benchmark.py [-f FRAMES] [-d FRAME_DELAY] [-o report.json]
+#                       [-b baseline.json] [-t THRESHOLD] [-p] [-m] [stage ...]
+#
+# With -b the results are compared with a previous report and the exit
+# status is 1 if some section is slower than the threshold. With -p the
+# alpha operations are measured with the images of the game (the stages
+# are only run if they are specified). With -m the hit tests check the
+# pixels of the surfaces instead of the bit masks, to compare the hit_test
+# section of the map and library stages:
+#
+#   python benchmark.py -m -o pixels.json map library
+#   python benchmark.py -b pixels.json map library
+#
+# With -k the keystrokes of the text box of the activity are measured with
+# texts of several sizes (the stages are only run if they are specified).
+
+import sys
+import os
+import random
+from optparse import OptionParser
+from framework import benchmark
+
+# The drivers must be configured before the game initializes pygame
+benchmark.use_dummy_drivers()
+
+import pygame
+from pygame.locals import *
+from framework.engine import Game
+from game.data import datastore
+from yaml import load
+from utils import DictClass
+from timeit import default_timer
+
+# Sizes (in chars) of the texts where the keystrokes of the text box are measured
+TYPING_SIZES = [1000, 10000, 50000]
+
+# Words used to create the texts of the typing benchmark
+TYPING_WORDS = ["hola", "mundo", "el", "contribuyente", "paga", "sus", "impuestos", "DGI"]
+
+def key_press(frame, key, duration):
+    """
+    Gets the actions of a script to press a key during some frames.
+    - frame: Frame where the key is pressed.
+    - key: Key.
+    - duration: Number of frames that the key is pressed.
+    """
+    return [(frame, pygame.event.Event(KEYDOWN, key = key, mod = 0, unicode = u"")),
+            (frame + duration, pygame.event.Event(KEYUP, key = key, mod = 0))]
+
+def click(frame, x, y):
+    """
+    Gets the actions of a script to click in a position.
+    - frame: Frame where the mouse button is pressed.
+    - x, y: Position.
+    """
+    return [(frame, pygame.event.Event(MOUSEMOTION, pos = (x, y), rel = (0, 0), buttons = (0, 0, 0))),
+            (frame, pygame.event.Event(MOUSEBUTTONDOWN, pos = (x, y), button = 1)),
+            (frame + 1, pygame.event.Event(MOUSEBUTTONUP, pos = (x, y), button = 1))]
+
+def mouse_sweep(frame, count, step = 7):
+    """
+    Gets the actions of a script to move the mouse over the window.
+    - frame: First frame.
+    - count: Number of frames with mouse movement.
+    - step: Distance moved per frame.
+    """
+    actions = []
+    x = y = 0
+    for i in xrange(count):
+        x = (x + step) % 600
+        y = (y + step / 2 + 1) % 450
+        actions.append((frame + i, pygame.event.Event(MOUSEMOTION, pos = (x, y), rel = (step, step / 2 + 1), buttons = (0, 0, 0))))
+    return actions
+
+def skip_intro(frame, data_file):
+    """
+    Gets the actions of a script to press the next button of the intro
+    dialog of a minigame.
+    - frame: Frame.
+    - data_file: Data file of the minigame.
+    """
+    button = DictClass(load(file(data_file))).intro.next
+    return click(frame, button.left + 10, button.top + 10)
+
+def get_images():
+    """
+    Gets the file names of the PNG images of the game.
+    """
+    file_names = []
+    for path, dirs, files in os.walk("images"):
+        for name in files:
+            if name.endswith(".png"):
+                file_names.append(os.path.join(path, name))
+    file_names.sort()
+    return file_names
+
+def get_scenarios(frames):
+    """
+    Gets the list of scenarios (name, stage class, script) of the benchmark.
+    - frames: Number of measured frames.
+    """
+    from game.stages.map import Map
+    from game.stages.invaders import InvadersMinigame
+    from game.stages.running import RunningMinigame
+    from game.stages.asteroids import AsteroidsMinigame
+    from game.stages.memory import MemoryMinigame
+    from game.stages.presentation import Presentation
+    from game.stages.library import Library
+
+    walk = []
+    for i, key in enumerate([K_RIGHT, K_DOWN, K_LEFT, K_UP]):
+        walk += key_press(i * frames / 4, key, frames / 4 - 1)
+
+    dodge = []
+    for i in xrange(0, frames, 40):
+        dodge += key_press(i, [K_LEFT, K_RIGHT][(i / 40) % 2], 20)
+
+    return [("map", Map, walk + mouse_sweep(0, frames / 4)),
+            ("invaders", InvadersMinigame, skip_intro(-5, "data/invaders.yaml") + dodge),
+            ("running", RunningMinigame, skip_intro(-5, "data/running.yaml") + dodge),
+            ("asteroids", AsteroidsMinigame, skip_intro(-5, "data/asteroids.yaml") + mouse_sweep(0, frames)),
+            ("memory", MemoryMinigame, skip_intro(-5, "data/memory.yaml") + mouse_sweep(0, frames)),
+            ("presentation", Presentation, mouse_sweep(0, frames)),
+            ("library", Library, mouse_sweep(0, frames))]
+
+def run_typing_benchmark(sizes = TYPING_SIZES, keystrokes = 200):
+    """
+    Measures the keystrokes typed in the middle of the text box of the activity
+    with texts of several sizes. Returns a dictionary indexed by size with the
+    mean, the p95 and the max time (in milliseconds) of a keystroke, including
+    the drawing of the text box. The keystrokes are applied with the editing
+    functions that the key handler of the text box invokes, because the text
+    box ignores the key events when it is not in a stage.
+    - sizes: Sizes of the texts in chars.
+    - keystrokes: Number of keystrokes measured for each size.
+    """
+    from framework import assets
+    from framework.engine import SCREEN_WIDTH, SCREEN_HEIGHT
+    from framework.stage import CustomDraw
+    from widgets.textbox import TextBox
+
+    data = DictClass(load(file('data/common/activity.yaml'))).text_box
+    fonts = load(file('data/fonts.yaml'))
+    font = assets.load_font(fonts[data.font]['file_name'], fonts[data.font]['size'])
+    target = CustomDraw(SCREEN_WIDTH, SCREEN_HEIGHT)
+
+    results = {}
+    for size in sizes:
+        # Use the same text in each execution
+        random.seed(size)
+        words = []
+        length = 0
+        while length < size:
+            word = random.choice(TYPING_WORDS)
+            words.append(word)
+            length += len(word) + 1
+            if random.randint(0, 40) == 0:
+                words.append("\n")
+        text = " ".join(words)[:size]
+
+        text_box = TextBox(data.left, data.top, data.width, data.height, font, eval(data.color))
+        text_box.text(text)
+        text_box._cursor.char = size / 2
+        length = len(text_box.get_text())
+
+        times = []
+        deleted = 0
+        for i in xrange(keystrokes):
+            start = default_timer()
+            if i % 10 == 9:
+                # Backspace
+                text_box._cursor.move_left()
+                text_box._delete_char(text_box._cursor.char)
+                deleted += 1
+            else:
+                text_box._add_char(text_box._cursor.char, "escribiendo un mensaje "[i % 23])
+                text_box._cursor.move_right()
+            text_box.render(text_box, target)
+            times.append((default_timer() - start) * 1000)
+
+        # Check that the keystrokes modified the text
+        expected = length + keystrokes - 2 * deleted
+        assert len(text_box.get_text()) == expected, \
+            "the text has %d chars instead of %d" % (len(text_box.get_text()), expected)
+
+        times.sort()
+        results[size] = {"mean": sum(times) / len(times),
+                         "p95": times[min(len(times) - 1, int(len(times) * 0.95))],
+                         "max": times[-1]}
+    return results
+
+def main():
+    parser = OptionParser(usage = "usage: %prog [options] [stage ...]")
+    parser.add_option("-f", "--frames", type = "int", default = 300, help = "measured frames per stage")
+    parser.add_option("-d", "--frame-delay", type = "int", default = 25, help = "fixed time between frames (ms)")
+    parser.add_option("-w", "--warm-up", type = "int", default = 10, help = "frames executed before measure")
+    parser.add_option("-o", "--output", help = "file where the JSON report is saved")
+    parser.add_option("-b", "--baseline", help = "JSON report used to compare the results")
+    parser.add_option("-t", "--threshold", type = "float", default = benchmark.REGRESSION_THRESHOLD,
+                      help = "relative increment reported as regression")
+    parser.add_option("-p", "--pixels", action = "store_true", default = False,
+                      help = "measure the alpha operations with the images")
+    parser.add_option("-m", "--no-hit-masks", action = "store_true", default = False,
+                      help = "check the pixels of the surfaces in the hit tests")
+    parser.add_option("-k", "--typing", action = "store_true", default = False,
+                      help = "measure the keystrokes of the text box")
+    options, names = parser.parse_args()
+
+    if options.no_hit_masks:
+        from framework import pixels
+        pixels.USE_HIT_MASKS = False
+
+    game = Game('DGI', None, None)
+    game.datastore = datastore.Datastore()
+    runner = benchmark.Benchmark(game, options.frames, options.frame_delay, options.warm_up)
+
+    if not (options.pixels or options.typing) or names:
+        for name, stage_class, script in get_scenarios(options.frames):
+            if names and not name in names:
+                continue
+            # Use the same random sequence in each execution
+            random.seed(0)
+            result = runner.run_stage(name, stage_class(game), script)
+            stage = game.get_stage()
+            if hasattr(stage, "get_quadrant_stats"):
+                result["quadrants"] = stage.get_quadrant_stats()
+
+    if options.pixels:
+        runner.pixels = benchmark.run_pixel_benchmark(get_images())
+        benchmark.print_pixel_report(runner.pixels)
+
+    if options.typing:
+        runner.typing = run_typing_benchmark()
+        for size in sorted(runner.typing):
+            times = runner.typing[size]
+            print "typing %6d chars: mean %8.3f  p95 %8.3f  max %8.3f ms per keystroke" % \
+                (size, times["mean"], times["p95"], times["max"])
+
+    report = runner.get_report()
+    benchmark.print_report(report)
+    for name in sorted(report["stages"]):
+        quadrants = report["stages"][name].get("quadrants")
+        if quadrants != None:
+            print "%s quadrants: %d hits, %d misses, %d prefetched, %d swaps (max %.3f ms)" % \
+                (name, quadrants["hits"], quadrants["misses"], quadrants["prefetched"],
+                 quadrants["swaps"], quadrants["max_swap_time"])
+    if options.output:
+        runner.save(options.output)
+
+    if options.baseline:
+        comparison = benchmark.compare(report, benchmark.load_report(options.baseline), options.threshold)
+        benchmark.print_comparison(comparison)
+        for entry in comparison:
+            if entry[5]:
+                return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,13 +6,105 @@
 
 import stage, assets
 from stage import ItemImage
+from cache import LRUCache
+import pixels
 import math
 import pygame
 import sys
+import weakref
 import animations
 
 WAIT_ORDINAL = 1
 
+# Milliseconds between the steps of the animations
+STEP_INTERVAL = 20
+
+# The sizes of the intermediate images of the resize animations are rounded to a
+# multiple of this value to reuse the images in other animations
+RESIZE_SIZE_STEP = 2
+
+# Maximum number of bytes used by the images of the resize animations kept in memory
+RESIZE_CACHE_MAX_BYTES = 4 * 1024 * 1024
+
+# Images of the resize animations by (weak reference to the source surface, size)
+__resize_cache = LRUCache(RESIZE_CACHE_MAX_BYTES)
+
+def linear(percentage):
+    """
+    Easing function for an uniform animation.
+    - percentage: Percentage of the duration of the animation (0 to 1).
+
+    Return the percentage of the change applied (0 to 1).
+    """
+    return percentage
+
+def ease_in_out_sine(percentage):
+    """
+    Easing function that accelerates at the beginning and decelerates at the end
+    of the animation following a sine curve.
+    - percentage: Percentage of the duration of the animation (0 to 1).
+    """
+    return (1 - math.cos(percentage * math.pi)) / 2
+
+def get_acceleration_easing(acceleration):
+    """
+    Returns an easing function that applies an acceleration as described in
+    start_move.
+    - acceleration: A tuple (maxvel_t, maxvel_dist, tension).
+    """
+    maxvel_t, maxvel_dist, tension = acceleration
+
+    def easing(percentage):
+        if percentage <= maxvel_t:
+            factor = (math.cos(percentage / maxvel_t * math.pi / 2 - math.pi) + 1)
+            return math.pow(factor, tension) * maxvel_dist
+        else:
+            factor = (math.cos((percentage - maxvel_t) / (1 - maxvel_t) * math.pi / 2 - math.pi / 2) + 1) - 1
+            return math.pow(factor, tension) * (1 - maxvel_dist) + maxvel_dist
+
+    return easing
+
+def get_scaled_image(image, size, exact = True):
+    """
+    Returns an image scaled to the specified size. The scaled images are kept in
+    a cache shared by the resize animations, so the returned image must not be
+    modified.
+    - image: Image (an instance of assets.Image).
+    - size: Size (width, height).
+    - exact: False to round the size to a multiple of RESIZE_SIZE_STEP.
+    """
+    width, height = max(0, int(size[0])), max(0, int(size[1]))
+    if not exact:
+        width = width / RESIZE_SIZE_STEP * RESIZE_SIZE_STEP
+        height = height / RESIZE_SIZE_STEP * RESIZE_SIZE_STEP
+
+    # The key uses the surface because the flips of the image replace it. It is
+    # a weak reference, so the cache doesn't keep alive the images released (the
+    # keys of the dead surfaces don't match other surfaces, and they are evicted)
+    key = (weakref.ref(image.surface), (width, height))
+    scaled_image = __resize_cache.get(key)
+    if scaled_image == None:
+        scaled_image = assets.Image(pygame.transform.smoothscale(image.surface, (width, height)))
+        __resize_cache.put(key, scaled_image, pixels.get_surface_bytes(scaled_image.surface))
+    return scaled_image
+
+def get_resize_cache_stats():
+    """
+    Gets the statistics of the cache of the images of the resize animations (see
+    LRUCache.get_stats).
+    """
+    return __resize_cache.get_stats()
+
+def get_animator(stage):
+    """
+    Returns the animator that runs the animations of a stage (it is created
+    if the stage doesn't have one).
+    - stage: Stage.
+    """
+    if stage.animator == None:
+        stage.animator = Animator(stage)
+    return stage.animator
+
 def fade_in_item(item, duration = 500, callback = None, to_alpha = 255):
     """    
     Perform a fade in animation to show an item.
@@ -24,18 +116,12 @@ def fade_in_item(item, duration = 500, callback = None, to_alpha = 255):
     """
     stage = __get_item_stage(item)
     
-    key = (item, "fade")
-    milliseconds = 20
-    
     if item.get_alpha() == 255:
         item.set_alpha(0)
     
-    # If a fade timer was already started for the item, stop it
-    stage.stop_timer(key)
-    
-    # Start the timer        
-    data = [pygame.time.get_ticks(), None, duration, to_alpha, callback, stage]
-    stage.start_timer(key, milliseconds, __timer_fade_in_item, data, True, True)
+    # Start the animation, if a fade was already started for the item it is replaced
+    tween = FadeTween((item, "fade"), item, callback, float(to_alpha) / duration, to_alpha, False)
+    get_animator(stage).start(tween)
 
 def fade_out_item(item, remove, duration = 500, callback = None):
     """    
@@ -47,19 +133,16 @@ def fade_out_item(item, remove, duration = 500, callback = None):
       there is no callback function.     
     """
     stage = __get_item_stage(item)
+    animator = get_animator(stage)
     
-    key = (item, "fade")
-    milliseconds = 20
-    
-    # If a fade timer was already started for the item, stop it
-    stage.stop_timer(key)
+    # If a fade was already started for the item, stop it
+    animator.stop((item, "fade"))
     
     # Hide the rollover if there is a rollover over the item
     item.hide_rollover()
     
-    # Start the timer
-    data = [pygame.time.get_ticks(), None, duration, remove, callback, stage]
-    stage.start_timer(key, milliseconds, __timer_fade_out_item, data, True, True)
+    # Start the animation
+    animator.start(FadeTween((item, "fade"), item, callback, -255.0 / duration, 0, remove))
 
 def fade_in_layer(layer, duration = 500, callback = None):
     """    
@@ -74,15 +157,9 @@ def fade_in_layer(layer, duration = 500, callback = None):
     if layer.get_alpha() == 255:
         layer.set_alpha(0)
     
-    key = (layer, "fade")
-    milliseconds = 20
-    
-    # If a fade timer was already started for the item, stop it
-    stage.stop_timer(key)
-    
-    # Start the timer    
-    data = [pygame.time.get_ticks(), None, duration, callback, stage]
-    stage.start_timer(key, milliseconds, __timer_fade_in_layer, data, True, True)
+    # Start the animation, if a fade was already started for the layer it is replaced
+    tween = FadeTween((layer, "fade"), layer, callback, 255.0 / duration, 255, False)
+    get_animator(stage).start(tween)
 
 def fade_out_layer(layer, duration = 500, callback = None):
     """    
@@ -94,15 +171,9 @@ def fade_out_layer(layer, duration = 500, callback = None):
     """
     stage = __get_layer_stage(layer)
     
-    key = (layer, "fade")
-    milliseconds = 20
-    
-    # If a fade timer was already started for the item, stop it
-    stage.stop_timer(key)
-    
-    # Start the timer
-    data = [pygame.time.get_ticks(), None, duration, callback, stage]
-    stage.start_timer(key, milliseconds, __timer_fade_out_layer, data, True, True)
+    # Start the animation, if a fade was already started for the layer it is replaced
+    tween = FadeTween((layer, "fade"), layer, callback, -255.0 / duration, 0, False)
+    get_animator(stage).start(tween)
     
 def start_image_sequence(item_image, images, fps, loops = 0, callback = None):
     """
@@ -119,13 +190,9 @@ def start_image_sequence(item_image, images, fps, loops = 0, callback = None):
     """
     stage = __get_item_stage(item_image)        
     
-    # If a image sequence timer was already started for the item, stop it
-    key = (item_image, "image_sequence")
-    stage.stop_timer(key)
-    
-    # Start the timer
-    milliseconds = 1000 / fps
-    stage.start_timer(key, milliseconds, __timer_image_sequence, [0, images, loops, callback, stage])
+    # Start the animation, if a image sequence was already started for the item it is replaced
+    tween = ImageSequenceTween((item_image, "image_sequence"), item_image, callback, images, loops, max(1, 1000 / fps))
+    get_animator(stage).start(tween)
         
 def stop_image_sequence(item_image):
     """
@@ -135,13 +202,13 @@ def stop_image_sequence(item_image):
     Return current image in the sequence.
     """
     stage = __get_item_stage(item_image)    
-    item_data = stage.stop_timer((item_image, "image_sequence"))
-    if item_data == None:
+    tween = get_animator(stage).stop((item_image, "image_sequence"))
+    if tween == None:
         return 0
     else:
-        return item_data[0]
+        return tween.index
 
-def start_move(item, left, top, duration, acceleration = None, move_marks = None, callback = None):
+def start_move(item, left, top, duration, acceleration = None, move_marks = None, callback = None, easing = None):
     """
     Starts an animation that moves the specified item in a straight line to 
     the specified position.
@@ -169,14 +236,11 @@ def start_move(item, left, top, duration, acceleration = None, move_marks = None
       None to don't print move marks.
     - callback: Function that is invoked with parameter item when the animation is completed. None
       there is no callback function.     
+    - easing: Easing function (like linear or ease_in_out_sine) used instead of the
+      acceleration. None to use the acceleration.
     """ 
     stage = __get_item_stage(item)        
     
-    # If a move timer is already started for the item, stop it
-    key = (item, "move")
-    milliseconds = 20
-    stage.stop_timer(key)    
-    
     item_left = item.get_left()
     item_top = item.get_top()    
     
@@ -194,9 +258,12 @@ def start_move(item, left, top, duration, acceleration = None, move_marks = None
             mark_image_dy = item.get_height() / 2 - move_marks.mark_image.get_height() / 2
             move_marks_data = [item_left - dx_per_mark, item_top - dy_per_mark, dx_per_mark, dy_per_mark, mark_image_dx, mark_image_dy]
                     
-    # Start the timer
-    data = [None, duration, item_left, item_top, left, top, acceleration, move_marks, move_marks_data, callback, stage]        
-    stage.start_timer(key, milliseconds, __timer_move, data, True, True)
+    if easing == None and acceleration != None:
+        easing = get_acceleration_easing(acceleration)
+
+    # Start the animation, if a move was already started for the item it is replaced
+    tween = MoveTween((item, "move"), item, callback, duration, (item_left, item_top), (left, top), easing, move_marks, move_marks_data)
+    get_animator(stage).start(tween)
 
 def remove_move_marks(item):
     """
@@ -224,9 +291,9 @@ def stop_move(item):
     - item_image: Item.
     """
     stage = __get_item_stage(item)    
-    stage.stop_timer((item, "move"))
+    get_animator(stage).stop((item, "move"))
 
-def start_resize(item_image, image, from_size, to_size, duration, origin_type = 1, callback = None):
+def start_resize(item_image, image, from_size, to_size, duration, origin_type = 1, callback = None, easing = None):
     """
     Start a resize animation on the specified ItemImage.
     - item: ItemImage to resize.
@@ -238,26 +305,25 @@ def start_resize(item_image, image, from_size, to_size, duration, origin_type =
         1 - Center X, Center Y.
     - callback: Function that is invoked with parameter item when the animation is completed. None
       there is no callback function.     
+    - easing: Easing function (like linear or ease_in_out_sine). None for an uniform resize.
     """
     stage = __get_item_stage(item_image)        
+    animator = get_animator(stage)
     
-    # If a move timer is already started for the item, stop it
+    # If a resize is already started for the item, stop it
     key = (item_image, "resize")
-    milliseconds = 20
-    stage.stop_timer(key)    
+    animator.stop(key)
     
     # Set the initial size
-    resized_image = assets.Image(pygame.transform.smoothscale(image.surface, (int(from_size[0]), int(from_size[1]))))
-    item_image.set_image(resized_image) 
+    item_image.set_image(get_scaled_image(image, from_size))
     
     if origin_type == 1:
         orgin_pos = (item_image.get_left() + item_image.get_width() / 2, item_image.get_top() + item_image.get_height() / 2)
     else:
         orgin_pos = None
     
-    # Start the timer    
-    data = [None, image, duration, origin_type, orgin_pos, from_size, to_size, callback, stage]        
-    stage.start_timer(key, milliseconds, __timer_resize, data, True, True)    
+    # Start the animation
+    animator.start(ResizeTween(key, item_image, callback, duration, image, origin_type, orgin_pos, from_size, to_size, easing))
 
 def stop_resize(item_image):
     """
@@ -265,7 +331,7 @@ def stop_resize(item_image):
     - item_image: Item.
     """
     stage = __get_item_stage(item_image)    
-    stage.stop_timer((item_image, "resize"))
+    get_animator(stage).stop((item_image, "resize"))
 
 def wait(stage, milliseconds, callback):
     """
@@ -467,6 +533,423 @@ class MoveMarks:
         """
         self.mark_image = mark_image
         self.separation = separation
+
+class Animator:
+    """
+    Runs the animations (tweens) of a stage. All the animations are advanced in
+    the same timer of the stage, using one sample of the clock per step. There
+    is one animation per key, starting an animation with the key of other
+    animation replaces it.
+    """
+
+    def __init__(self, stage):
+        """
+        Constructor.
+        - stage: Stage.
+        """
+        self.__stage = stage
+        self.__tweens = {}
+
+        # Animations that are advanced in each step, and animations that wait a
+        # render before the first step
+        self.__running = []
+        self.__starting = []
+
+    def start(self, tween):
+        """
+        Starts an animation.
+        - tween: Tween.
+        """
+        stage = self.__stage
+        if not self.__check_timer():
+            stage.start_timer(self, STEP_INTERVAL, self.__step, None, True)
+
+        previous = self.__tweens.get(tween.key)
+        if previous != None:
+            previous.active = False
+        self.__tweens[tween.key] = tween
+        if tween.render_first:
+            self.__starting.append(tween)
+        else:
+            self.__running.append(tween)
+
+    def stop(self, key):
+        """
+        Stops an animation.
+        - key: Key of the animation.
+
+        Return the tween of the animation, or None if there isn't an animation
+        with the key.
+        """
+        self.__check_timer()
+        tween = self.__tweens.pop(key, None)
+        if tween != None:
+            tween.active = False
+        if len(self.__tweens) == 0:
+            self.__stage.stop_timer(self)
+        return tween
+
+    def stop_all(self):
+        """
+        Stops all the animations.
+        """
+        self.__clear()
+        self.__stage.stop_timer(self)
+
+    def is_running(self, key):
+        """
+        Determines if there is an animation with the specified key.
+        - key: Key of the animation.
+        """
+        self.__check_timer()
+        return key in self.__tweens
+
+    def get_tween(self, key):
+        """
+        Gets the tween of an animation, or None if there isn't an animation with
+        the key.
+        - key: Key of the animation.
+        """
+        self.__check_timer()
+        return self.__tweens.get(key)
+
+    def get_tweens_count(self):
+        """
+        Gets the number of animations running.
+        """
+        self.__check_timer()
+        return len(self.__tweens)
+
+    def __check_timer(self):
+        """
+        Removes the animations if the timer was stopped by the stage (the
+        animations were cancelled, for example by Stage.stop_timers).
+
+        Return True if the timer is started.
+        """
+        if self.__stage.is_timer_started(self):
+            return True
+        if len(self.__tweens) > 0 or len(self.__running) > 0 or len(self.__starting) > 0:
+            self.__clear()
+        return False
+
+    def __clear(self):
+        """
+        Removes all the animations.
+        """
+        for tween in self.__tweens.values():
+            tween.active = False
+        self.__tweens = {}
+        self.__running = []
+        self.__starting = []
+
+    def __step(self, key, data):
+        """
+        This function is invoked by the timer to advance the animations.
+        - key: Timer's key.
+        - data: Timer's data.
+        """
+        now = pygame.time.get_ticks()
+        starting = self.__starting
+        running = self.__running
+        self.__starting = []
+        self.__running = []
+        survivors = []
+        try:
+            for tween in running:
+                if not tween.active:
+                    continue
+                if tween.step(now):
+                    # The animation reaches the end
+                    tween.active = False
+                    if self.__tweens.get(tween.key) is tween:
+                        del self.__tweens[tween.key]
+                    if tween.callback != None:
+                        tween.callback(tween.target)
+                elif tween.active:
+                    survivors.append(tween)
+        finally:
+            # The animations that were waiting the render (and the animations started
+            # in this step) are advanced from the next step
+            running = survivors + starting + self.__running + self.__starting
+            self.__running = [tween for tween in running if tween.active]
+            self.__starting = []
+
+        if len(self.__tweens) == 0:
+            self.__stage.stop_timer(self)
+
+class Tween(object):
+    """
+    Base class for the state of an animation run by an Animator.
+    """
+    __slots__ = ["key", "target", "callback", "render_first", "active", "start"]
+
+    def __init__(self, key, target, callback, render_first = True):
+        """
+        Constructor.
+        - key: Key of the animation.
+        - target: Item or layer animated.
+        - callback: Function that is invoked with parameter target when the animation
+          is completed. None if there is no callback function.
+        - render_first: True if a full render is performed before the first step.
+        """
+        self.key = key
+        self.target = target
+        self.callback = callback
+        self.render_first = render_first
+        self.active = True
+        self.start = None
+
+    def step(self, now):
+        """
+        Advances the animation.
+        - now: Current ticks.
+
+        Return True if the animation is completed.
+        """
+        return True
+
+    def get_elapsed_time(self, now):
+        """
+        Gets the milliseconds elapsed since the first step (0 in the first step).
+        - now: Current ticks.
+        """
+        if self.start == None:
+            self.start = now
+        return now - self.start
+
+class FadeTween(Tween):
+    """
+    Fade of the alpha value of an item or a layer.
+    """
+    __slots__ = ["rate", "to_alpha", "remove", "last"]
+
+    def __init__(self, key, target, callback, rate, to_alpha, remove):
+        """
+        Constructor.
+        - key, target, callback: See Tween.
+        - rate: Change of the alpha value per millisecond (negative for a fade out).
+        - to_alpha: Final alpha value.
+        - remove: True to remove the item from its layer at the end of the fade.
+        """
+        Tween.__init__(self, key, target, callback)
+        self.rate = rate
+        self.to_alpha = to_alpha
+        self.remove = remove
+        self.last = None
+
+    def step(self, now):
+        # The alpha value is changed from the current value, based on the
+        # elapsed time since the previous step
+        if self.last == None:
+            elapsed_time = 0
+        else:
+            elapsed_time = now - self.last
+        self.last = now
+
+        target = self.target
+        alpha = target.get_alpha() + self.rate * elapsed_time
+        if self.rate >= 0:
+            finished = alpha >= self.to_alpha
+        else:
+            finished = alpha < self.to_alpha
+        if not finished:
+            target.set_alpha(alpha)
+            return False
+
+        target.set_alpha(self.to_alpha)
+        if self.remove:
+            layer = target.get_layer()
+            if layer != None:
+                layer.remove(target)
+        return True
+
+class ImageSequenceTween(Tween):
+    """
+    Sequence of images shown in an ItemImage with a fixed interval.
+    """
+    __slots__ = ["images", "index", "loops", "interval", "next_tick"]
+
+    def __init__(self, key, target, callback, images, loops, interval):
+        """
+        Constructor.
+        - key, target, callback: See Tween.
+        - images: Images.
+        - loops: Number of times that the sequence is repeated (-1 to repeat it indefinitely).
+        - interval: Milliseconds between two images.
+        """
+        Tween.__init__(self, key, target, callback, False)
+        self.images = images
+        self.index = 0
+        self.loops = loops
+        self.interval = interval
+        self.next_tick = pygame.time.get_ticks() + interval
+
+    def step(self, now):
+        # Skip the images that should be shown since the previous step, only the
+        # last one is set in the item
+        images = self.images
+        image = None
+        finished = False
+        while now >= self.next_tick:
+            self.next_tick += self.interval
+            if len(images) > 0:
+                image = images[self.index]
+
+            # Update the index
+            self.index += 1
+            if self.index >= len(images):
+                self.index = 0
+
+                # Update the loops
+                if self.loops != -1:
+                    self.loops -= 1
+                    if self.loops < 0:
+                        # There are no more loops left, the animation must be stopped
+                        finished = True
+                        break
+
+        if image != None:
+            self.target.set_image(image)
+        return finished
+
+class MoveTween(Tween):
+    """
+    Move of an item in a straight line.
+    """
+    __slots__ = ["duration", "from_pos", "to_pos", "easing", "move_marks", "marks_data"]
+
+    def __init__(self, key, target, callback, duration, from_pos, to_pos, easing, move_marks, marks_data):
+        """
+        Constructor.
+        - key, target, callback: See Tween.
+        - duration: Duration in milliseconds.
+        - from_pos: Initial position (left, top).
+        - to_pos: Target position (left, top).
+        - easing: Easing function, None for an uniform move.
+        - move_marks: MoveMarks, None to don't print move marks.
+        - marks_data: List with the position of the last mark, the displacement per
+          mark and the position of the mark image relative to the item.
+        """
+        Tween.__init__(self, key, target, callback)
+        self.duration = duration
+        self.from_pos = from_pos
+        self.to_pos = to_pos
+        self.easing = easing
+        self.move_marks = move_marks
+        self.marks_data = marks_data
+
+    def step(self, now):
+        item = self.target
+
+        # Calculate the displacement
+        percentage = min(1, (float(self.get_elapsed_time(now)) / self.duration))
+        if self.easing == None:
+            factor = percentage
+        else:
+            factor = self.easing(percentage)
+        left_from, top_from = self.from_pos
+        left_to, top_to = self.to_pos
+
+        # Update the position in the item
+        new_left = left_from + (left_to - left_from) * factor
+        new_top = top_from + (top_to - top_from) * factor
+        item.set_left(new_left)
+        item.set_top(new_top)
+
+        # Check if must define move marks
+        marks_data = self.marks_data
+        if self.move_marks != None and marks_data != None:
+            last_mark_left, last_mark_top, dx_per_mark, dy_per_mark = marks_data[:4]
+
+            # Check if must define a new mark        
+            while ((((dx_per_mark > 0) and (last_mark_left + dx_per_mark < new_left)) or \
+                   ((dx_per_mark < 0) and (last_mark_left + dx_per_mark > new_left))) and \
+                  (((dy_per_mark > 0) and (last_mark_top + dy_per_mark < new_top)) or \
+                   ((dy_per_mark < 0) and (last_mark_top + dy_per_mark > new_top)))):
+
+                # Create the new mark                        
+                mark_x = last_mark_left + dx_per_mark
+                mark_y = last_mark_top + dy_per_mark
+                mark = ItemImage(mark_x + marks_data[4], mark_y + marks_data[5], self.move_marks.mark_image)
+                mark.move_mark_item = item            
+
+                # Add the mark
+                layer = item.get_layer()
+                if layer != None:
+                    index = layer.items.index(item)
+                    layer.add(mark, index)
+
+                # Store the data of the last mark
+                last_mark_left = mark_x
+                last_mark_top = mark_y
+                marks_data[0] = last_mark_left
+                marks_data[1] = last_mark_top
+
+        return percentage >= 1
+
+class ResizeTween(Tween):
+    """
+    Resize of the image of an ItemImage.
+    """
+    __slots__ = ["duration", "image", "origin_type", "origin_pos", "from_size", "to_size", "easing", "size"]
+
+    def __init__(self, key, target, callback, duration, image, origin_type, origin_pos, from_size, to_size, easing):
+        """
+        Constructor.
+        - key, target, callback: See Tween.
+        - duration: Duration in milliseconds.
+        - image: Image that is resized.
+        - origin_type: Origin (see start_resize).
+        - origin_pos: Position of the center of the item if origin_type is 1.
+        - from_size: Initial size (width, height).
+        - to_size: Final size (width, height).
+        - easing: Easing function, None for an uniform resize.
+        """
+        Tween.__init__(self, key, target, callback)
+        self.duration = duration
+        self.image = image
+        self.origin_type = origin_type
+        self.origin_pos = origin_pos
+        self.from_size = from_size
+        self.to_size = to_size
+        self.easing = easing
+        self.size = None
+
+    def step(self, now):
+        item_image = self.target
+
+        # Calculate the new size
+        percentage = min(1, (float(self.get_elapsed_time(now)) / self.duration))
+        if self.easing == None:
+            factor = percentage
+        else:
+            factor = self.easing(percentage)
+        from_size = self.from_size
+        to_size = self.to_size
+        new_size = (int(from_size[0] + (to_size[0] - from_size[0]) * factor), int(from_size[1] + (to_size[1] - from_size[1]) * factor))
+        finished = percentage >= 1
+        if not finished:
+            new_size = (new_size[0] / RESIZE_SIZE_STEP * RESIZE_SIZE_STEP, new_size[1] / RESIZE_SIZE_STEP * RESIZE_SIZE_STEP)
+        if new_size == self.size:
+            # The image didn't change since the previous step
+            return finished
+        self.size = new_size
+
+        # Calculate the new position
+        if self.origin_type == 1:      
+            new_left = self.origin_pos[0] - new_size[0] / 2
+            new_top = self.origin_pos[1] - new_size[1] / 2
+        else:
+            new_left = item_image.get_left()
+            new_top = item_image.get_top()
+
+        # Update the image and the position in the item
+        item_image.set_image(get_scaled_image(self.image, new_size))
+        item_image.set_left(new_left)
+        item_image.set_top(new_top)
+
+        return finished
     
 def __get_item_stage(item):
     """
@@ -493,312 +976,6 @@ def __get_layer_stage(layer):
     
     return stage
     
-def __timer_fade_in_item(key, data):
-    """    
-    This function is invoked by a timer to perform an step of a fade in animation over an item.
-    - key: Timer's key.
-    - data: Timer's data.    
-    """
-    item = key[0]
-    
-    # Calculate the increment based on the elapsed time
-    now = pygame.time.get_ticks()
-    if data[1] == None:        
-        elapsed_time = min(0, now - data[0])
-    else:    
-        elapsed_time = now - data[1]
-    data[1] = now    
-    to_alpha = data[3]
-    increment = to_alpha * (float(elapsed_time) / data[2]) 
-    
-    # Apply the increment
-    alpha = item.get_alpha()
-    alpha += increment
-    if alpha < to_alpha:
-        item.set_alpha(alpha)
-    else:
-        item.set_alpha(to_alpha)                
-        stage = data[5]
-        stage.stop_timer(key)
-        
-        callback = data[4]
-        if callback != None:             
-            callback(item)    
-    
-def __timer_fade_out_item(key, data):
-    """    
-    This function is invoked by a timer to perform an step of a fade out animation over an item.
-    - key: Timer's key.
-    - data: Timer's data.    
-    """    
-    item = key[0]
-    
-    # Calculate the decrement based on the elapsed time
-    now = pygame.time.get_ticks()
-    if data[1] == None:
-        elapsed_time = min(0, now - data[0])
-    else:    
-        elapsed_time = now - data[1]
-    data[1] = now                
-    decrement = 255 * (float(elapsed_time) / data[2])    
-    
-    # Apply the decrement
-    alpha = item.get_alpha()
-    alpha -= decrement
-    if alpha >= 0:
-        item.set_alpha(alpha)
-    else:
-        item.set_alpha(0)                
-        layer = item.get_layer()
-        if data[3] and layer != None:
-            layer.remove(item)
-        stage = data[5] 
-        stage.stop_timer(key)
-        
-        callback = data[4]
-        if callback != None:
-            callback(item)        
-
-def __timer_fade_in_layer(key, data):
-    """    
-    This function is invoked by a timer to perform an step of a fade in animation over a layer.
-    - key: Timer's key.
-    - data: Timer's data.    
-    """
-    layer = key[0]
-    
-    # Calculate the increment based on the elapsed time
-    now = pygame.time.get_ticks()
-    if data[1] == None:        
-        elapsed_time = min(0, now - data[0])
-    else:    
-        elapsed_time = now - data[1]
-    data[1] = now    
-    increment = 255 * (float(elapsed_time) / data[2]) 
-    
-    # Apply the increment
-    alpha = layer.get_alpha()
-    alpha += increment
-    if alpha < 255:
-        layer.set_alpha(alpha)
-    else:
-        layer.set_alpha(255)
-        stage = data[4]                
-        stage.stop_timer(key)
-        
-        callback = data[3]
-        if callback != None:
-            callback(layer)    
-    
-def __timer_fade_out_layer(key, data):
-    """    
-    This function is invoked by a timer to perform an step of a fade out animation over a layer.
-    - key: Timer's key.
-    - data: Timer's data.    
-    """    
-    layer = key[0]
-    
-    # Calculate the decrement based on the elapsed time
-    now = pygame.time.get_ticks()
-    if data[1] == None:
-        elapsed_time = min(0, now - data[0])
-    else:    
-        elapsed_time = now - data[1]
-    data[1] = now                
-    decrement = 255 * (float(elapsed_time) / data[2])    
-    
-    # Apply the decrement
-    alpha = layer.get_alpha()    
-    alpha -= decrement
-    if alpha >= 0:       
-        layer.set_alpha(alpha)
-    else:
-        layer.set_alpha(0)
-        stage = data[4]         
-        stage.stop_timer(key)
-        
-        callback = data[3]
-        if callback != None:
-            callback(layer)        
-    
-def __timer_image_sequence(key, data):
-    """    
-    This function is invoked by a timer to perform an step of a image sequence animation.
-    - key: Timer's key.
-    - data: Timer's data.    
-    """    
-    item = key[0]    
-    images = data[1]
-
-    # Set the new image in the item
-    if len(images) > 0:
-        item.set_image(images[data[0]])        
-    
-    # Update the index
-    data[0] += 1
-    if data[0] >= len(images):        
-        data[0] = 0
-                   
-        # Update the loops                 
-        if data[2] != -1:
-            data[2] -= 1
-            if data[2] < 0:
-                # There are no more loops left, the animation must be stopped
-                stage = data[4]
-                stage.stop_timer(key)
-                        
-                callback = data[3]
-                if callback != None:
-                    callback(item)
-
-def __timer_move(key, data):
-    """    
-    This function is invoked by a timer to perform an step of a move animation.
-    - key: Timer's key.
-    - data: Timer's data.    
-    """
-    item = key[0]
-            
-    # Calculate the the elapsed time
-    now = pygame.time.get_ticks()
-    if data[0] == None:
-        elapsed_time = 0
-        data[0] = now
-    else:    
-        elapsed_time = now - data[0]    
-    
-    # Get the move data
-    duration = data[1]
-    left_from = data[2]
-    top_from = data[3]
-    left_to = data[4]
-    top_to = data[5]
-    acceleration = data[6]
-            
-    # Calculate the displacement
-    percentage = min(1, (float(elapsed_time) / duration))    
-    if acceleration == None:
-        dx = (left_to - left_from) * percentage
-        dy = (top_to - top_from) * percentage
-    else:
-        # Apply the acceleration if it was indicated
-        maxvel_t, maxvel_dist, tension = acceleration
-        if percentage <= maxvel_t:
-            factor = (math.cos(percentage / maxvel_t * math.pi / 2 - math.pi) + 1)
-            factor = math.pow(factor, tension) * maxvel_dist
-        else:
-            factor = (math.cos((percentage - maxvel_t) / (1 - maxvel_t) * math.pi / 2 - math.pi / 2) + 1) - 1
-            factor = math.pow(factor, tension) * (1 - maxvel_dist) + maxvel_dist
-        dx = (left_to - left_from) * factor
-        dy = (top_to - top_from) * factor        
-                
-    # Calculate the new position      
-    new_left = left_from + dx
-    new_top = top_from + dy
-    
-    # Update the position in the item
-    item.set_left(new_left)
-    item.set_top(new_top)
-    
-    # Check if must define move marks
-    move_marks = data[7]
-    if move_marks != None:        
-        marks_data = data[8]
-        
-        last_mark_left = marks_data[0]
-        last_mark_top = marks_data[1]
-        dx_per_mark = marks_data[2]
-        dy_per_mark = marks_data[3]
-        
-        # Check if must define a new mark        
-        while ((((dx_per_mark > 0) and (last_mark_left + dx_per_mark < new_left)) or \
-               ((dx_per_mark < 0) and (last_mark_left + dx_per_mark > new_left))) and \
-              (((dy_per_mark > 0) and (last_mark_top + dy_per_mark < new_top)) or \
-               ((dy_per_mark < 0) and (last_mark_top + dy_per_mark > new_top)))):
-    
-            # Create the new mark                        
-            mark_x = last_mark_left + dx_per_mark
-            mark_y = last_mark_top + dy_per_mark
-            mark = ItemImage(mark_x + marks_data[4], mark_y + marks_data[5], move_marks.mark_image)
-            mark.move_mark_item = item            
-            
-            # Add the mark
-            layer = item.get_layer()
-            if layer != None:
-                index = layer.items.index(item)
-                layer.add(mark, index)
-                
-            # Store the data of the last mark
-            last_mark_left = mark_x
-            last_mark_top = mark_y
-            marks_data[0] = last_mark_left
-            marks_data[1] = last_mark_top
-            
-    if percentage >= 1:
-        # The item reaches the target location, the animation should be stopped
-        
-        stage = data[10]
-        stage.stop_timer(key)
-                
-        callback = data[9]
-        if callback != None:
-            callback(item)
-
-def __timer_resize(key, data):
-    """    
-    This function is invoked by a timer to perform an step of a resize animation.
-    - key: Timer's key.
-    - data: Timer's data.    
-    """
-    item_image = key[0]
-            
-    # Calculate the the elapsed time
-    now = pygame.time.get_ticks()
-    if data[0] == None:
-        elapsed_time = 0
-        data[0] = now
-    else:    
-        elapsed_time = now - data[0]    
-    
-    # Get the resize data
-    image = data[1]
-    duration = data[2]
-    origin_type = data[3]
-    origin_pos = data[4]
-    from_size = data[5]    
-    to_size = data[6]            
-            
-    # Calculate the new size
-    percentage = min(1, (float(elapsed_time) / duration))
-    new_size = (int(from_size[0] + (to_size[0] - from_size[0]) * percentage), int(from_size[1] + (to_size[1] - from_size[1]) * percentage))
-    
-    # Calculate the new position
-    if origin_type == 1:      
-        new_left = origin_pos[0] - new_size[0] / 2
-        new_top = origin_pos[1] - new_size[1] / 2
-    else:
-        new_left = item_image.get_left()
-        new_top = item_image.get_top()
-    
-    # Set the new size
-    resized_image = assets.Image(pygame.transform.smoothscale(image.surface, new_size))
-    item_image.set_image(resized_image) 
-           
-    # Update the image and the position in the item
-    item_image.set_image(resized_image)
-    item_image.set_left(new_left)
-    item_image.set_top(new_top)
-                
-    if percentage >= 1:
-        # The item reaches the target location, the animation should be stopped
-        
-        stage = data[8]
-        stage.stop_timer(key)
-                
-        callback = data[7]
-        if callback != None:
-            callback(item_image)
-            
 def __timer_wait(key, data):
     """    
     This function is invoked by a timer to invoke a callback after a wait.
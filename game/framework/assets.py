@@ -8,8 +8,15 @@ import pygame
 import os
 import engine
 import codecs
+import pixels
+from cache import LRUCache
 from pygame.locals import *
 
+# Maximum number of bytes of the assets (images, masks, sounds and fonts) kept in
+# the cache. The assets used by the current stage are always kept, the assets that
+# are not used are removed (the least recently used first) when it is exceeded
+CACHE_MAX_BYTES = 16 * 1024 * 1024
+
 
 def load_data(file_name, field_sep = ";"):
     """ 
@@ -75,7 +82,14 @@ def load_sound(file_name):
     """    
     Loads the specified sound .
     - file_name: File name   
+    
+    The sound is shared with the other users of the same file.
     """ 
+    key = ("sound", file_name)
+    sound = __cache.get(key)
+    if sound != None:
+        return sound
+
     full_name = os.path.join('sounds', file_name)
     try:
         sound = pygame.mixer.Sound(full_name)
@@ -83,6 +97,7 @@ def load_sound(file_name):
         print 'Cannot load sound:', full_name
         raise SystemExit, message
     
+    __cache.put(key, sound, __get_sound_bytes(sound))
     return sound
 
 def load_image(file_name):
@@ -116,7 +131,14 @@ def load_surface(file_name):
     """    
     Loads the specified image in a surface.
     - file_name: File name
+
+    The surface is shared with the other users of the same file, it must not
+    be modified.
     """   
+    key = ("surface", file_name)
+    image = __cache.get(key)
+    if image != None:
+        return image
 
     full_name = os.path.join('images', file_name)
     try:
@@ -132,6 +154,7 @@ def load_surface(file_name):
     else:
         image = image.convert()
         
+    __cache.put(key, image, pixels.get_surface_bytes(image))
     return image                
 
 def load_surface_alpha(file_name_rgb, file_name_alpha):
@@ -139,7 +162,14 @@ def load_surface_alpha(file_name_rgb, file_name_alpha):
     Loads the specified image with a separated alpha mask in a surface.
     - file_name_rgb: File name (with RGB colors)   
     - file_name_alpha: File name (with alpha channel). None to create a solid alpha channel.
+
+    The surface is shared with the other users of the same files, it must not
+    be modified.
     """
+    key = ("surface_alpha", file_name_rgb, file_name_alpha)
+    image = __cache.get(key)
+    if image != None:
+        return image
 
     full_name = os.path.join('images', file_name_rgb)
     try:
@@ -160,11 +190,9 @@ def load_surface_alpha(file_name_rgb, file_name_alpha):
         
         # Merge image RGB with alpha channel
         image = image_rgb.convert_alpha()
-        alpha = pygame.surfarray.pixels_alpha(image);                
-        for x in range(image.get_width()):
-            for y in range(image.get_height()):                                
-                alpha[x][y] = image_alpha.get_at((x, y))[0]        
+        pixels.copy_alpha_channel(image, image_alpha)
 
+    __cache.put(key, image, pixels.get_surface_bytes(image))
     return image   
 
 def load_mask(file_name):
@@ -172,8 +200,13 @@ def load_mask(file_name):
     Loads the specified image to be used as a mask in a surface.
     - file_name: File name   
     
-    The loaded image is optimized to consume less memory.
+    The loaded image is optimized to consume less memory. It is shared with the
+    other users of the same file, it must not be modified.
     """ 
+    key = ("mask", file_name)
+    image = __cache.get(key)
+    if image != None:
+        return image
 
     full_name = os.path.join('images', file_name)
     try:
@@ -187,6 +220,7 @@ def load_mask(file_name):
     # screen and the representation with a palette consume less
     # memory
     
+    __cache.put(key, image, pixels.get_surface_bytes(image))
     return image                
 
 def load_font(file_name, size):
@@ -194,10 +228,216 @@ def load_font(file_name, size):
     Loads a font.
     - file_name: File name.
     - size: Size.
+
+    The font is shared with the other users of the same file and size, its
+    style must not be modified.
     """
+    key = ("font", file_name, size)
+    font = __cache.get(key)
+    if font != None:
+        return font
 
     full_name = os.path.join('fonts', file_name)
-    return pygame.font.Font(full_name, size)
+    font = pygame.font.Font(full_name, size)
+    __cache.put(key, font, os.path.getsize(full_name))
+    return font
+
+def set_assets_owner(owner):
+    """
+    Sets the owner (usually the stage that is being shown) of the assets loaded
+    from now. The assets of an owner are kept in the cache until the owner is
+    released with release_assets.
+    - owner: Owner. None to load the assets without owner.
+    """
+    __cache.set_owner(owner)
+
+def release_assets(owner):
+    """
+    Releases the assets used by an owner. They are kept in the cache while the
+    memory budget is not exceeded.
+    - owner: Owner.
+    """
+    __cache.release(owner)
+
+def set_cache_max_bytes(max_bytes):
+    """
+    Sets the memory budget of the asset cache.
+    - max_bytes: Maximum number of bytes of the assets kept in the cache.
+    """
+    __cache.set_max_bytes(max_bytes)
+
+def clear_cache():
+    """
+    Removes the assets that are not used by an owner from the cache.
+    """
+    __cache.clear()
+
+def get_cache_stats():
+    """
+    Gets the statistics of the asset cache. It is a dictionary with the hits,
+    misses, evictions, count (number of assets), bytes (bytes of all the assets)
+    and referenced_bytes (bytes of the assets used by an owner).
+    """
+    return __cache.get_stats()
+
+def __get_sound_bytes(sound):
+    """
+    Returns the number of bytes used by the samples of a sound.
+    - sound: Sound.
+    """
+    mixer_settings = pygame.mixer.get_init()
+    if mixer_settings == None:
+        return 0
+    frequency, sample_format, channels = mixer_settings
+    return int(sound.get_length() * frequency * channels * abs(sample_format) / 8)
+
+class AssetCache:
+    """
+    Cache of the assets loaded from files. The assets are referenced by their
+    owners (the stages), and the referenced assets are always kept. The assets
+    without references are kept while the total size of the assets doesn't
+    exceed the memory budget, removing the least recently used first.
+    """
+
+    def __init__(self, max_bytes = CACHE_MAX_BYTES):
+        """
+        Constructor.
+        - max_bytes: Maximum number of bytes of the assets.
+        """
+        self.__max_bytes = max_bytes
+        self.__owner = None
+        self.__hits = 0
+        self.__misses = 0
+
+        # Assets with references by key, with [asset, bytes, references]
+        self.__referenced = {}
+        self.__referenced_bytes = 0
+
+        # Keys of the assets referenced by each owner (by owner id)
+        self.__owner_keys = {}
+
+        # Assets without references, with (asset, bytes)
+        self.__released = LRUCache(max_bytes)
+
+    def set_owner(self, owner):
+        """
+        Sets the owner of the assets that are requested from now.
+        - owner: Owner, None to request the assets without owner.
+        """
+        self.__owner = owner
+
+    def get(self, key):
+        """
+        Gets an asset, adding a reference of the current owner. Returns None if
+        the asset is not in the cache.
+        - key: Key (kind, file names and parameters).
+        """
+        entry = self.__referenced.get(key)
+        if entry != None:
+            self.__hits += 1
+            self.__add_reference(key, entry)
+            return entry[0]
+
+        released = self.__released.get(key)
+        if released == None:
+            self.__misses += 1
+            return None
+
+        self.__hits += 1
+        if self.__owner != None:
+            self.__released.remove(key)
+            self.__add_entry(key, released[0], released[1])
+        return released[0]
+
+    def put(self, key, asset, size):
+        """
+        Adds an asset, adding a reference of the current owner.
+        - key: Key (kind, file names and parameters).
+        - asset: Asset.
+        - size: Number of bytes used by the asset.
+        """
+        if self.__owner == None:
+            self.__released.put(key, (asset, size), size)
+        else:
+            self.__add_entry(key, asset, size)
+
+    def release(self, owner):
+        """
+        Removes the references of an owner.
+        - owner: Owner.
+        """
+        if self.__owner is owner:
+            self.__owner = None
+
+        for key in self.__owner_keys.pop(id(owner), []):
+            entry = self.__referenced[key]
+            entry[2] -= 1
+            if entry[2] == 0:
+                del self.__referenced[key]
+                self.__referenced_bytes -= entry[1]
+                self.__released.put(key, (entry[0], entry[1]), entry[1])
+        self.__update_budget()
+
+    def set_max_bytes(self, max_bytes):
+        """
+        Sets the memory budget.
+        - max_bytes: Maximum number of bytes of the assets.
+        """
+        self.__max_bytes = max_bytes
+        self.__update_budget()
+
+    def clear(self):
+        """
+        Removes the assets without references.
+        """
+        self.__released.clear()
+
+    def get_stats(self):
+        """
+        Gets the statistics of the cache (see get_cache_stats).
+        """
+        released_stats = self.__released.get_stats()
+        return {"hits": self.__hits, "misses": self.__misses,
+                "evictions": released_stats["evictions"],
+                "count": len(self.__referenced) + released_stats["count"],
+                "bytes": self.__referenced_bytes + released_stats["size"],
+                "referenced_bytes": self.__referenced_bytes}
+
+    def __add_entry(self, key, asset, size):
+        """
+        Adds an asset referenced by the current owner.
+        - key: Key.
+        - asset: Asset.
+        - size: Number of bytes used by the asset.
+        """
+        entry = [asset, size, 0]
+        self.__referenced[key] = entry
+        self.__referenced_bytes += size
+        self.__add_reference(key, entry)
+        self.__update_budget()
+
+    def __add_reference(self, key, entry):
+        """
+        Adds a reference of the current owner to an asset (only one reference per
+        owner is added).
+        - key: Key.
+        - entry: Entry of the asset.
+        """
+        if self.__owner == None:
+            return
+        keys = self.__owner_keys.setdefault(id(self.__owner), set())
+        if not key in keys:
+            keys.add(key)
+            entry[2] += 1
+
+    def __update_budget(self):
+        """
+        Updates the bytes available for the assets without references.
+        """
+        self.__released.set_max_size(max(0, self.__max_bytes - self.__referenced_bytes))
+
+# Cache used to load the assets
+__cache = AssetCache()
 
 class Image(object):
     """    
@@ -211,6 +451,7 @@ class Image(object):
         """    
     
         self.surface = surface        
+        self.__hit_mask = None
             
     def get_width(self):
         """        
@@ -238,11 +479,32 @@ class Image(object):
         """    
         return self.surface.get_at(x, y)
      
+    def is_over(self, x, y):
+        """
+        Determines if a pixel of the image is not transparent (its alpha value is
+        greater than pixels.HIT_ALPHA_THRESHOLD). The bit mask used to check the
+        pixels is shared by the images with the same surface.
+        - x: X coordinate
+        - y: Y coordinate
+        """
+        hit_mask = self.__hit_mask
+        if hit_mask == None or hit_mask[0] is not self.surface:
+            # The mask is looked up again if the surface was replaced
+            hit_mask = self.__hit_mask = (self.surface, pixels.get_shared_hit_mask(self.surface))
+
+        try:
+            if hit_mask[1] == None:
+                return self.surface.get_at((x, y))[3] > pixels.HIT_ALPHA_THRESHOLD
+            return hit_mask[1].get_at((x, y)) != 0
+        except IndexError:
+            return False
+
     def flip_h(self):
         """
         Flips the image horizontally.
         """
         self.surface = pygame.transform.flip(self.surface, True, False)
+        self.__hit_mask = None
     
     def flip_h_copy(self):
         """
@@ -255,6 +517,7 @@ class Image(object):
         Flips the image vertically.
         """
         self.surface = pygame.transform.flip(self.surface, False, True)
+        self.__hit_mask = None
     
     def flip_v_copy(self):
         """
@@ -267,6 +530,7 @@ class Image(object):
         Flips the image horizontally and vertically.
         """
         self.surface = pygame.transform.flip(self.surface, True, True)
+        self.__hit_mask = None
     
     def flip_hv_copy(self):
         """
@@ -0,0 +1,517 @@
+# -*- coding: latin-1 -*-
+
+# 2011 - Direccin General Impositiva, Uruguay.
+# Todos los derechos reservados.
+# All rights reserved.
+
+"""
+Headless benchmark harness. It runs stages for a fixed number of frames
+using the dummy video and audio drivers of SDL, a virtual clock and a
+scripted stream of events, and measures the time spent per frame in the
+main parts of the render path.
+"""
+
+import os
+import gc
+import assets
+import pixels
+from stage import get_text_cache_stats, reset_text_cache_stats
+from simulation import FixedStepLoop
+import pygame
+import simplejson as json
+from timeit import default_timer
+
+# Sections of the frame that are measured. Each section is a method of a
+# framework class, it is measured only in the outer invocation (an override
+# that invokes the base method is not counted twice)
+SECTIONS = ["notify_tick", "layer_update", "layer_draw", "update_display", "hit_test"]
+
+# Default relative increment of the mean time of a section that is reported
+# as a regression in the comparison with a baseline
+REGRESSION_THRESHOLD = 0.1
+
+# Maximum number of timers printed per stage (the timers with more time spent)
+TIMERS_REPORTED = 8
+
+def use_dummy_drivers():
+    """
+    Configures SDL to use the dummy video and audio drivers. It must be
+    invoked before the game is created (before pygame is initialized).
+    """
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    os.environ["SDL_AUDIODRIVER"] = "dummy"
+
+class VirtualClock:
+    """
+    Replaces pygame.time.get_ticks with a clock that only advances when
+    it is requested, so the timers and animations of the stages run in the
+    same way in each execution.
+    """
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.ticks = 0
+        self.__get_ticks = None
+
+    def install(self):
+        """
+        Starts using the virtual clock.
+        """
+        if self.__get_ticks == None:
+            self.__get_ticks = pygame.time.get_ticks
+            self.ticks = self.__get_ticks()
+            pygame.time.get_ticks = self.get_ticks
+
+    def uninstall(self):
+        """
+        Restores the clock of pygame.
+        """
+        if self.__get_ticks != None:
+            pygame.time.get_ticks = self.__get_ticks
+            self.__get_ticks = None
+
+    def get_ticks(self):
+        """
+        Gets the current time of the virtual clock in milliseconds.
+        """
+        return self.ticks
+
+    def advance(self, milliseconds):
+        """
+        Advances the virtual clock.
+        - milliseconds: Time to advance.
+        """
+        self.ticks += milliseconds
+
+class FrameProfiler:
+    """
+    Measures the time spent in each section of the frames. The measured
+    methods are wrapped while the profiler is installed.
+    """
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.frames = []
+        self.__current = None
+        self.__depth = {}
+        self.__patched = []
+
+    def install(self):
+        """
+        Wraps the measured methods.
+        """
+        from framework.engine import Game
+        from framework.stage import Stage, Layer
+
+        self.__patch(Stage, "notify_tick", "notify_tick")
+        for cls in [Stage] + self.__subclasses(Stage):
+            self.__patch(cls, "hit_test", "hit_test")
+            self.__patch(cls, "hit_test_stack", "hit_test")
+        self.__patch(Game, "update_display", "update_display")
+        for cls in [Layer] + self.__subclasses(Layer):
+            self.__patch(cls, "update", "layer_update")
+            self.__patch(cls, "draw", "layer_draw")
+
+    def uninstall(self):
+        """
+        Restores the measured methods.
+        """
+        for cls, name, func in self.__patched:
+            setattr(cls, name, func)
+        self.__patched = []
+
+    def start_frame(self):
+        """
+        Starts the measure of a new frame.
+        """
+        self.__current = dict([(section, 0.0) for section in SECTIONS])
+
+    def end_frame(self):
+        """
+        Ends the measure of the current frame. The times are stored in
+        milliseconds.
+        """
+        frame = {}
+        for section, elapsed in self.__current.iteritems():
+            frame[section] = elapsed * 1000
+        self.frames.append(frame)
+        self.__current = None
+
+    def __subclasses(self, cls):
+        """
+        Gets all the subclasses (direct or not) of a class.
+        - cls: Class.
+        """
+        subclasses = []
+        for subclass in cls.__subclasses__():
+            subclasses.append(subclass)
+            subclasses.extend(self.__subclasses(subclass))
+        return subclasses
+
+    def __patch(self, cls, name, section):
+        """
+        Wraps a method to accumulate its time in a section.
+        - cls: Class that defines the method. Nothing is done if the method
+          is inherited.
+        - name: Name of the method.
+        - section: Section where the time is accumulated.
+        """
+        if not name in cls.__dict__:
+            return
+
+        func = cls.__dict__[name]
+        profiler = self
+        self.__depth[section] = 0
+
+        def wrapper(*args, **kwargs):
+            depth = profiler.__depth
+            if depth[section] > 0 or profiler.__current == None:
+                depth[section] += 1
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    depth[section] -= 1
+
+            depth[section] = 1
+            start = default_timer()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                if profiler.__current != None:
+                    profiler.__current[section] += default_timer() - start
+                depth[section] = 0
+
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        self.__patched.append((cls, name, func))
+        setattr(cls, name, wrapper)
+
+class Benchmark:
+    """
+    Runs stages in a game for a fixed number of frames and collects the
+    time per frame of each section.
+    """
+
+    def __init__(self, game, frames = 300, frame_delay = 25, warm_up = 10):
+        """
+        Constructor.
+        - game: Game (created after invoke use_dummy_drivers).
+        - frames: Number of frames that are measured for each stage.
+        - frame_delay: Fixed time between frames in milliseconds.
+        - warm_up: Number of frames that are executed before start the
+          measure. The first frame changes the stage, so it is always
+          excluded from the measure.
+        """
+        self.game = game
+        self.frames = frames
+        self.frame_delay = frame_delay
+        self.warm_up = max(1, warm_up)
+        self.results = {}
+        self.pixels = None
+        self.typing = None
+
+    def run_stage(self, name, stage, script = None):
+        """
+        Runs a stage and stores its results.
+        - name: Name used to identify the stage in the results.
+        - stage: Stage.
+        - script: List of tuples (frame, action) with the actions executed
+          before the frame with the specified number (starting with 0 in the
+          first measured frame, negative values are executed during the
+          warm up). The action can be an event or a function that receives
+          the stage and returns a list of events. The events are posted in
+          the queue of pygame.
+        """
+        game = self.game
+        actions = {}
+        if script != None:
+            for frame, action in script:
+                actions.setdefault(frame, []).append(action)
+
+        clock = VirtualClock()
+        profiler = FrameProfiler()
+        random_state = None
+        try:
+            clock.install()
+            profiler.install()
+            game.set_fixed_frame_delay(self.frame_delay)
+            pygame.event.clear()
+            game.set_stage(stage)
+            stage = None
+            gc.collect()
+
+            for frame in xrange(-self.warm_up, self.frames):
+                if not game.is_running():
+                    break
+
+                for action in actions.get(frame, []):
+                    if callable(action):
+                        events = action(game.get_stage())
+                    else:
+                        events = [action]
+                    for event in events or []:
+                        pygame.event.post(event)
+
+                clock.advance(self.frame_delay)
+                if frame == 0:
+                    # Don't count the invocations of the timers during the warm up
+                    game.get_stage().set_timers_stats_enabled(True)
+                    simulation = get_simulation(game.get_stage())
+                    if simulation != None:
+                        simulation.reset_stats()
+                    reset_text_cache_stats()
+                    pixels.reset_alpha_cache_stats()
+                if frame >= 0:
+                    profiler.start_frame()
+                    game.run_frame()
+                    profiler.end_frame()
+                else:
+                    game.run_frame()
+        finally:
+            profiler.uninstall()
+            clock.uninstall()
+            game.set_fixed_frame_delay(None)
+
+        self.results[name] = summarize(profiler.frames)
+        self.results[name]["frames"] = profiler.frames
+        self.results[name]["assets"] = assets.get_cache_stats()
+        self.results[name]["text"] = get_text_cache_stats()
+        self.results[name]["alpha"] = pixels.get_alpha_cache_stats()
+        self.results[name]["coalesced_events"] = game.get_stage().get_coalesced_events_count()
+        timers = game.get_stage().get_timers_stats()
+        if timers != None:
+            self.results[name]["timers"] = dict([(str(key), value) for key, value in timers.items()])
+        simulation = get_simulation(game.get_stage())
+        if simulation != None:
+            self.results[name]["simulation"] = simulation.get_stats()
+        if hasattr(game.get_stage(), "get_positions_stats"):
+            # Isometric stage, report the time spent ordering the items
+            self.results[name]["positions"] = game.get_stage().get_positions_stats()
+        return self.results[name]
+
+    def get_report(self):
+        """
+        Gets the report with the results of all the stages.
+        """
+        report = {"frames": self.frames, "frame_delay": self.frame_delay,
+                  "warm_up": self.warm_up, "stages": self.results}
+        if self.pixels != None:
+            report["pixels"] = self.pixels
+        if self.typing != None:
+            report["typing"] = self.typing
+        return report
+
+    def save(self, file_name):
+        """
+        Saves the report in a JSON file.
+        - file_name: File name.
+        """
+        f = open(file_name, "w")
+        try:
+            json.dump(self.get_report(), f, indent = 2, sort_keys = True)
+        finally:
+            f.close()
+
+def get_simulation(stage):
+    """
+    Returns the fixed step loop of a stage (kept in the attribute 'simulation'),
+    or None if the stage doesn't have it.
+    - stage: Stage.
+    """
+    simulation = getattr(stage, "simulation", None)
+    if isinstance(simulation, FixedStepLoop):
+        return simulation
+    return None
+
+def summarize(frames):
+    """
+    Calculates the statistics of the sections of a list of frames.
+    - frames: List of dictionaries with the time of each section.
+    """
+    summary = {}
+    for section in SECTIONS:
+        values = sorted([frame[section] for frame in frames if section in frame])
+        if len(values) == 0:
+            continue
+        count = len(values)
+        summary[section] = {"mean": sum(values) / count,
+                            "median": values[count / 2],
+                            "p95": values[min(count - 1, int(count * 0.95))],
+                            "max": values[-1],
+                            "total": sum(values)}
+    return {"summary": summary}
+
+def load_report(file_name):
+    """
+    Loads a report saved with Benchmark.save.
+    - file_name: File name.
+    """
+    f = open(file_name, "r")
+    try:
+        return json.load(f)
+    finally:
+        f.close()
+
+def compare(report, baseline, threshold = REGRESSION_THRESHOLD):
+    """
+    Compares the mean time of the sections of two reports. Returns a list
+    of tuples (stage, section, baseline mean, mean, ratio, regression) with
+    the sections present in both reports.
+    - report: Report with the current results.
+    - baseline: Report used as reference.
+    - threshold: Relative increment that is considered a regression.
+    """
+    comparison = []
+    for name in sorted(report["stages"]):
+        if not name in baseline["stages"]:
+            continue
+        summary = report["stages"][name]["summary"]
+        base_summary = baseline["stages"][name]["summary"]
+        for section in SECTIONS:
+            if not section in summary or not section in base_summary:
+                continue
+            mean = summary[section]["mean"]
+            base_mean = base_summary[section]["mean"]
+            if base_mean > 0:
+                ratio = mean / base_mean
+            else:
+                ratio = 1.0
+            comparison.append((name, section, base_mean, mean, ratio, ratio > 1 + threshold))
+    return comparison
+
+def print_report(report):
+    """
+    Prints the summary of a report.
+    - report: Report.
+    """
+    for name in sorted(report["stages"]):
+        print name
+        summary = report["stages"][name]["summary"]
+        for section in SECTIONS:
+            if section in summary:
+                values = summary[section]
+                print "  %-16s mean %8.3f  median %8.3f  p95 %8.3f  max %8.3f ms" % \
+                    (section, values["mean"], values["median"], values["p95"], values["max"])
+        timers = report["stages"][name].get("timers", {})
+        if len(timers) > 0:
+            print "  timers"
+            for key, (count, milliseconds) in sorted(timers.items(), key = lambda entry: -entry[1][1])[:TIMERS_REPORTED]:
+                print "    %-30s %6d calls %10.3f ms" % (key, count, milliseconds)
+        simulation = report["stages"][name].get("simulation")
+        if simulation != None:
+            print "  simulation       %d steps in %d frames, %.2f steps per frame (max %d), %d ms dropped" % \
+                (simulation["steps"], simulation["frames"], simulation["steps_per_frame"],
+                 simulation["max_steps"], simulation["dropped"])
+        text = report["stages"][name].get("text")
+        if text != None:
+            print "  text cache       %d hits, %d misses, %d texts, %d bytes" % \
+                (text["hits"], text["misses"], text["count"], text["size"])
+        positions = report["stages"][name].get("positions")
+        if positions != None:
+            print "  positions        %d sorts, %d items reinserted, %.3f ms" % \
+                (positions["sorts"], positions["reinserted"], positions["time"])
+
+def print_comparison(comparison):
+    """
+    Prints the result of compare.
+    - comparison: Result of compare.
+    """
+    for name, section, base_mean, mean, ratio, regression in comparison:
+        if regression:
+            mark = "REGRESSION"
+        else:
+            mark = ""
+        print "%-20s %-16s %8.3f -> %8.3f ms (%+6.1f%%) %s" % \
+            (name, section, base_mean, mean, (ratio - 1) * 100, mark)
+
+def run_pixel_benchmark(file_names, repeat = 5):
+    """
+    Measures the alpha operations of the pixels module against the previous
+    implementations (multiply the alpha plane in float, merge the alpha
+    channel pixel by pixel) with a list of images. Returns a dictionary with
+    the best time in milliseconds of each operation per image. The display
+    must be initialized.
+    - file_names: Image file names.
+    - repeat: Number of times that each operation is measured.
+    """
+
+    fade = range(0, 256, 12)
+    results = {}
+    for file_name in file_names:
+        surface = pygame.image.load(file_name).convert_alpha()
+        result = {"size": list(surface.get_size())}
+
+        result["set_surface_alpha"] = {
+            "previous": __measure(lambda: [__previous_set_surface_alpha(surface, alpha) for alpha in fade], repeat),
+            "current": __measure(lambda: [pixels.apply_alpha(surface, alpha) for alpha in fade], repeat)}
+
+        # The cache is filled in the first fade, the following fades reuse the surfaces
+        cache = pixels.AlphaCache(surface)
+        result["set_surface_alpha"]["cached"] = __measure(lambda: [cache.get(alpha) for alpha in fade], repeat)
+
+        target = surface.copy()
+        result["merge_alpha"] = {
+            "previous": __measure(lambda: __previous_copy_alpha_channel(target, surface), 1),
+            "current": __measure(lambda: pixels.copy_alpha_channel(target, surface), repeat)}
+
+        results[file_name] = result
+    return results
+
+def print_pixel_report(results):
+    """
+    Prints the result of run_pixel_benchmark.
+    - results: Result of run_pixel_benchmark.
+    """
+    for file_name in sorted(results):
+        result = results[file_name]
+        print "%s (%dx%d)" % (file_name, result["size"][0], result["size"][1])
+        for operation in ["set_surface_alpha", "merge_alpha"]:
+            times = result[operation]
+            line = "  %-18s" % operation
+            for name in ["previous", "current", "cached"]:
+                if name in times:
+                    line += "  %s %9.3f ms" % (name, times[name])
+            if times["current"] > 0:
+                line += "  (x%.1f)" % (times["previous"] / times["current"])
+            print line
+
+def __measure(func, repeat):
+    """
+    Gets the best time in milliseconds of several invocations of a function.
+    - func: Function.
+    - repeat: Number of invocations.
+    """
+    best = None
+    for i in xrange(repeat):
+        start = default_timer()
+        func()
+        elapsed = (default_timer() - start) * 1000
+        if best == None or elapsed < best:
+            best = elapsed
+    return best
+
+def __previous_set_surface_alpha(surface, alpha):
+    """
+    Previous implementation of set_surface_alpha (used as reference).
+    """
+    surface = surface.copy()
+    alpha_matrix = pygame.surfarray.pixels_alpha(surface)
+    mult_alpha = alpha_matrix * (float(alpha) / 255)
+    alpha_matrix[:] = mult_alpha.astype('b')
+    del alpha_matrix
+    return surface
+
+def __previous_copy_alpha_channel(surface, source):
+    """
+    Previous implementation of the merge of the alpha channel in
+    assets.load_surface_alpha (used as reference).
+    """
+    alpha = pygame.surfarray.pixels_alpha(surface)
+    for x in range(surface.get_width()):
+        for y in range(surface.get_height()):
+            alpha[x][y] = source.get_at((x, y))[0]
+    del alpha
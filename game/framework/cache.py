@@ -0,0 +1,190 @@
+# -*- coding: latin-1 -*-
+
+# 2011 - Direccin General Impositiva, Uruguay.
+# Todos los derechos reservados.
+# All rights reserved.
+
+import heapq
+
+class LRUCache:
+    """
+    Cache of values with a maximum size. When the size is exceeded the least
+    recently used values are removed. The size of each value is indicated when
+    it is added (for example, the bytes of a surface), and the cache counts the
+    hits and misses of the lookups.
+    """
+
+    def __init__(self, max_size, max_count = None):
+        """
+        Constructor.
+        - max_size: Maximum sum of the sizes of the values.
+        - max_count: Maximum number of values. None if there is no limit.
+        """
+        self.__max_size = max_size
+        self.__max_count = max_count
+        self.__entries = {}
+        self.__size = 0
+        self.__stamp = 0
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+
+        # Heap with (stamp, key) of the uses of the values. The entries whose stamp
+        # is older than the stamp of the value are ignored
+        self.__uses = []
+
+    def get(self, key, default = None):
+        """
+        Gets a value and marks it as recently used.
+        - key: Key.
+        - default: Value returned if the key is not in the cache.
+        """
+        entry = self.__entries.get(key)
+        if entry == None:
+            self.__misses += 1
+            return default
+
+        self.__hits += 1
+        self.__touch(key, entry)
+        return entry[0]
+
+    def put(self, key, value, size = 1):
+        """
+        Adds a value to the cache, replacing the previous value with the same key.
+        The least recently used values are removed if the limits are exceeded. If
+        the value is bigger than the maximum size it isn't added.
+        - key: Key.
+        - value: Value.
+        - size: Size of the value.
+        """
+        self.remove(key)
+        if size > self.__max_size:
+            return
+
+        entry = [value, size, 0]
+        self.__entries[key] = entry
+        self.__size += size
+        self.__touch(key, entry)
+        self.__evict(self.__max_size, self.__max_count)
+
+    def remove(self, key):
+        """
+        Removes a value from the cache.
+        - key: Key.
+
+        Return the value removed, or None if the key is not in the cache.
+        """
+        entry = self.__entries.pop(key, None)
+        if entry == None:
+            return None
+        self.__size -= entry[1]
+        if len(self.__entries) == 0:
+            self.__uses = []
+        return entry[0]
+
+    def clear(self):
+        """
+        Removes all the values of the cache.
+        """
+        self.__entries = {}
+        self.__uses = []
+        self.__size = 0
+
+    def __contains__(self, key):
+        return key in self.__entries
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def keys(self):
+        """
+        Gets the keys of the values in the cache.
+        """
+        return self.__entries.keys()
+
+    def get_size(self):
+        """
+        Gets the sum of the sizes of the values in the cache.
+        """
+        return self.__size
+
+    def get_max_size(self):
+        """
+        Gets the maximum size of the cache.
+        """
+        return self.__max_size
+
+    def set_max_size(self, max_size):
+        """
+        Sets the maximum size of the cache, removing the least recently used values
+        if it is exceeded.
+        - max_size: Maximum sum of the sizes of the values.
+        """
+        self.__max_size = max_size
+        self.__evict(max_size, self.__max_count)
+
+    def shrink(self, size, accept = None):
+        """
+        Removes the least recently used values until the size of the cache is not
+        greater than the specified size.
+        - size: Size.
+        - accept: Function that receives the key and the value and returns True
+          if the value can be removed. None to remove any value.
+        """
+        self.__evict(size, None, accept)
+
+    def get_stats(self):
+        """
+        Gets the statistics of the cache as a dictionary with the hits, misses,
+        evictions, count and size.
+        """
+        return {"hits": self.__hits, "misses": self.__misses, "evictions": self.__evictions,
+                "count": len(self.__entries), "size": self.__size}
+
+    def reset_stats(self):
+        """
+        Resets the counters of the statistics.
+        """
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+
+    def __touch(self, key, entry):
+        """
+        Marks a value as recently used.
+        - key: Key.
+        - entry: Entry of the value.
+        """
+        self.__stamp += 1
+        entry[2] = self.__stamp
+        heapq.heappush(self.__uses, (self.__stamp, key))
+
+        # Remove the old uses when there are too many
+        if len(self.__uses) > 4 * len(self.__entries) + 16:
+            self.__uses = [(entry[2], key) for key, entry in self.__entries.items()]
+            heapq.heapify(self.__uses)
+
+    def __evict(self, max_size, max_count, accept = None):
+        """
+        Removes the least recently used values while the limits are exceeded.
+        - max_size: Maximum sum of the sizes of the values.
+        - max_count: Maximum number of values, None if there is no limit.
+        - accept: Function that determines if a value can be removed, None to
+          remove any value.
+        """
+        entries = self.__entries
+        uses = self.__uses
+        kept = []
+        while len(uses) > 0 and (self.__size > max_size or (max_count != None and len(entries) > max_count)):
+            stamp, key = heapq.heappop(uses)
+            entry = entries.get(key)
+            if entry == None or entry[2] != stamp:
+                continue
+            if accept != None and not accept(key, entry[0]):
+                kept.append((stamp, key))
+                continue
+            del entries[key]
+            self.__size -= entry[1]
+            self.__evictions += 1
+        for use in kept:
+            heapq.heappush(uses, use)
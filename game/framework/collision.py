@@ -0,0 +1,297 @@
+# -*- coding: latin-1 -*-
+
+# 2011 - Direccin General Impositiva, Uruguay.
+# Todos los derechos reservados.
+# All rights reserved.
+
+from pygame import Rect
+import pixels
+
+# Size of the cells of the grid used by CollisionWorld to find the bodies that can collide
+COLLISION_CELL_SIZE = 128
+
+def get_inset(data, default = 0):
+    """
+    Returns the inset (left, top, right, bottom) of a collision box from a
+    dictionary with the keys left, top, right and bottom (as they are written in
+    the yaml files of the games).
+    - data: Dictionary, None to use the default value in all the sides.
+    - default: Value of the sides that aren't in the dictionary.
+    """
+    if data == None:
+        data = {}
+    return (data.get("left", default), data.get("top", default),
+            data.get("right", default), data.get("bottom", default))
+
+class CollisionBody:
+    """
+    Body of a CollisionWorld. Its collision box is the rect of the image
+    (width x height at the position of the body) reduced by an inset.
+    """
+
+    def __init__(self, data, width, height, inset = (0, 0, 0, 0), category = 1, collides = 0, surface = None):
+        """
+        Constructor.
+        - data: Object associated to the body (for example, the invader).
+        - width: Width of the image.
+        - height: Height of the image.
+        - inset: Tuple (left, top, right, bottom) with the margins of the image
+          that are not part of the collision box.
+        - category: Bits with the categories of the body.
+        - collides: Bits with the categories of the bodies whose collisions with
+          this body are reported. The collisions between bodies that don't have
+          each other's categories are not checked.
+        - surface: Surface of the image, used to refine the collisions with pixel
+          masks. None if the body is only a box.
+        """
+        self.data = data
+        self.width = width
+        self.height = height
+        self.inset = inset
+        self.category = category
+        self.collides = collides
+        self.surface = surface
+        self.mask = None
+        self.x = 0
+        self.y = 0
+        left, top, right, bottom = inset
+        self.rect = Rect(left, top, max(0, width - left - right), max(0, height - top - bottom))
+        self.world = None
+        self.order = None
+        self.cells = None
+
+    def get_rect(self):
+        """
+        Gets the collision box of the body. The rect must not be modified.
+        """
+        return self.rect
+
+    def set_size(self, width, height):
+        """
+        Sets the size of the image of the body (for example, when the image of
+        the item changes). The cells of the grid of the world are updated in the
+        next move of the body.
+        - width: Width of the image.
+        - height: Height of the image.
+        """
+        if self.width == width and self.height == height:
+            return
+        self.width = width
+        self.height = height
+        left, top, right, bottom = self.inset
+        self.rect.width = max(0, width - left - right)
+        self.rect.height = max(0, height - top - bottom)
+
+class CollisionWorld:
+    """
+    Finds the collisions between the bodies of a game. The bodies are kept in a
+    uniform grid, so only the bodies in the same cells are checked, and the
+    positions are updated in place. After moving the bodies, step determines
+    the pairs of bodies in contact and returns the pairs that weren't in contact
+    in the previous step.
+    """
+
+    def __init__(self, cell_size = COLLISION_CELL_SIZE, use_masks = False):
+        """
+        Constructor.
+        - cell_size: Size of the cells of the grid.
+        - use_masks: Indicate if the collisions of the boxes are refined with the
+          pixel masks of the bodies that have a surface.
+        """
+        self.__cell_size = cell_size
+        self.__use_masks = use_masks and pixels.USE_HIT_MASKS
+        self.__cells = {}
+        self.__bodies = set()
+        self.__active = set()
+        self.__order = 0
+        self.__contacts = {}
+        self.__tests = 0
+
+    def add(self, body, x, y):
+        """
+        Adds a body to the world.
+        - body: CollisionBody.
+        - x: X coordinate of the image of the body.
+        - y: Y coordinate of the image of the body.
+        """
+        if body.world != None:
+            body.world.remove(body)
+
+        self.__order += 1
+        body.world = self
+        body.order = self.__order
+        if self.__use_masks and body.surface != None and body.mask == None:
+            body.mask = pixels.get_hit_mask(body.surface)
+        self.__bodies.add(body)
+        if body.collides:
+            self.__active.add(body)
+        self.__set_position(body, x, y)
+        self.__add_cells(body)
+
+    def remove(self, body):
+        """
+        Removes a body from the world.
+        - body: CollisionBody.
+        """
+        if body.world is not self:
+            return
+        self.__remove_cells(body)
+        self.__bodies.discard(body)
+        self.__active.discard(body)
+        body.world = None
+        body.cells = None
+
+    def clear(self):
+        """
+        Removes all the bodies from the world.
+        """
+        for body in self.__bodies:
+            body.world = None
+            body.cells = None
+        self.__cells = {}
+        self.__bodies = set()
+        self.__active = set()
+        self.__contacts = {}
+
+    def move(self, body, x, y):
+        """
+        Moves a body. The cells of the grid are only updated if the body moves
+        to other cells.
+        - body: CollisionBody.
+        - x: X coordinate of the image of the body.
+        - y: Y coordinate of the image of the body.
+        """
+        self.__set_position(body, x, y)
+        cells = self.__get_cells(body.rect)
+        if cells != body.cells:
+            self.__remove_cells(body)
+            self.__add_cells(body, cells)
+
+    def step(self):
+        """
+        Determines the pairs of bodies in contact. Returns a list with the pairs
+        (body, other) that entered in contact since the previous step, where
+        the categories of other are in the bits collides of body. The bodies
+        can be removed while the list is processed.
+        """
+        grid_cells = self.__cells
+        contacts = {}
+        for body in self.__active:
+            candidates = set()
+            col_start, col_end, row_start, row_end = body.cells
+            for col in xrange(col_start, col_end):
+                for row in xrange(row_start, row_end):
+                    cell = grid_cells.get((col, row))
+                    if cell != None:
+                        candidates.update(cell)
+
+            for other in candidates:
+                if other is body or not (body.collides & other.category):
+                    continue
+                if body.order < other.order:
+                    key = (body.order, other.order)
+                else:
+                    key = (other.order, body.order)
+                if key in contacts:
+                    continue
+                self.__tests += 1
+                if body.rect.colliderect(other.rect) and self.__overlap_masks(body, other):
+                    contacts[key] = (body, other)
+
+        previous = self.__contacts
+        self.__contacts = contacts
+        return [contacts[key] for key in sorted(contacts) if not key in previous]
+
+    def get_contacts(self):
+        """
+        Gets the list of pairs of bodies in contact in the last step.
+        """
+        contacts = self.__contacts
+        return [contacts[key] for key in sorted(contacts)]
+
+    def get_bodies_count(self):
+        """
+        Gets the number of bodies in the world.
+        """
+        return len(self.__bodies)
+
+    def get_stats(self):
+        """
+        Gets the statistics of the world as a dictionary with the number of
+        bodies, the number of pairs checked since the creation of the world
+        (tests) and the number of contacts of the last step.
+        """
+        return {"bodies": len(self.__bodies), "tests": self.__tests, "contacts": len(self.__contacts)}
+
+    def __set_position(self, body, x, y):
+        """
+        Sets the position of a body and its collision box.
+        - body: CollisionBody.
+        - x: X coordinate of the image of the body.
+        - y: Y coordinate of the image of the body.
+        """
+        body.x = x
+        body.y = y
+        body.rect.left = int(x) + body.inset[0]
+        body.rect.top = int(y) + body.inset[1]
+
+    def __overlap_masks(self, body, other):
+        """
+        Determines if the pixel masks of two bodies whose boxes collide overlap.
+        Returns True if the masks are not used or any of the bodies doesn't
+        have a mask.
+        - body: CollisionBody.
+        - other: CollisionBody.
+        """
+        if body.mask == None or other.mask == None:
+            return True
+        offset = (int(other.x) - int(body.x), int(other.y) - int(body.y))
+        return body.mask.overlap(other.mask, offset) != None
+
+    def __get_cells(self, rect):
+        """
+        Gets the range of cells covered by a rect as a tuple (first column,
+        last column + 1, first row, last row + 1).
+        - rect: Rect.
+        """
+        size = self.__cell_size
+        return (rect.left // size, (rect.right - 1) // size + 1,
+                rect.top // size, (rect.bottom - 1) // size + 1)
+
+    def __add_cells(self, body, cells = None):
+        """
+        Adds a body to the cells of the grid covered by its collision box.
+        - body: CollisionBody.
+        - cells: Range of cells, None to calculate it.
+        """
+        if cells == None:
+            cells = self.__get_cells(body.rect)
+        body.cells = cells
+        grid_cells = self.__cells
+        col_start, col_end, row_start, row_end = cells
+        for col in xrange(col_start, col_end):
+            for row in xrange(row_start, row_end):
+                cell = (col, row)
+                if cell in grid_cells:
+                    grid_cells[cell].add(body)
+                else:
+                    grid_cells[cell] = set([body])
+
+    def __remove_cells(self, body):
+        """
+        Removes a body from the cells of the grid.
+        - body: CollisionBody.
+        """
+        if body.cells == None:
+            return
+        grid_cells = self.__cells
+        col_start, col_end, row_start, row_end = body.cells
+        for col in xrange(col_start, col_end):
+            for row in xrange(row_start, row_end):
+                cell = (col, row)
+                bodies = grid_cells.get(cell)
+                if bodies != None:
+                    bodies.discard(body)
+                    if len(bodies) == 0:
+                        del grid_cells[cell]
+        body.cells = None
@@ -14,6 +14,7 @@ import gc
 import platform
 from pygame.locals import *
 from framework.stage import Layer, ItemImage
+from timeit import default_timer
 import web
 
 # Factor used to scale the images in the screen. If we are in the XO it is adjusted
@@ -23,6 +24,34 @@ SCREEN_FACTOR = 1
 SCREEN_WIDTH = 600
 SCREEN_HEIGHT = 450
 
+# Indicate if the stages are rendered directly in the display when the images are
+# not scaled (SCREEN_FACTOR is 1), instead of using a buffer
+DIRECT_RENDER = False
+
+# Maximum number of frames per second (except with FramePacing.MAX_FPS)
+FRAME_RATE = 40
+
+# Maximum number of milliseconds that the main loop sleeps when the stage is idle
+# (with FramePacing.ADAPTIVE)
+IDLE_MAX_WAIT = 250
+
+# Milliseconds between the checks of new events while the main loop sleeps
+IDLE_POLL_INTERVAL = 10
+
+class FramePacing:
+    """
+    Policies to wait between the frames of the main loop.
+    """
+    # Run FRAME_RATE frames per second
+    FIXED = 0
+    
+    # Run FRAME_RATE frames per second, but sleep until the next timer or
+    # input event while the stage is idle (nothing changes on the screen)
+    ADAPTIVE = 1
+    
+    # Run the frames without waiting
+    MAX_FPS = 2
+
 class Game:
     """    
     Allows to run the game using the framework
@@ -69,6 +98,8 @@ class Game:
         # is used to scale the image using the SCREEN_FACTOR before drawing it
         # in the screen 
         self.window = pygame.Surface((600, 450), 0, self.display)
+        if engine.SCREEN_FACTOR == 1 and DIRECT_RENDER:
+            self.window = self.display
         
         if platform.system() == 'Windows':
             self.__set_icon("icon.gif")
@@ -89,6 +120,9 @@ class Game:
         self.__show_fps = False
         self.__clock = pygame.time.Clock()
         self.__frame_delay = 0    
+        self.__fixed_frame_delay = None
+        self.__frame_pacing = FramePacing.ADAPTIVE
+        self.__pacing_stats = {"frames": 0, "idle_frames": 0, "idle": 0.0, "busy": 0.0}
         self.__fps_max_width = 0
         self.__quit_game = 0        
         self.__font = assets.load_font('freesansbold.ttf', 13)
@@ -112,18 +146,96 @@ class Game:
                 
         # Main loop
         while not self.__quit_game:
+            self.run_frame()
+            
+    def run_frame(self):
+        """
+        Runs a single iteration of the main loop: waits for the next frame,
+        notifies the tick to the current stage and executes the pending web
+        events. It is invoked by run, but it can be used to drive the game
+        from outside (for example to run benchmarks).
+        """
+        stats = self.__pacing_stats
+        start = default_timer()
+        if self.__fixed_frame_delay != None:
+            self.__frame_delay = self.__fixed_frame_delay
+        elif self.__frame_pacing == FramePacing.MAX_FPS:
+            self.__frame_delay = self.__clock.tick()
+        else:
+            if self.__frame_pacing == FramePacing.ADAPTIVE and self.__wait_idle():
+                stats["idle_frames"] += 1
+
             # Make sure game doesn't run at more than 40 frames per second. This
             # avoid that the use of CPU goes up to 100%
-            self.__frame_delay = self.__clock.tick(40)
-                        
-            # Do operations per tick                
-            self.__stage.notify_tick()
-            
-            # execute web events
+            self.__frame_delay = self.__clock.tick(FRAME_RATE)
+        end = default_timer()
+        stats["idle"] += (end - start) * 1000
+                    
+        # Do operations per tick                
+        self.__stage.notify_tick()
+        
+        # execute web events
+        callback = web.get_callback()
+        while callback:
+            callback()
             callback = web.get_callback()
-            while callback:
-                callback()
-                callback = web.get_callback()
+
+        stats["busy"] += (default_timer() - end) * 1000
+        stats["frames"] += 1
+
+    def __wait_idle(self):
+        """
+        Sleeps while the stage is idle, until the next timer of the stage must be
+        invoked or an event is received (at most IDLE_MAX_WAIT milliseconds).
+        Returns True if the main loop slept.
+        """
+        frame_time = 1000 / FRAME_RATE
+        if self.__stage == None or self.__show_fps:
+            return False
+        delay = self.__stage.get_idle_delay(IDLE_MAX_WAIT)
+        if delay <= frame_time:
+            return False
+
+        # The clock waits the rest of the frame after the sleep
+        deadline = pygame.time.get_ticks() + delay - frame_time
+        while pygame.time.get_ticks() < deadline:
+            pygame.event.pump()
+            pending = pygame.event.peek()
+            if not isinstance(pending, bool):
+                # Old versions of pygame return the first event (NOEVENT if there are no events)
+                pending = pending.type != NOEVENT
+            if pending or web.has_callbacks():
+                break
+            pygame.time.wait(IDLE_POLL_INTERVAL)
+        return True
+
+    def get_frame_pacing(self):
+        """
+        Gets the policy used to wait between the frames (a value of FramePacing).
+        """
+        return self.__frame_pacing
+
+    def set_frame_pacing(self, frame_pacing):
+        """
+        Sets the policy used to wait between the frames.
+        - frame_pacing: A value of FramePacing.
+        """
+        self.__frame_pacing = frame_pacing
+
+    def get_pacing_stats(self):
+        """
+        Gets the statistics of the main loop as a dictionary with the number of
+        frames, the number of frames where the main loop slept because the stage
+        was idle (idle_frames), the milliseconds spent waiting between frames (idle)
+        and the milliseconds spent running the frames (busy).
+        """
+        return dict(self.__pacing_stats)
+
+    def reset_pacing_stats(self):
+        """
+        Resets the statistics of the main loop.
+        """
+        self.__pacing_stats = {"frames": 0, "idle_frames": 0, "idle": 0.0, "busy": 0.0}
                                                 
     def quit(self):
         """        
@@ -281,32 +393,65 @@ class Game:
         """
         return self.__frame_delay
     
+    def get_fixed_frame_delay(self):
+        """
+        Gets the fixed time used as the elapsed time between frames. None
+        if the frames are synchronized with the clock.
+        """
+        return self.__fixed_frame_delay
+    
+    def set_fixed_frame_delay(self, frame_delay):
+        """
+        Sets a fixed time used as the elapsed time between frames instead
+        of waiting the clock. This makes the execution repeatable and
+        it is intended for benchmarks.
+        - frame_delay: Time in milliseconds, or None to synchronize the
+          frames with the clock (the default behavior).
+        """
+        self.__fixed_frame_delay = frame_delay
+    
+    def get_stage(self):
+        """
+        Gets the current stage.
+        """
+        return self.__stage
+    
+    def is_running(self):
+        """
+        Gets a value that indicates if the main loop is running (quit was
+        not invoked).
+        """
+        return not self.__quit_game
+    
     def update_display(self, dirty_rects):
         """
         Update the specified areas in the screen from the window buffer.
         - dirty_rects: List of the rects that must be updated.
         """
-        # pygame.display.update(dirty_rects)
-        # return
-        if SCREEN_FACTOR == 2:            
-            dirty_rects2 = []
-            for r in dirty_rects:
-                r = self.window_rect.clip(r)
-                r2 = [x * 2 for x in r]                
-                s2 = pygame.transform.scale2x(self.window.subsurface(r))
-                self.display.blit(s2, r2)
-                dirty_rects2.append(r2)
-            pygame.display.update(dirty_rects2)
-        elif SCREEN_FACTOR == 1:
-            self.display.blit(self.window, (0, 0))
+        # The rects are scaled directly into the display surface, that is kept between
+        # frames, using the display as destination of the transforms to avoid creating
+        # new surfaces
+        if SCREEN_FACTOR == 1:
+            if self.window is not self.display:
+                display_blit = self.display.blit
+                window = self.window
+                for r in dirty_rects:
+                    display_blit(window, r, r)
             pygame.display.update(dirty_rects)
         else:
+            window = self.window
+            window_rect = self.window_rect
+            display_subsurface = self.display.subsurface
             dirty_rects2 = []
             for r in dirty_rects:
-                r = self.window_rect.clip(r)
-                r2 = [x * SCREEN_FACTOR for x in r]                
-                s2 = pygame.transform.scale(self.window.subsurface(r), r2[2:4])
-                self.display.blit(s2, r2)
+                r = window_rect.clip(r)
+                if r.width == 0 or r.height == 0:
+                    continue
+                r2 = Rect(r.left * SCREEN_FACTOR, r.top * SCREEN_FACTOR, r.width * SCREEN_FACTOR, r.height * SCREEN_FACTOR)
+                if SCREEN_FACTOR == 2:
+                    pygame.transform.scale2x(window.subsurface(r), display_subsurface(r2))
+                else:
+                    pygame.transform.scale(window.subsurface(r), r2.size, display_subsurface(r2))
                 dirty_rects2.append(r2)
             pygame.display.update(dirty_rects2)
             
@@ -347,6 +492,14 @@ class _ChangeStageDummy:
         self.__game = game
         self.__old_stage = old_stage
         self.__new_stage = new_stage
+
+    def get_idle_delay(self, max_delay):
+        """
+        Gets the number of milliseconds that the game can wait without rendering.
+        It is always 0, the stage is changed in the next tick.
+        - max_delay: Maximum delay returned.
+        """
+        return 0
         
     def notify_tick(self):
         """
@@ -386,6 +539,12 @@ class _ChangeStageDummy:
         if self.__game.loading_layer != None:
             self.__game.loading_layer.stage = None
         
+        # Release the assets used by the old stage (they are kept in the cache while
+        # there is memory available), the assets loaded from now are used by the new stage
+        if old_stage != None:
+            assets.release_assets(old_stage)
+        assets.set_assets_owner(self.__new_stage)
+
         # Run the garbage collector to release unreferenced objects. This code was added to avoid 
         # memory problems in the XO, because the garbage collector doesn't run as often as it should
         # and the application could run out of memory        
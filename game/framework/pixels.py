@@ -0,0 +1,245 @@
+# -*- coding: latin-1 -*-
+
+# 2011 - Direccin General Impositiva, Uruguay.
+# Todos los derechos reservados.
+# All rights reserved.
+
+import pygame
+import weakref
+from cache import LRUCache
+from pygame.locals import *
+
+# Difference between the alpha values kept by AlphaCache. The alpha values are rounded
+# to a multiple of this value
+ALPHA_CACHE_STEP = 16
+
+# Maximum number of bytes used by the copies of a surface with all the alpha values
+# (the copies of bigger surfaces are not kept by an AlphaCache)
+ALPHA_CACHE_MAX_BYTES = 2 * 1024 * 1024
+
+# Maximum number of bytes used by the copies kept by all the AlphaCache instances
+ALPHA_CACHE_TOTAL_MAX_BYTES = 6 * 1024 * 1024
+
+# Indicate if the blits can multiply the channels of the pixels (pygame 1.8.1 or newer)
+USE_BLEND_MULT = hasattr(pygame, "BLEND_RGBA_MULT")
+
+# Indicate if the alpha value of a surface is also applied in the blits of the surfaces
+# with per-pixel alpha (pygame 2 or newer)
+USE_SURFACE_ALPHA = pygame.version.vernum[0] >= 2
+
+# Minimum alpha value (exclusive) of a pixel to be considered part of an image in
+# the hit tests
+HIT_ALPHA_THRESHOLD = 40
+
+# Indicate if the hit tests use bit masks (pygame 1.8 or newer)
+USE_HIT_MASKS = hasattr(pygame, "mask")
+
+# Tables to multiply the alpha channel by an alpha value (used when the blits can't do it)
+__alpha_tables = {}
+
+# Hit masks of the surfaces shared by several images (removed with the surfaces)
+__shared_hit_masks = weakref.WeakKeyDictionary()
+
+# Copies with alpha values of the surfaces of all the AlphaCache instances, by
+# (key of the AlphaCache, alpha value)
+__alpha_copies = LRUCache(ALPHA_CACHE_TOTAL_MAX_BYTES)
+
+def multiply_alpha(surface, alpha):
+    """
+    Multiplies the alpha channel of a surface with per-pixel alpha by an alpha
+    value. The surface is modified.
+    - surface: Surface (32 bits).
+    - alpha: Alpha value (0 to 255).
+    """
+    if alpha >= 255 or surface.get_width() == 0 or surface.get_height() == 0:
+        return
+
+    if USE_BLEND_MULT:
+        surface.fill((255, 255, 255, max(0, alpha)), None, BLEND_RGBA_MULT)
+    else:
+        alpha_matrix = pygame.surfarray.pixels_alpha(surface)
+        alpha_matrix[:] = __get_alpha_table(alpha)[alpha_matrix]
+        del alpha_matrix
+
+def copy_alpha_channel(surface, source):
+    """
+    Sets the alpha channel of a surface with per-pixel alpha using the red
+    channel of other surface (usually a gray scale image).
+    - surface: Surface (32 bits) whose alpha channel is modified.
+    - source: Surface used as the alpha channel. It must be at least as big
+      as surface.
+    """
+    width, height = surface.get_size()
+    alpha_matrix = pygame.surfarray.pixels_alpha(surface)
+    alpha_matrix[:] = pygame.surfarray.array3d(source)[:width, :height, 0]
+    del alpha_matrix
+
+def and_alpha_channel(surface, pos, mask, area):
+    """
+    Applies the AND operator between the alpha channel of a surface and the
+    alpha channel of a mask. The surface is modified.
+    - surface: Surface (32 bits) whose alpha channel is modified.
+    - pos: Position (x, y) in surface where the area of the mask is applied.
+    - mask: Surface (32 bits) with the mask.
+    - area: Area of the mask that is applied (x, y, width, height).
+    """
+    x, y = pos
+    area_x, area_y, width, height = area
+    width = min(width, surface.get_width() - x, mask.get_width() - area_x)
+    height = min(height, surface.get_height() - y, mask.get_height() - area_y)
+    if width <= 0 or height <= 0:
+        return
+
+    alpha_matrix = pygame.surfarray.pixels_alpha(surface)
+    alpha_matrix_mask = pygame.surfarray.pixels_alpha(mask)
+    alpha_matrix[x:x + width, y:y + height] &= alpha_matrix_mask[area_x:area_x + width, area_y:area_y + height]
+    del alpha_matrix
+    del alpha_matrix_mask
+
+def get_surface_bytes(surface):
+    """
+    Returns the number of bytes used by the pixels of a surface.
+    - surface: Surface.
+    """
+    return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+def get_hit_mask(surface):
+    """
+    Returns a bit mask with the pixels of a surface whose alpha value is greater
+    than HIT_ALPHA_THRESHOLD, or None if the hit tests don't use masks or the
+    surface doesn't have per-pixel alpha.
+    - surface: Surface.
+    """
+    if not USE_HIT_MASKS or not (surface.get_flags() & SRCALPHA):
+        return None
+    return pygame.mask.from_surface(surface, HIT_ALPHA_THRESHOLD)
+
+def get_shared_hit_mask(surface):
+    """
+    Returns the hit mask of a surface like get_hit_mask, but the mask is kept
+    while the surface is alive, so the images that share a surface (like the
+    ones loaded from the same file) create it only once. The surface must not
+    be modified after the mask is created.
+    - surface: Surface.
+    """
+    try:
+        return __shared_hit_masks[surface]
+    except KeyError:
+        hit_mask = __shared_hit_masks[surface] = get_hit_mask(surface)
+        return hit_mask
+
+def get_alpha_copy(key, surface, alpha):
+    """
+    Gets a copy of a surface with an alpha value applied from the copies shared
+    by all the AlphaCache instances, and creates it if it isn't cached. The least
+    recently used copies are removed when ALPHA_CACHE_TOTAL_MAX_BYTES is exceeded.
+    - key: Key of the surface (it must not reference the surface, so the removed
+      surfaces are not kept by the cache).
+    - surface: Surface.
+    - alpha: Alpha value.
+    """
+    copy = __alpha_copies.get((key, alpha))
+    if copy == None:
+        copy = apply_alpha(surface, alpha)
+        __alpha_copies.put((key, alpha), copy, get_surface_bytes(copy))
+    return copy
+
+def get_alpha_cache_stats():
+    """
+    Gets the statistics of the copies with alpha values as a dictionary with the
+    hits, misses, evictions, count and size (bytes of the surfaces).
+    """
+    return __alpha_copies.get_stats()
+
+def reset_alpha_cache_stats():
+    """
+    Resets the counters of the statistics of the copies with alpha values.
+    """
+    __alpha_copies.reset_stats()
+
+def clear_alpha_cache():
+    """
+    Removes all the copies with alpha values.
+    """
+    __alpha_copies.clear()
+
+class AlphaCache:
+    """
+    Gets copies of a surface with different alpha values. It is used to
+    avoid calculating again the same surface in the fades. The alpha values
+    are rounded to multiples of ALPHA_CACHE_STEP, and if the surface is too
+    big to keep all the copies the surfaces are not cached (and the alpha
+    value is not rounded). The copies of all the instances are kept in the
+    same cache (see get_alpha_copy), so the memory used is limited even if
+    there are a lot of instances.
+    """
+
+    def __init__(self, surface, step = ALPHA_CACHE_STEP, max_bytes = ALPHA_CACHE_MAX_BYTES):
+        """
+        Constructor.
+        - surface: Source surface.
+        - step: Difference between the alpha values kept.
+        - max_bytes: Maximum number of bytes used by the copies with all the
+          alpha values.
+        """
+        self.surface = surface
+        self.__step = step
+
+        # Key of the copies in the shared cache. An object without references
+        # to the surface is used, so the copies of the instances that are
+        # removed don't keep the surface alive until they are evicted
+        self.__key = object()
+        levels = 255 / step + 1
+        size = get_surface_bytes(surface)
+        self.__enabled = size * levels <= max_bytes
+
+    def get(self, alpha):
+        """
+        Gets the surface with the alpha value applied. The returned surface must
+        not be modified.
+        - alpha: Alpha value.
+        """
+        if alpha >= 255:
+            return self.surface
+
+        if not self.__enabled:
+            return apply_alpha(self.surface, alpha)
+
+        alpha = round_alpha(alpha, self.__step)
+        if alpha >= 255:
+            return self.surface
+        return get_alpha_copy(self.__key, self.surface, alpha)
+
+def round_alpha(alpha, step = ALPHA_CACHE_STEP):
+    """
+    Rounds an alpha value to a multiple of step (255 is the maximum).
+    - alpha: Alpha value.
+    - step: Difference between the rounded values.
+    """
+    return min(255, int(alpha + step / 2) / step * step)
+
+def apply_alpha(surface, alpha):
+    """
+    Returns a copy of a surface with the alpha value applied.
+    - surface: Surface.
+    - alpha: Alpha value.
+    """
+    surface = surface.copy()
+    if surface.get_bitsize() < 32:
+        surface.set_alpha(alpha)
+    else:
+        multiply_alpha(surface, alpha)
+    return surface
+
+def __get_alpha_table(alpha):
+    """
+    Gets a table to multiply the values of the alpha channel by an alpha value.
+    - alpha: Alpha value.
+    """
+    if not alpha in __alpha_tables:
+        import numpy
+        table = numpy.arange(256, dtype = numpy.uint16)
+        table *= max(0, alpha)
+        table //= 255
+        __alpha_tables[alpha] = table.astype(numpy.uint8)
+    return __alpha_tables[alpha]
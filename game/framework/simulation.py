@@ -0,0 +1,129 @@
+# -*- coding: latin-1 -*-
+
+# 2011 - Direccin General Impositiva, Uruguay.
+# Todos los derechos reservados.
+# All rights reserved.
+
+import pygame
+
+# Maximum number of simulation steps executed in a frame. If the frame is later the
+# remaining time is discarded (the game is slowed down instead of running a burst of
+# steps that makes the next frame even later)
+MAX_STEPS_PER_FRAME = 5
+
+class FixedStepLoop:
+    """
+    Runs the simulation of a game (the physics of the objects) with a fixed time
+    step, independently of the frame rate. The elapsed time is accumulated in each
+    frame and the simulation runs as many steps as fit in it. After the steps a
+    function is invoked with the fraction of step that remains in the accumulator,
+    to interpolate the positions shown between the last two steps.
+
+    The stages that use a loop keep it in the attribute 'simulation', so the
+    benchmarks can report its statistics.
+    """
+
+    def __init__(self, stage, step, step_func, interpolate_func = None, max_steps = MAX_STEPS_PER_FRAME):
+        """
+        Constructor.
+        - stage: Stage whose timers run the loop.
+        - step: Duration of a step in milliseconds.
+        - step_func: Function invoked with the duration of the step (in milliseconds)
+          to advance the simulation.
+        - interpolate_func: Function invoked after the steps of a frame with the
+          fraction of step (0 to 1) elapsed since the last step. None if the positions
+          are not interpolated.
+        - max_steps: Maximum number of steps executed in a frame.
+        """
+        self.__stage = stage
+        self.__step = step
+        self.__step_func = step_func
+        self.__interpolate_func = interpolate_func
+        self.__max_steps = max_steps
+        self.__running = False
+        self.__last_tick = None
+        self.__accumulator = 0
+        self.reset_stats()
+
+    def start(self):
+        """
+        Starts the simulation. The first step is executed after a step of time.
+        """
+        self.__running = True
+        self.__last_tick = pygame.time.get_ticks()
+        self.__accumulator = 0
+
+        # The timer is invoked in each frame
+        self.__stage.start_timer(self, 1, self.__run_frame, None, True)
+
+    def stop(self):
+        """
+        Stops the simulation. It can be invoked from the step function, the
+        remaining steps of the frame are not executed.
+        """
+        self.__running = False
+        self.__stage.stop_timer(self)
+
+    def is_running(self):
+        """
+        Determines if the simulation is running.
+        """
+        return self.__running
+
+    def get_step(self):
+        """
+        Gets the duration of a step in milliseconds.
+        """
+        return self.__step
+
+    def get_stats(self):
+        """
+        Gets the statistics of the loop as a dictionary with the number of frames,
+        the number of steps, the maximum number of steps in a frame (max_steps), the
+        steps per frame and the milliseconds discarded because the frames were too
+        late (dropped).
+        """
+        stats = dict(self.__stats)
+        if stats["frames"] > 0:
+            stats["steps_per_frame"] = float(stats["steps"]) / stats["frames"]
+        else:
+            stats["steps_per_frame"] = 0.0
+        return stats
+
+    def reset_stats(self):
+        """
+        Resets the statistics of the loop.
+        """
+        self.__stats = {"frames": 0, "steps": 0, "max_steps": 0, "dropped": 0}
+
+    def __run_frame(self, key, data):
+        """
+        This function is invoked by a timer in each frame to run the steps of
+        the simulation.
+        - key: Timer's key.
+        - data: Timer's data.
+        """
+        now = pygame.time.get_ticks()
+        self.__accumulator += now - self.__last_tick
+        self.__last_tick = now
+
+        step = self.__step
+        steps = 0
+        while self.__running and self.__accumulator >= step and steps < self.__max_steps:
+            self.__step_func(step)
+            self.__accumulator -= step
+            steps += 1
+
+        if self.__accumulator >= step:
+            # Discard the time that can't be simulated in this frame
+            dropped = self.__accumulator - self.__accumulator % step
+            self.__accumulator -= dropped
+            self.__stats["dropped"] += dropped
+
+        stats = self.__stats
+        stats["frames"] += 1
+        stats["steps"] += steps
+        stats["max_steps"] = max(stats["max_steps"], steps)
+
+        if self.__running and self.__interpolate_func != None:
+            self.__interpolate_func(float(self.__accumulator) / step)
@@ -8,10 +8,15 @@ import assets
 import engine
 import gc
 import sounds
+import pixels
 import os
 import pygame
 import math
 import sys
+import heapq
+from cache import LRUCache
+from text import get_font_metrics
+from timeit import default_timer
 
 from pygame.locals import *
 
@@ -25,6 +30,41 @@ STREAM_MUSIC = False
 # Sets the maximum number of milliseconds between two clicks to treat it as a double click
 DBLCLICK_DELAY = 500
 
+# Maximum number of dirty rects drawn per frame. If there are more rects the nearest
+# rects are joined (drawing a bigger area)
+DIRTY_RECTS_MAX = 6
+
+# Maximum proportion of area drawn but not changed that is accepted to join two dirty rects
+# even if the number of rects is lower than DIRTY_RECTS_MAX
+DIRTY_RECTS_OVERDRAW = 0.25
+
+# Size of the cells used to find the dirty rects that intersect with a rect
+DIRTY_CELL_SIZE = 64
+
+# Size of the cells used to index the items of a layer by position
+ITEM_CELL_SIZE = 64
+
+# Maximum number of cells of an item in the index. Bigger items are always checked
+ITEM_GRID_MAX_CELLS = 48
+
+# Minimum number of items of a layer to use the index to draw and find items
+ITEM_GRID_MIN_ITEMS = 12
+
+# Maximum number of items of a layer of StageIso that are placed again one by one
+# when their positions change. If more items change the whole layer is sorted
+ISO_REINSERT_MAX_ITEMS = 16
+
+# Maximum number of bytes used by the surfaces of the rendered texts that are kept to
+# reuse them when the same text is rendered again (rollovers, repeated values)
+TEXT_CACHE_MAX_BYTES = 2 * 1024 * 1024
+
+# Characters of the glyph atlases used by default to compose the numbers of the
+# scores and timers
+GLYPH_ATLAS_CHARS = "0123456789+-:.,/% "
+
+# Maximum number of bytes used by the glyph atlases that are kept to share them
+GLYPH_ATLAS_CACHE_MAX_BYTES = 512 * 1024
+
 class Stage:
     """
     Base class to define a stage of a game.
@@ -38,6 +78,10 @@ class Stage:
         - target_surface: Surface where the stage is rendered. None if it is rendered over the screen.
         """
 
+        # The assets loaded from now (in the constructors of the stage and its subclasses)
+        # are used by this stage, so they are not released with the previous stage
+        assets.set_assets_owner(self)
+
         self.game = game
         self.layers = []
         self.initialized = False
@@ -61,8 +105,17 @@ class Stage:
             self.__load_background(background)
         self.__background_dirty = True
 
-        # Create the list to start timers in the stage
-        self.__timers = []
+        # Animator of the animations module, it is created with the first animation
+        self.animator = None
+
+        # Create the structures to start timers in the stage: a dictionary with the timers
+        # by key, and a heap with the timers ordered by the time of the next invocation
+        self.__timers = {}
+        self.__timers_heap = []
+        self.__timers_order = 0
+        self.__timers_pass = 0
+        self.__processing_timers = False
+        self.__timers_stats = None
 
         # Initialize the music
         self.__music = None
@@ -78,6 +131,10 @@ class Stage:
         self.__prerender_to_layer = None
         self.__prerender_buffer = None
 
+        # Set the limits used to join the dirty rects before draw them
+        self.__dirty_rects_max = DIRTY_RECTS_MAX
+        self.__dirty_rects_overdraw = DIRTY_RECTS_OVERDRAW
+
         # Set the layer to show an image as the mouse cursor. By default, is
         # not used
         self.__mouse_layer = None
@@ -85,6 +142,8 @@ class Stage:
         self.__mouse_snap_to_cursor = False
         self.__mouse_update = False
         self.__mouse_real_pos = None
+        self.__mouse_over_pos = None
+        self.__coalesced_events = 0
         self.__use_mouse_layer = False
         self.__mouse_pointer = (0, 0)
         self.__leftmousedown_handlers = []
@@ -131,6 +190,26 @@ class Stage:
                 self.__prerender_buffer = pygame.Surface((self.target_surface.get_width(), self.target_surface.get_height()))
         self.__update_prerender_buffer = True
 
+    def get_dirty_rects_limits(self):
+        """
+        Gets a tuple with the maximum number of dirty rects drawn per frame and
+        the proportion of area not changed accepted to join two rects. See
+        set_dirty_rects_limits for more information.
+        """
+        return self.__dirty_rects_max, self.__dirty_rects_overdraw
+
+    def set_dirty_rects_limits(self, max_rects = DIRTY_RECTS_MAX, overdraw = DIRTY_RECTS_OVERDRAW):
+        """
+        Sets the limits used to join the dirty rects before draw them. Less rects
+        reduce the number of blits per frame but can draw areas that didn't change.
+        - max_rects: Maximum number of dirty rects drawn per frame.
+        - overdraw: Maximum proportion of area not changed that is accepted to join
+          two rects when there are less than max_rects rects (0 to join them only
+          to respect max_rects).
+        """
+        self.__dirty_rects_max = max_rects
+        self.__dirty_rects_overdraw = overdraw
+
     def add_layer(self, layer, index = - 1):
         """
         Adds a layer to the stage.
@@ -406,7 +485,7 @@ class Stage:
                 while i >= 0:
                     layer = self.layers[i]
                     if layer.get_visible() and layer.is_inside_clip(x, y):
-                        for item in reversed(layer.items):
+                        for item in reversed(layer.get_items_at(x, y)):
                             if item.get_visible() and item.is_over(x, y):
                                 return item
                     i -= 1
@@ -418,7 +497,7 @@ class Stage:
                 while i >= 0:
                     layer = self.layers[i]
                     if layer.get_visible() and layer.is_inside_clip(x, y):
-                        for item in reversed(layer.items):
+                        for item in reversed(layer.get_items_at(x, y)):
                             if item.get_visible() and item.is_over(x, y):
                                 return item
                     if layer == dialog_layer:
@@ -454,7 +533,7 @@ class Stage:
         while i < l:
             layer = self.layers[i]
             if layer.get_visible() and layer.is_inside_clip(x, y):
-                for item in layer.items:
+                for item in layer.get_items_at(x, y):
                     if item.get_visible() and item.is_over(x, y):
                         stack.append(item)
             i += 1
@@ -708,18 +787,24 @@ class Stage:
 
         If there is a timer started with the same key stop the timer.
         """
-        # If the timer is already defined throw an exception
-        i = 0
-        while i < len(self.__timers):
-            if self.__timers[i].key == key:
-                # The timer is already defined. Stop the timer
-                self.stop_timer(key)                
-                break                
-            i += 1
+        # If the timer is already defined stop the timer
+        if key in self.__timers:
+            self.stop_timer(key)
 
         # Add the timer
         milliseconds = max(1, milliseconds)
-        self.__timers.append(Stage.TimerData(key, milliseconds, func, data, drop_ticks, render_first))
+        timer = Stage.TimerData(key, milliseconds, func, data, drop_ticks, render_first)
+        timer.order = self.__timers_order
+        self.__timers_order += 1
+        if render_first:
+            # The timer can't be invoked until the end of the next pass (or the current one
+            # if the timers are being processed)
+            if self.__processing_timers:
+                timer.wait_pass = self.__timers_pass
+            else:
+                timer.wait_pass = self.__timers_pass + 1
+        self.__timers[key] = timer
+        heapq.heappush(self.__timers_heap, (timer.tick, timer.order, timer))
 
     def stop_timer(self, key):
         """
@@ -728,49 +813,81 @@ class Stage:
 
         Return the timer data, or None if the timer is not active.
         """
-        i = 0
-        while i < len(self.__timers):
-            if self.__timers[i].key == key:
-                # Delete the timer
-                data = self.__timers[i].data
-                del self.__timers[i]
-                return data
-            i += 1
-
-        return None
+        # The timer remains in the heap, but it is ignored because it is not in the dictionary
+        timer = self.__timers.pop(key, None)
+        if timer == None:
+            return None
+        if len(self.__timers) == 0:
+            del self.__timers_heap[:]
+        return timer.data
 
     def stop_timers(self):
         """
         Stops all the timers defined in the stage.
         """
-        while len(self.__timers) > 0:
-            del self.__timers[len(self.__timers) - 1]
+        # The structures are cleared instead of replaced because the timers could
+        # be being processed
+        self.__timers.clear()
+        del self.__timers_heap[:]
 
     def is_timer_started(self, key):
         """
         Determines if a timer is enabled.
         - key: Key of the timer.
         """
-        i = 0
-        while i < len(self.__timers):
-            if self.__timers[i].key == key:
-                return True
-            i += 1
-
-        return False
+        return key in self.__timers
 
     def get_timer_data(self, key):
         """
         Get the data associated with the timer with the specified key.
         - key: Key.
         """
-        i = 0
-        while i < len(self.__timers):
-            if self.__timers[i].key == key:
-                return self.__timers[i].data
-            i += 1
+        timer = self.__timers.get(key)
+        if timer == None:
+            return None
+        return timer.data
 
-        return None
+    def get_timers_count(self):
+        """
+        Gets the number of timers started.
+        """
+        return len(self.__timers)
+
+    def set_timers_stats_enabled(self, enabled):
+        """
+        Sets if the stage collects statistics of the invocations of the timers. See
+        get_timers_stats.
+        - enabled: True to collect the statistics (the previous statistics are
+          removed), False to stop collecting them.
+        """
+        if enabled:
+            self.__timers_stats = {}
+        else:
+            self.__timers_stats = None
+
+    def get_timers_stats(self):
+        """
+        Gets the statistics of the invocations of the timers since they were enabled,
+        or None if they are not enabled. It is a dictionary where the values are
+        [number of invocations, milliseconds spent in the invocations], and the keys
+        are the keys of the timers. To avoid keeping references to the objects used in
+        the keys, the objects (not strings and numbers) are replaced by their class
+        name, so the timers of the same animation in different items are grouped (for
+        example, the key (item, "fade") is reported as "ItemImage.fade").
+        """
+        return self.__timers_stats
+
+    def __get_timer_stats_key(self, key):
+        """
+        Gets the key used in the statistics for a timer key.
+        - key: Timer key.
+        """
+        if isinstance(key, tuple):
+            return ".".join([str(self.__get_timer_stats_key(part)) for part in key])
+        elif isinstance(key, (str, unicode, int, long, float)):
+            return key
+        else:
+            return key.__class__.__name__
 
     def get_key_repeat(self):
         """
@@ -880,7 +997,7 @@ class Stage:
             event_handler = self.__dialogs[len(self.__dialogs) - 1][1]
 
         # Handle input events
-        for event in pygame.event.get():
+        for event in self.__coalesce_mouse_motion(pygame.event.get()):
             processed = False
             
             if event.type == MOUSEMOTION:
@@ -945,6 +1062,76 @@ class Stage:
     
     def handle_quit(self):
         return True
+
+    def get_idle_delay(self, max_delay):
+        """
+        Gets the number of milliseconds that the stage can wait without rendering
+        if no event is received: 0 if something must be updated on the screen,
+        otherwise the time until the next timer must be invoked.
+        - max_delay: Maximum delay returned.
+        """
+        if self.__mouse_update or self.__background_dirty or self.__update_prerender_buffer:
+            return 0
+        if pygame.mouse.get_pos() != self.__mouse_real_pos:
+            return 0
+
+        layers = self.layers + [self.__mouse_layer]
+        if self.target_surface == None:
+            layers.append(self.game.loading_layer)
+        for layer in layers:
+            if layer != None and layer.is_dirty():
+                return 0
+
+        delay = max_delay
+        if len(self.__timers) > 0 and len(self.__timers_heap) > 0:
+            delay = min(delay, self.__timers_heap[0][0] - pygame.time.get_ticks())
+        return max(0, delay)
+
+    def get_coalesced_events_count(self):
+        """
+        Gets the number of mouse motion events that were joined with the previous
+        motion event since the stage was created.
+        """
+        return self.__coalesced_events
+
+    def __coalesce_mouse_motion(self, events):
+        """
+        Joins the consecutive mouse motion events of a list of events, so the
+        motion is processed only once per frame. The joined event has the last
+        position, the sum of the relative motions and the buttons pressed in
+        any of the events. The order with the other events is kept.
+        - events: List of events.
+        """
+        coalesced = []
+        count = 0
+        for event in events + [None]:
+            if event != None and event.type == MOUSEMOTION and count > 0:
+                # Accumulate the motion in the current sequence
+                last = event
+                rel_x += event.rel[0]
+                rel_y += event.rel[1]
+                buttons = [buttons[i] | event.buttons[i] for i in xrange(len(buttons))]
+                count += 1
+                continue
+
+            if count > 1:
+                # Replace the first event of the sequence with the joined event
+                coalesced[-1] = pygame.event.Event(MOUSEMOTION, {'pos': last.pos, 'rel': (rel_x, rel_y),
+                                                                 'buttons': tuple(buttons)})
+                self.__coalesced_events += count - 1
+
+            if event == None:
+                break
+            coalesced.append(event)
+            if event.type == MOUSEMOTION:
+                # Start a new sequence of motion events
+                rel_x, rel_y = event.rel
+                buttons = event.buttons
+                count = 1
+            else:
+                count = 0
+
+        return coalesced
     
     def __on_mouse_move(self, x, y, buttons, rel_x, rel_y):
         """
@@ -970,12 +1157,16 @@ class Stage:
 
         # Check if the mouse is over an object to fire MOUSE_ENTER and MOUSE_LEAVE
         # event
-        event = pygame.event.Event(MOUSEMOTION,
-                            {'pos' : (int(x / engine.SCREEN_FACTOR), int(y / engine.SCREEN_FACTOR)),
-                             'rel' : (int(rel_x / engine.SCREEN_FACTOR), int(rel_y / engine.SCREEN_FACTOR)),
-                             'buttons' : buttons})
-
-        x, y = event.pos
+        x = int(x / engine.SCREEN_FACTOR)
+        y = int(y / engine.SCREEN_FACTOR)
+
+        # The render doesn't update the item below the mouse again if the mouse
+        # is not moved and nothing requests a mouse update (only the cursor is moved).
+        # The flag is cleared before the update, so the updates requested by the
+        # MOUSE_ENTER and MOUSE_LEAVE handlers are not lost
+        self.__mouse_over_pos = (x, y)
+        self.__mouse_update = False
+        self.__mouse_real_pos = None
         item_stack = self.__update_over_item(x, y)
 
         # Fire MOUSE_MOVE event in the first item that handle it
@@ -983,9 +1174,7 @@ class Stage:
 
         # If there are handlers capturing the left mouse down invoke
         # the handlers
-        if event.buttons[0] == 1 and len(self.__leftmousedown_handlers) > 0:
-            x = event.pos[0]
-            y = event.pos[1]
+        if buttons[0] == 1 and len(self.__leftmousedown_handlers) > 0:
             args = ItemEventArgsMouse(x, y)
             for handler_data in self.__leftmousedown_handlers:
                 handler_data[1](args, False)
@@ -1293,47 +1482,22 @@ class Stage:
         # Update the mouse (if necessary)
         pos = pygame.mouse.get_pos()
         if pos != self.__mouse_real_pos or self.__mouse_update:
-            self.__mouse_real_pos = pos
-            self.__mouse_update = False
-
             x = int(pos[0] / engine.SCREEN_FACTOR)
             y = int(pos[1] / engine.SCREEN_FACTOR)
+            update_over_item = self.__mouse_update or self.__mouse_over_pos != (x, y)
 
-            self.__update_over_item(x, y)
+            self.__mouse_real_pos = pos
+            self.__mouse_update = False
+
+            if update_over_item:
+                self.__update_over_item(x, y)
             if self.__mouse_cursor != None:
                 self.__update_mouse_cursor_position(x, y)
+        self.__mouse_over_pos = None
 
         # Invoke the functions associated with the timers
-        timers = self.__timers
-        if len(timers) > 0:
-            ticks = pygame.time.get_ticks()
-            i = 0
-            while i < len(timers):
-                timer = timers[i]                
-
-                if timer.render_first:
-                    # The timer is invoked after perform this full render
-                    timer.render_first = False
-                else:                    
-                    while ticks >= timer.tick:                                                            
-                        # Invoke the function associated with the timer                        
-                        timer.func(timer.key, timer.data)
-
-                        # Check if the timer is still defined because it could
-                        # be stopped during previous invocation
-                        if not timer in timers:
-                            i -= 1
-                            break
-
-                        if timer.drop_ticks:
-                            while ticks >= timer.tick:
-                                timer.tick += timer.milliseconds
-                            break;
-                        else:
-                            # Increment the timer
-                            timer.tick += timer.milliseconds
-
-                i += 1
+        if len(self.__timers) > 0:
+            self.__process_timers()
 
         # Get the target surface where the stage is rendered
         target_surface = self.target_surface
@@ -1345,38 +1509,39 @@ class Stage:
 
         # Update the items and calculate the rects that must by
         # updated (the dirty rects)
-        dirty_rects = []
-        prerender_dirty_rects = []
+        dirty_region = DirtyRegion(self.__dirty_rects_max, self.__dirty_rects_overdraw)
+        prerender_region = DirtyRegion(self.__dirty_rects_max, self.__dirty_rects_overdraw)
         prerender = (self.__prerender_to_layer != None)
         for l in self.layers:
             if prerender:
-                l.update(prerender_dirty_rects, frame_delay)
+                l.update(prerender_region, frame_delay)
                 prerender = (self.__prerender_to_layer != l)
-
-                if len(prerender_dirty_rects) > 6:
-                    self.__compact_dirty_rects(prerender_dirty_rects)
             else:
-                l.update(dirty_rects, frame_delay)
-                if len(prerender_dirty_rects) > 6:
-                    self.__compact_dirty_rects(dirty_rects)
+                l.update(dirty_region, frame_delay)
         if self.target_surface != None:
             loading_layer = None
         else:
             loading_layer = self.game.loading_layer
             if loading_layer != None:             
-                loading_layer.update(dirty_rects, frame_delay)                                
+                loading_layer.update(dirty_region, frame_delay)                                
         if self.__mouse_layer != None:
-            self.__mouse_layer.update(dirty_rects, frame_delay)
+            self.__mouse_layer.update(dirty_region, frame_delay)
 
         # Check if must update the background
         if self.__background_dirty:
             if self.__prerender_to_layer != None:
-                prerender_dirty_rects = [target_surface.get_rect()]
-                dirty_rects = []
+                prerender_region.clear()
+                prerender_region.add(target_surface.get_rect())
+                dirty_region.clear()
             else:
-                dirty_rects = [target_surface.get_rect()]
+                dirty_region.clear()
+                dirty_region.add(target_surface.get_rect())
             self.__background_dirty = False
 
+        # Get the rects that must be drawn
+        dirty_rects = dirty_region.get_rects()
+        prerender_dirty_rects = prerender_region.get_rects()
+
         # Check if some layers are prerendered
         prerender = (self.__prerender_to_layer != None)
         if prerender:
@@ -1402,12 +1567,8 @@ class Stage:
                     l.draw(self.__prerender_buffer, prerender_rects)
                 if self.__prerender_to_layer == l:
                     for prerender_dirty_rect in prerender_dirty_rects:
-                        k = prerender_dirty_rect.collidelist(dirty_rects)
-                        while k != - 1:
-                            prerender_dirty_rect.union_ip(dirty_rects[k])
-                            del dirty_rects[k]
-                            k = prerender_dirty_rect.collidelist(dirty_rects)
-                        dirty_rects.append(prerender_dirty_rect)
+                        dirty_region.add(prerender_dirty_rect)
+                    dirty_rects = dirty_region.get_rects()
                     if len(dirty_rects) > 0:
                         self.__draw_prerender_buffer(target_surface, dirty_rects)
                     prerender = False
@@ -1428,22 +1589,76 @@ class Stage:
             # Update the screen
             self.game.update_display(dirty_rects)
 
-    def __compact_dirty_rects(self, dirty_rects):
+    def __process_timers(self):
         """
-        Reduce the list of dirty rects, to avoid to have a large list
-        that could affect the performance in drawing partial items.
-        - dirty_rects: Dirty rects.
+        Invokes the functions of the timers that reached their time. All the timers
+        are processed with the same time, in the order of their next invocation (and
+        in the order they were started if they have the same time).
         """
-        while len(dirty_rects) > 6:
-            dirty_rect = dirty_rects[0]
-            dirty_rect.union_ip(dirty_rects[1])
-            del dirty_rects[0:1]
-            k = dirty_rect.collidelist(dirty_rects)
-            while k != - 1:
-                dirty_rect.union_ip(dirty_rects[k])
-                del dirty_rects[k]
-                k = dirty_rect.collidelist(dirty_rects)
-            dirty_rects.append(dirty_rect)
+        timers = self.__timers
+        heap = self.__timers_heap
+        stats = self.__timers_stats
+        ticks = pygame.time.get_ticks()
+        self.__timers_pass += 1
+        timers_pass = self.__timers_pass
+        processing_timers = self.__processing_timers
+        self.__processing_timers = True
+        delayed = []
+        try:
+            while len(heap) > 0 and heap[0][0] <= ticks:
+                tick, order, timer = heapq.heappop(heap)
+                if timers.get(timer.key) is not timer or timer.tick != tick:
+                    # The timer was stopped
+                    continue
+
+                if timer.wait_pass != None:
+                    if timer.wait_pass >= timers_pass:
+                        # The timer is invoked after perform a full render
+                        delayed.append(timer)
+                        continue
+                    timer.wait_pass = None
+
+                # Invoke the function associated with the timer
+                if stats == None:
+                    timer.func(timer.key, timer.data)
+                else:
+                    start = default_timer()
+                    timer.func(timer.key, timer.data)
+                    self.__add_timer_stats(timer.key, default_timer() - start)
+
+                # Check if the timer is still defined because it could
+                # be stopped during previous invocation
+                if timers.get(timer.key) is not timer:
+                    continue
+
+                # Increment the timer. If the ticks are not dropped and the timer is
+                # late it is invoked again in this pass
+                timer.tick += timer.milliseconds
+                if timer.drop_ticks:
+                    while ticks >= timer.tick:
+                        timer.tick += timer.milliseconds
+                heapq.heappush(heap, (timer.tick, timer.order, timer))
+        finally:
+            self.__processing_timers = processing_timers
+            for timer in delayed:
+                heapq.heappush(heap, (timer.tick, timer.order, timer))
+
+    def __add_timer_stats(self, key, elapsed):
+        """
+        Adds an invocation of a timer in the statistics.
+        - key: Timer key.
+        - elapsed: Seconds spent in the invocation.
+        """
+        stats = self.__timers_stats
+        if stats == None:
+            return
+        stats_key = self.__get_timer_stats_key(key)
+        if stats_key in stats:
+            entry = stats[stats_key]
+            entry[0] += 1
+            entry[1] += elapsed * 1000
+        else:
+            stats[stats_key] = [1, elapsed * 1000]
 
     def __draw_prerender_buffer(self, target_surface, dirty_rects):
         """
@@ -1570,6 +1785,8 @@ class Stage:
             self.data = data
             self.drop_ticks = drop_ticks
             self.render_first = render_first
+            self.wait_pass = None
+            self.order = 0
 
 class StageIso(Stage):
     """
@@ -1597,6 +1814,7 @@ class StageIso(Stage):
         self.__image_suffix = ""
         self.__tags = tags
         self.__adjust_positions = None
+        self.__positions_stats = {"sorts": 0, "reinserted": 0, "time": 0.0}
 
 
     def add_layer(self, layer, index= - 1):
@@ -1659,7 +1877,7 @@ class StageIso(Stage):
             row_to = row_from + size[0] - 1
             col_to = col_from + size[1] - 1
             items = layer.items
-            k = layer.items.index(item)
+            k = layer.index_of(item)
             l = len(items)
             k += 1
             while k < l:
@@ -2063,12 +2281,7 @@ class StageIso(Stage):
         - position: Position.
         - type: type.
         """
-        for item in layer.items:
-            if isinstance(item, ItemCell):
-                if (item.get_type() == type) and (item.get_position() == position):
-                    return item
-
-        return None
+        return layer.find_cell_item(type, position)
 
     def render(self):
         """
@@ -2089,96 +2302,107 @@ class StageIso(Stage):
         - item: Item that changed. None to update all items.
         """
         if self.__adjust_positions == None:
-            self.__adjust_positions = []
-        add_item = True
-        l = len(self.__adjust_positions)
+            self.__adjust_positions = {}
+        adjust_positions = self.__adjust_positions
 
         if item == None:
-            # If there is already an item of the layer marked to update remove the
-            # item because all the items must be updates
-            k = l - 1
-            while k >= 0:
-                adj_pos = self.__adjust_positions[k]
-                if adj_pos[0] == layer:
-                    if adj_pos[1] == None:
-                        add_item = False
-                    else:
-                        del self.__adjust_positions[k]
-                k -= 1
-        else:
-            if not isinstance(item, ItemCell):
-                add_item = False
+            # All the items of the layer must be updated
+            adjust_positions[layer] = None
+        elif isinstance(item, ItemCell):
+            if not layer in adjust_positions:
+                adjust_positions[layer] = [item]
             else:
-                # Check if the item is already defined to update, or the layer
-                # is marked to update all items in it
-                k = 0
-                while k < l:
-                    adj_pos = self.__adjust_positions[k]
-                    if adj_pos[0] == layer:
-                        if adj_pos[1] == None:
-                            add_item = False
-                        elif adj_pos[1] == item:
-                            add_item = False
-                        else:
-                            # There is already other item of the layer,
-                            # mark to update all the items, because if
-                            # too much items are marked to update the
-                            # algorithm is very slow
-                            del self.__adjust_positions[k]
-                            self.__adjust_positions.append((layer, None))
-                            add_item = False
-                        break
-                    k += 1
-        if add_item:
-            self.__adjust_positions.append((layer, item))
+                items = adjust_positions[layer]
+                if items != None and not item in items:
+                    if len(items) < ISO_REINSERT_MAX_ITEMS:
+                        items.append(item)
+                    else:
+                        # Too much items changed, it is faster to sort all the items
+                        adjust_positions[layer] = None
+
+    def get_positions_stats(self):
+        """
+        Gets the statistics of the updates of the items order as a dictionary with
+        the number of layers sorted completely (sorts), the number of items placed
+        again one by one (reinserted) and the time spent in milliseconds (time).
+        """
+        return dict(self.__positions_stats)
 
     def __update_positions(self):
         """
         Update the items positions that are marked to update.
         """
         if self.__adjust_positions != None:
-            compare_func = self.__compare
-
-            for adj_pos in self.__adjust_positions:
-                layer = adj_pos[0]
-                item = adj_pos[1]
+            start = default_timer()
+            stats = self.__positions_stats
 
+            for layer, changed_items in self.__adjust_positions.iteritems():
                 items = layer.items
-                self.__several_rows_items = layer._Layer__several_rows_items
-                self.__compare_items = items[:]
-                if item != None:
-                    if item in items:
-                        items.remove(item)
-                        self.__add_item_in_order(items, item)
+                order = IsoDepthOrder(items, layer._Layer__several_rows_items)
+                if changed_items == None or len(changed_items) * 4 > len(items):
+                    items.sort(order.compare)
+                    stats["sorts"] += 1
                 else:
-                    items.sort(compare_func)
+                    for item in changed_items:
+                        if item in items:
+                            items.remove(item)
+                            order.insert(items, item)
+                            stats["reinserted"] += 1
+                layer.mark_items_order_changed()
 
             # Clear the list of pending adjusts
             self.__adjust_positions = None
-            self.__several_rows_items = None
-            self.__compare_items = None
+            stats["time"] += (default_timer() - start) * 1000.0
 
-    def __add_item_in_order(self, items, item):
+class IsoDepthOrder:
+    """
+    Determines the order in which the items of a layer of an isometric stage are
+    drawn. The position, size and z-index of the items are read once, and the
+    items with several rows are indexed by the rows that they cover, so each
+    comparison only checks the big items of the row of the first item.
+    """
+
+    def __init__(self, items, several_rows_items):
+        """
+        Constructor.
+        - items: Items of the layer.
+        - several_rows_items: List with (item, first row, last row, column) of the
+          items with several rows of the layer.
+        """
+        self.__cells = {}
+        self.__indexes = {}
+        for k, item in enumerate(items):
+            if isinstance(item, ItemCell):
+                row, col = item.get_position()
+                rows, cols = item.get_definition().size
+                self.__cells[item] = (row, col, row + rows - 1, col + cols - 1, item.get_z_index())
+            else:
+                self.__indexes[item] = k
+
+        self.__big_items = {}
+        for big_item, row_from, row_to, col_from in several_rows_items:
+            for row in xrange(int(math.floor(row_from)), int(math.floor(row_to)) + 1):
+                self.__big_items.setdefault(row, []).append((row_from, row_to, col_from))
+
+    def insert(self, items, item):
         """
         Add the specified item in order in the correct position according with its row and column.
         - items: List of items.
         - item: Item.
         """
+        cells = self.__cells
+        compare = self.compare
         k = 0
         l = len(items)
-        added = False
         while k < l:
             itemk = items[k]
-            if isinstance(itemk, ItemCell) and self.__compare(item, items[k]) < 0:
+            if itemk in cells and compare(item, itemk) < 0:
                 items.insert(k, item)
-                added = True
-                break
-            else:
-                k += 1
-        if not added:
-            items.append(item)
+                return
+            k += 1
+        items.append(item)
 
-    def __compare(self, item1, item2):
+    def compare(self, item1, item2):
         """
         Determines if item1 must be placed before item2.
         - item1: Item 1.
@@ -2187,43 +2411,43 @@ class StageIso(Stage):
         Returns a negative number if item1 < item2, 0 if item1 == item2 or
         a positive number if item1 > item2
         """
-        if not isinstance(item1, ItemCell):
-            if not isinstance(item2, ItemCell):
-                return self.__compare_items.index(item1) - self.__compare_items.index(item2)
+        cells = self.__cells
+        cell1 = cells.get(item1)
+        cell2 = cells.get(item2)
+        if cell1 == None:
+            if cell2 == None:
+                return self.__indexes[item1] - self.__indexes[item2]
             else:
                 return -1
-        if not isinstance(item2, ItemCell):
+        if cell2 == None:
             return 1
 
-        row1, col1 = item1.get_position()
-        row2, col2 = item2.get_position()
+        row1, col1, row_to1, col_to1, z_index1 = cell1
+        row2, col2, row_to2, col_to2, z_index2 = cell2
 
         # Check if there is an item with more than one row in the middle of the two items
-        for big_item in self.__several_rows_items:
-            b_row_from = big_item[1]
-            b_row_to = big_item[2]
-            b_col_from = big_item[3]
-            if b_row_from <= row1 and row1 <= b_row_to and \
-               b_row_from <= row2 and row2 <= b_row_to:
-                if col1 < b_col_from and col2 >= b_col_from:
-                    return -1
-                elif col2 < b_col_from and col1 >= b_col_from:
-                    return 1
-
-        size1 = item1.get_definition().size
-        if row1 + size1[0] - 1 < row2:
+        big_items = self.__big_items.get(int(math.floor(row1)))
+        if big_items != None:
+            for b_row_from, b_row_to, b_col_from in big_items:
+                if b_row_from <= row1 and row1 <= b_row_to and \
+                   b_row_from <= row2 and row2 <= b_row_to:
+                    if col1 < b_col_from and col2 >= b_col_from:
+                        return -1
+                    elif col2 < b_col_from and col1 >= b_col_from:
+                        return 1
+
+        if row_to1 < row2:
             return -1
-        size2 = item2.get_definition().size
-        if row1 > row2 + size2[0] - 1:
+        if row1 > row_to2:
             return 1
         else:
-            if col1 + size1[1] - 1 < col2:
+            if col_to1 < col2:
                 return -1
-            if col1 > col2 + size2[1] - 1:
+            if col1 > col_to2:
                 return 1
 
         # The items are overlapped
-        return item1.get_z_index() - item2.get_z_index()
+        return z_index1 - z_index2
 
 class IsoDefinition:
     """
@@ -2542,6 +2766,8 @@ class Item:
         # Move the drawing rectangle to the new position
         old_rect = self.rect
         self.rect = Rect(real_left, real_top, real_width, real_height)
+        if self.__layer != None and self.rect != old_rect:
+            self.__layer.index_item(self)
 
         # Marks the rectangle that must be redrawn
         if old_rect == None:
@@ -2648,7 +2874,7 @@ class Item:
             if layer != None:
                 # Only show the rollover if there isn't a fade over the item
                 stage = layer.get_stage()
-                if stage != None and not stage.is_timer_started((self, "fade")):
+                if stage != None and (stage.animator == None or not stage.animator.is_running((self, "fade"))):
                     item_image = self.__update_rollover_position()
                     layer.add(item_image, layer.index_of(self))
 
@@ -2857,6 +3083,8 @@ class ItemImage(Item):
 
         # Set the image
         self.__alpha = 255
+        self.__alpha_cache = None
+        self.__clip_image = None
         self.__hit_over_transparent = hit_over_transparent
         self.set_image(image, area)
         
@@ -2869,6 +3097,8 @@ class ItemImage(Item):
             self.__pressed = None
         self.__source_surface = None
         self.__surface_noclip = None
+        self.__alpha_cache = None
+        self.__clip_image = None
         self.surface = None
         
     def get_alpha(self):
@@ -2885,9 +3115,19 @@ class ItemImage(Item):
         - alpha: Alpha value.
         """
         self.__alpha = alpha
-        self.surface = set_surface_alpha(self.__source_surface, alpha)
+        self.surface = self.__get_alpha_surface()
         self.set_dirty()
 
+    def __get_alpha_surface(self):
+        """
+        Gets the source surface with the alpha value of the item applied. The
+        surfaces are cached to reuse them in fades.
+        """
+        alpha_cache = self.__alpha_cache
+        if alpha_cache == None or alpha_cache.surface is not self.__source_surface:
+            alpha_cache = self.__alpha_cache = pixels.AlphaCache(self.__source_surface)
+        return alpha_cache.get(self.__alpha)
+
     def is_over(self, x, y):
         """
         Determines if the specified point is contained in the item.
@@ -2900,14 +3140,27 @@ class ItemImage(Item):
                 return True
 
             # The coordinate is over the image rectangle, check if it is not
-            # over a transparent pixel. Get the pixel RGBA
+            # over a transparent pixel
+            x = int(x - self.get_left())
+            y = int(y - self.get_top())
+            if self.__alpha == 255 and self.__image != None:
+                # Use the bit mask of the image (or the image with the clip mask applied)
+                if self.surface is self.__image.surface:
+                    return self.__image.is_over(x, y)
+                if self.surface is self.__source_surface:
+                    clip_image = self.__clip_image
+                    if clip_image == None or clip_image.surface is not self.__source_surface:
+                        clip_image = self.__clip_image = assets.Image(self.__source_surface)
+                    return clip_image.is_over(x, y)
+
+            # Get the pixel RGBA
             try:
-                c = self.surface.get_at((int(x - self.get_left()), int(y - self.get_top())))
+                c = self.surface.get_at((x, y))
             except Exception:
                 return False
 
             # Check the value of the alpha component
-            if c[3] > 40:
+            if c[3] > pixels.HIT_ALPHA_THRESHOLD:
                 return True;
         return False;
 
@@ -2941,6 +3194,9 @@ class ItemImage(Item):
           in this image.
         """
 
+        # The mask used in the hit tests is created again with the new surface
+        self.__clip_image = None
+
         if image_mask == None:
             self.__source_surface = self.__surface_noclip
             if self.surface != self.__surface_noclip:
@@ -2967,10 +3223,7 @@ class ItemImage(Item):
 
             # Copy the alpha channel of 'image_mask' in this image
             self.surface = self.__source_surface.copy()
-            alpha_matrix = pygame.surfarray.pixels_alpha(self.surface)
-            alpha_matrix_mask = pygame.surfarray.pixels_alpha(image_mask.surface)
-            for i in xrange(area_width):
-                alpha_matrix[x + i][y:y + area_height] &= alpha_matrix_mask[area_x + i][area_y : area_y + area_height]
+            pixels.and_alpha_channel(self.surface, (x, y), image_mask.surface, (area_x, area_y, area_width, area_height))
 
             # Copy the surface to the source surface, because when alpha is
             # modified the source surface is used to calculate the final surface with the alpha value
@@ -3048,7 +3301,7 @@ class ItemImage(Item):
             self.area = area
 
             if self.__alpha != 255:
-                self.surface = set_surface_alpha(self.__source_surface, self.__alpha)
+                self.surface = self.__get_alpha_surface()
 
             self.set_dirty()
 
@@ -3347,6 +3600,7 @@ class ItemCell(ItemImage):
         if z_index != - 1:
             self.__z_index = z_index
         if layer != None:
+            layer.index_cell_item(self)
             stage = layer.get_stage()
             if old_rows > 1:
                 layer = self.get_layer()
@@ -3517,7 +3771,7 @@ class ItemCell(ItemImage):
                 stage = layer.get_stage()
                 if stage != None:
                     for layer in stage.layers:
-                        item = self.__collide_test_layer(row, col, self.__layer)
+                        item = self.__collide_test_layer(row, col, layer)
                         if item != None:
                             return item
 
@@ -3551,8 +3805,8 @@ class ItemCell(ItemImage):
         - layer: Layer where the collision is tested.
         """
         size = self.__definition.size
-        for item in layer.items:
-            if isinstance(item, ItemCell) and (item != self):
+        for item in layer.get_cell_items(row, col, size[0], size[1]):
+            if item != self:
                 item_pos = item.get_position()
                 if item_pos != None:
                     if (item_pos[0] < row + size[0]) and \
@@ -3734,6 +3988,7 @@ class ItemText(Item):
         self.__rollover_color = None
         self.__edit_mode = None
         self.__max_chars = -1
+        self.__rendered = None
         
         # Initialize base class
         Item.__init__(self, left, top, 0, 0)
@@ -3782,7 +4037,8 @@ class ItemText(Item):
         - alpha: Alpha value.
         """
         self.__alpha = alpha
-        self.__text_surface = set_surface_alpha(self.__source_surface, alpha)
+        if self.__text_surface != None:
+            self.__text_surface = self.__rendered.get_surface(alpha)
         self.set_dirty()
 
     def get_color(self):
@@ -3889,6 +4145,20 @@ class ItemText(Item):
             self.__text = text
             self.__update_text()
 
+    def create_layout(self, text):
+        """
+        Creates a TextLayout to show a text that can be longer than this
+        ItemText in pages of the size of this ItemText, rendered with its font
+        and color.
+        - text: Text.
+        """
+        width = self.__width
+        if width != -1 and self.__edit_mode != None:
+            # Reserve some space to add the cursor at the end of the text
+            width -= 2
+        return TextLayout(text, self.__font, self.__additional_fonts, self.__line_height,
+                          width, self.__height, self.__color)
+
     def break_text_into(self, item_text):
         """
         Sets an ItemText to set the text that doesn't fit inside this ItemText. After invoke this
@@ -4153,12 +4423,14 @@ class ItemText(Item):
                     if focus_data[1]:
                         cursor_index = focus_data[0]                                        
                 
-        text_surface, text_fit, lines = render_text(self.__text, self.__font, self.__additional_fonts, self.__line_height,
-                                   self.__width, self.__height, True, self.__color, self.__background,
-                                   self.__h_align, self.__break_text_into, cursor_index, editable)
-        self.lines = lines
-        self.__text_surface = text_surface
-        self.__source_surface = text_surface
+        rendered = get_rendered_text(self.__text, self.__font, self.__additional_fonts, self.__line_height,
+                                     self.__width, self.__height, True, self.__color, self.__background,
+                                     self.__h_align, self.__break_text_into, cursor_index, editable)
+        self.__rendered = rendered
+        self.lines = rendered.line_widths
+        text_fit = rendered.text_fit
+        text_surface = rendered.surface
+        self.__text_surface = rendered.get_surface(self.__alpha)
 
         text_width = text_surface.get_width()
         text_height = text_surface.get_height()
@@ -4188,8 +4460,6 @@ class ItemText(Item):
             elif self.__v_align == 3:
                 # Align the text to the bottom
                 self.__dy = self.__height - text_height
-        if self.__alpha != 255:
-            self.__text_surface = set_surface_alpha(self.__source_surface, self.__alpha)
                     
         return text_fit
 
@@ -4241,6 +4511,262 @@ class ItemText(Item):
             focus_data[1] = not focus_data[1]
             self.__update_text()            
 
+class GlyphAtlas:
+    """
+    Surface with the glyphs of a set of characters rendered once with a font
+    and a color. The texts with these characters are composed copying the
+    areas of the glyphs, without rendering them with the font (the kerning
+    between the characters is not applied). It is used for the texts that
+    change frequently, like scores and timers.
+    """
+
+    def __init__(self, font, color, chars = GLYPH_ATLAS_CHARS, antialias = True):
+        """
+        Constructor.
+        - font: Font.
+        - color: Color of the glyphs.
+        - chars: Characters rendered in the atlas.
+        - antialias: Indicates if the glyphs are rendered using antialiasing.
+        """
+        glyphs = [(char, font.render(char, antialias, color)) for char in chars]
+        width = max(1, sum([glyph.get_width() for char, glyph in glyphs]))
+        height = max([font.get_height()] + [glyph.get_height() for char, glyph in glyphs])
+        surface = pygame.Surface((width, height), pygame.SRCALPHA, 32)
+        surface.fill((0, 0, 0, 0))
+        areas = {}
+        x = 0
+        for char, glyph in glyphs:
+            # Copy the pixels (with their alpha values) instead of blend them
+            glyph.set_alpha(None)
+            surface.blit(glyph, (x, 0))
+            areas[char] = (x, 0, glyph.get_width(), glyph.get_height())
+            x += glyph.get_width()
+
+        # The glyphs are also copied to the texts composed with them
+        surface.set_alpha(None)
+        self.surface = surface
+        self.__areas = areas
+
+    def can_draw(self, text):
+        """
+        Determines if all the characters of a text are in the atlas.
+        - text: Text.
+        """
+        areas = self.__areas
+        for char in text:
+            if not char in areas:
+                return False
+        return True
+
+    def get_width(self, text):
+        """
+        Gets the width of a text composed with the glyphs of the atlas.
+        - text: Text. All its characters must be in the atlas.
+        """
+        areas = self.__areas
+        return sum([areas[char][2] for char in text])
+
+    def draw(self, target, text, x, y):
+        """
+        Composes a text in a surface. The pixels of the area of the text are
+        replaced (not blended) with the glyphs.
+        - target: Surface.
+        - text: Text. All its characters must be in the atlas.
+        - x: X coordinate of the text in the surface.
+        - y: Y coordinate of the text in the surface.
+        """
+        areas = self.__areas
+        surface = self.surface
+        for char in text:
+            area = areas[char]
+            target.blit(surface, (x, y), area)
+            x += area[2]
+
+# Glyph atlases, shared by the items that use the same font and color
+__glyph_atlases = LRUCache(GLYPH_ATLAS_CACHE_MAX_BYTES)
+
+def get_glyph_atlas(font, color, chars = GLYPH_ATLAS_CHARS):
+    """
+    Gets the glyph atlas of a font and a color. The atlases are created the
+    first time and shared.
+    - font: Font.
+    - color: Color.
+    - chars: Characters of the atlas.
+    """
+    key = (font, __get_color_key(color), chars)
+    atlas = __glyph_atlases.get(key)
+    if atlas == None:
+        atlas = GlyphAtlas(font, color, chars)
+        __glyph_atlases.put(key, atlas, pixels.get_surface_bytes(atlas.surface))
+    return atlas
+
+class ItemGlyphText(Item):
+    """
+    Defines an item that shows a short text in one line (like a score or a
+    timer) composed with the glyphs of a GlyphAtlas. Changing the text only
+    copies the glyphs in a surface that is reused, so the text can be updated
+    in every frame. The texts with characters that are not in the atlas are
+    rendered as in ItemText.
+    """
+
+    def __init__(self, left, top, font, line_height, text, color = (255, 255, 255), width = -1, height = -1,
+                 h_align = 1, v_align = 1, chars = GLYPH_ATLAS_CHARS):
+        """
+        Constructor
+        - left: X coordinate of the upper-left corner of the item.
+        - top: Y coordinate of the upper-left corner of the item.
+        - font: Font used to render the text.
+        - line_height: Line height. 0 to use default height.
+        - text: Default text.
+        - color: Text's color. It could be an (R, G, B) tuple.
+        - width: Width for the text box. -1 if it is determined automatically.
+        - height: Height for the text box. -1 if it is determined automatically.
+        - h_align: Horizontal alignment (1 = left, 2 = center, 3 = right).
+        - v_align: Vertical alignment (1 = top, 2 = center, 3 = bottom).
+        - chars: Characters of the glyph atlas.
+        """
+        self.__width = width
+        self.__height = height
+        self.__h_align = h_align
+        self.__v_align = v_align
+        self.__font = font
+        if line_height == 0:
+            self.__line_height = max(1, font.get_linesize())
+        else:
+            self.__line_height = line_height
+        self.__color = color
+        self.__atlas = get_glyph_atlas(font, color, chars)
+        self.__alpha = 255
+        self.__alpha_cache = None
+        self.__buffer = None
+        self.__text_surface = None
+        self.__text_area = None
+        self.__dx = 0
+        self.__dy = 0
+
+        # Initialize base class
+        Item.__init__(self, left, top, 0, 0)
+        if self.__width != -1:
+            self.set_width(self.__width)
+        if self.__height != -1:
+            self.set_height(self.__height)
+
+        # Set the text
+        self.__text = None
+        self.set_text(text)
+
+        # Set the function to draw the text
+        self.draw_function = self.__draw_item
+
+    def get_text(self):
+        """
+        Gets the text of the item.
+        """
+        return self.__text
+
+    def set_text(self, text):
+        """
+        Sets the text of the item.
+        - text: Text.
+        """
+        if self.__text == text:
+            return
+        self.__text = text
+        self.__alpha_cache = None
+
+        atlas = self.__atlas
+        text_height = max(self.__font.get_linesize(), self.__line_height)
+        if atlas.can_draw(text):
+            # Compose the text in the surface of the item, it is only created
+            # again when the text doesn't fit
+            text_width = atlas.get_width(text)
+            buffer = self.__buffer
+            if buffer == None or buffer.get_width() < text_width or buffer.get_height() < text_height:
+                buffer_width = max(text_width, 1)
+                if buffer != None:
+                    buffer_width = max(buffer_width, buffer.get_width())
+                buffer = self.__buffer = pygame.Surface((buffer_width, text_height), pygame.SRCALPHA, 32)
+            buffer.fill((0, 0, 0, 0))
+            atlas.draw(buffer, text, 0, 0)
+            self.__text_surface = buffer
+            self.__text_area = Rect(0, 0, text_width, text_height)
+        else:
+            surface = render_text(text, self.__font, None, self.__line_height, -1, -1, True,
+                                  self.__color, None, 1, None)[0]
+            text_width, text_height = surface.get_size()
+            self.__text_surface = surface
+            self.__text_area = None
+
+        # Align the text in the item
+        if self.__width == -1:
+            self.set_width(text_width)
+            self.__dx = 0
+        elif self.__h_align == 2:
+            self.__dx = (self.__width - text_width) / 2
+        elif self.__h_align == 3:
+            self.__dx = self.__width - text_width
+        else:
+            self.__dx = 0
+        if self.__height == -1:
+            self.set_height(text_height)
+            self.__dy = 0
+        elif self.__v_align == 2:
+            self.__dy = (self.__height - text_height) / 2
+        elif self.__v_align == 3:
+            self.__dy = self.__height - text_height
+        else:
+            self.__dy = 0
+        self.set_dirty()
+
+    def get_color(self):
+        """
+        Gets the color of the text.
+        """
+        return self.__color
+
+    def get_alpha(self):
+        """
+        Gets the alpha value associated with the item.
+        """
+        return self.__alpha
+
+    def set_alpha(self, alpha):
+        """
+        Sets the alpha value associated with the item.
+        - alpha: Alpha value.
+        """
+        if self.__alpha != alpha:
+            self.__alpha = alpha
+            self.set_dirty()
+
+    def __get_surface(self):
+        """
+        Gets the surface with the text and the area of the text in the
+        surface, applying the alpha value of the item.
+        """
+        if self.__alpha >= 255:
+            return self.__text_surface, self.__text_area
+
+        # The copies with alpha values are reused while the text doesn't change (fades).
+        # They are kept in the shared cache of the AlphaCache instances, and the
+        # cache is created again when the text changes, so the buffer isn't copied
+        alpha_cache = self.__alpha_cache
+        if alpha_cache == None:
+            surface = self.__text_surface
+            if self.__text_area != None:
+                surface = surface.subsurface(self.__text_area)
+            alpha_cache = self.__alpha_cache = pixels.AlphaCache(surface)
+        return alpha_cache.get(self.__alpha), None
+
+    def __draw_item(self, item, target):
+        """
+        Draws the item.
+        - item: Item to be drawn.
+        - target: An instance of CustomDraw to draw the item.
+        """
+        surface, area = self.__get_surface()
+        target.blit_surface(surface, (self.get_left() + self.__dx, self.get_top() + self.__dy), area)
+
 class ItemRect(Item):
     """
     Defines an item that shows a rectangle
@@ -4410,7 +4936,7 @@ class ItemRect(Item):
                 text_background = None
             else:
                 text_background = self.__background
-            self.__text_surface, text_fit = render_text(self.__text, self.__font, self.__additional_fonts, self.__line_height,
+            self.__text_surface, text_fit, lines = render_text(self.__text, self.__font, self.__additional_fonts, self.__line_height,
                                                               width, height, True, self.__color, text_background,
                                                               self.__text_h_align, None)
             self.__text_width = width
@@ -4658,11 +5184,100 @@ class ItemObject(ItemImage):
         else:
             return move_data[1](frame_delay)
 
+class RenderedText:
+    """
+    Result of rendering a text. The instances are shared by all the items that
+    render the same text with the same parameters, so they must not be modified.
+    """
+
+    def __init__(self, surface, text_fit, line_widths, remaining_text):
+        """
+        Constructor.
+        - surface: Surface with the text.
+        - text_fit: Indicates if all the text fits in the surface.
+        - line_widths: List with the width of each line.
+        - remaining_text: Text that doesn't fit in the surface (with the control
+          characters of the color and font at the break), or None if it isn't
+          calculated.
+        """
+        self.surface = surface
+        self.text_fit = text_fit
+        self.line_widths = line_widths
+        self.remaining_text = remaining_text
+        self.alpha_cache = None
+
+    def get_surface(self, alpha = 255):
+        """
+        Gets the surface of the text with an alpha value applied. The copies with
+        alpha values are kept in the cache shared by all the AlphaCache instances
+        (limited by pixels.ALPHA_CACHE_TOTAL_MAX_BYTES), they are not counted in
+        the size of the text in the cache of rendered texts. The returned surface
+        must not be modified.
+        - alpha: Alpha value.
+        """
+        if alpha >= 255:
+            return self.surface
+        if self.alpha_cache == None:
+            self.alpha_cache = pixels.AlphaCache(self.surface)
+        return self.alpha_cache.get(alpha)
+
+# Rendered texts, shared by all the text items
+__text_cache = LRUCache(TEXT_CACHE_MAX_BYTES)
+
+def get_text_cache_stats():
+    """
+    Gets the statistics of the cache of rendered texts as a dictionary with the
+    hits, misses, evictions, count and size (bytes of the surfaces).
+    """
+    return __text_cache.get_stats()
+
+def reset_text_cache_stats():
+    """
+    Resets the counters of the statistics of the cache of rendered texts.
+    """
+    __text_cache.reset_stats()
+
+def clear_text_cache():
+    """
+    Removes all the rendered texts from the cache.
+    """
+    __text_cache.clear()
+
 def render_text(text, font, additional_fonts, line_height, max_width, max_height, 
                 antialias, color, background, h_align, break_text_into, cursor_index = -1,
                 editable = False):
     """
-    Render the text and returns a surface with the result.
+    Render the text and returns a tuple with a surface with the result, a value
+    that indicates if all the text fits in the surface and a list with the
+    width of each line. The surface is shared with the cache of rendered texts,
+    so it must not be modified.
+    - text: Text.
+    - font: Font used to render the text.
+    - additional_fonts: Dictionary with the additional fonts, see get_rendered_text.
+    - line_height: Line height.
+    - max_width: Maximum width of the text. -1 if there is no maximum width.
+    - max_height: Maximum height of the text. -1 if there is no maximum height.
+    - antialias: Indicates if the text is rendered with using antialiasing.
+    - color: Color used to render the text.
+    - background: Background of the text.
+    - h_align: Horizontal alignment (1 = left, 2 = center, 3 = right).
+    - break_text_into: Item to assign the text that doesn't fit in this surface.
+    - cursor_index: Index where the cursor must be drawn. -1 to doesn't draw the cursor.
+    - editable: Indicates if the text is editable.
+    """
+    rendered = get_rendered_text(text, font, additional_fonts, line_height, max_width, max_height,
+                                 antialias, color, background, h_align, break_text_into, cursor_index,
+                                 editable)
+    return rendered.surface, rendered.text_fit, rendered.line_widths
+
+def get_rendered_text(text, font, additional_fonts, line_height, max_width, max_height, 
+                      antialias, color, background, h_align, break_text_into, cursor_index = -1,
+                      editable = False):
+    """
+    Render the text and returns a RenderedText with the result. The texts
+    rendered without cursor are kept in a cache shared by all the items, so
+    rendering again a text with the same parameters only returns the same
+    RenderedText.
     - text: Text.
     - font: Font used to render the text.
     - additional_fonts: Dictionary with the additional fonts that can be
@@ -4682,6 +5297,56 @@ def render_text(text, font, additional_fonts, line_height, max_width, max_height
     - cursor_index: Index where the cursor must be drawn. -1 to doesn't draw the cursor.
     - editable: Indicates if the text is editable.
     """
+    if cursor_index != -1:
+        # The text is being edited, the surfaces with the cursor are not reused
+        rendered = __render_text(text, font, additional_fonts, line_height, max_width, max_height,
+                                 antialias, color, background, h_align, break_text_into, cursor_index,
+                                 editable)
+    else:
+        key = (text, font, __get_fonts_key(additional_fonts), line_height, max_width, max_height,
+               antialias, __get_color_key(color), __get_color_key(background), h_align,
+               break_text_into != None, editable)
+        rendered = __text_cache.get(key)
+        if rendered == None:
+            rendered = __render_text(text, font, additional_fonts, line_height, max_width, max_height,
+                                     antialias, color, background, h_align, break_text_into, cursor_index,
+                                     editable)
+            __text_cache.put(key, rendered, pixels.get_surface_bytes(rendered.surface))
+
+    # Set the text that doesn't fit in the specified item
+    if break_text_into != None:
+        break_text_into.set_text(rendered.remaining_text)
+
+    return rendered
+
+def __get_fonts_key(additional_fonts):
+    """
+    Gets a value that identifies the additional fonts in the key of the cache
+    of rendered texts.
+    - additional_fonts: Dictionary with the additional fonts.
+    """
+    if not additional_fonts:
+        return None
+    return tuple(sorted([(name, tuple(font_data)) for name, font_data in additional_fonts.items()]))
+
+def __get_color_key(color):
+    """
+    Gets a value that identifies a color in the key of the cache of rendered
+    texts (the instances of Color can't be used as keys).
+    - color: Color, None if there is no color.
+    """
+    if color == None:
+        return None
+    return tuple(color)
+
+def __render_text(text, font, additional_fonts, line_height, max_width, max_height, 
+                  antialias, color, background, h_align, break_text_into, cursor_index,
+                  editable):
+    """
+    Render the text and returns a RenderedText with the result. The parameters
+    are the same as get_rendered_text, but the remaining text is only calculated
+    and it isn't assigned to break_text_into.
+    """
     # Split the text in lines        
     if max_width == -1:
         max_line_width = sys.maxint
@@ -4693,7 +5358,7 @@ def render_text(text, font, additional_fonts, line_height, max_width, max_height
     
     # Wrap the text in lines    
     lines, remaining_lines, break_color, break_font = wrap_text_in_lines(text, 
-        False, color, font, line_height, additional_fonts, max_line_width, max_height,
+        color, font, line_height, additional_fonts, max_line_width, max_height,
         break_text_into)        
         
     # Render the lines
@@ -4741,12 +5406,9 @@ def render_text(text, font, additional_fonts, line_height, max_width, max_height
         if height == 0:
             height = line_height            
 
-        # Wrap the text in lines (for hit_test to avoid extra characters 
-        # like "..." or "-")
-        cursor_text_data = wrap_text_in_lines(text, True, color, font, line_height, additional_fonts, max_line_width, max_height, break_text_into)        
-        
-        # Draw the cursor
-        draw_cursor(cursor_index, text, cursor_text_data[0], line_surfs, width, line_height, font)
+        # Draw the cursor (the lines have the text without extra characters
+        # like "..." or "-" to find the position of the cursor)
+        draw_cursor(cursor_index, text, lines, line_surfs, width, line_height, font)
         
         # Add an extra width to draw the cursor at the end of the text if necessary
         extra_width = 2
@@ -4791,7 +5453,8 @@ def render_text(text, font, additional_fonts, line_height, max_width, max_height
             line_x += part_surf.get_width()
         line_y += parts_height
 
-    # Set the text that doesn't fit in the specified item    
+    # Calculate the text that doesn't fit in the specified item
+    remaining_text = None
     if break_text_into != None:
         # Remove empty lines at the beginning of the text
         k = 0
@@ -4819,9 +5482,8 @@ def render_text(text, font, additional_fonts, line_height, max_width, max_height
             remaining_text = "&#f:" + break_font[1] + '!' + remaining_text        
         if break_color != color:
             remaining_text = "&#c" + ','.join(map(str, break_color)) + '!' + remaining_text
-        break_text_into.set_text(remaining_text)
 
-    return surface, len(remaining_lines) == 0, [surf[0] for surf in line_surfs]
+    return RenderedText(surface, len(remaining_lines) == 0, [surf[0] for surf in line_surfs], remaining_text)
 
 def draw_cursor(cursor_index, text, lines, line_surfs, width, line_height, font):
     """
@@ -4841,14 +5503,14 @@ def draw_cursor(cursor_index, text, lines, line_surfs, width, line_height, font)
         part_index = 0
         while part_index < len(line):
             part = line[part_index]
-            part_text = part[2]
+            part_text = part[3]
             
             if cursor_index >= text_index and cursor_index < text_index + len(part_text):
                 # Found where the cursor should be drawn. Draw it
                 part_surf = line_surfs[line_index][2][part_index][0]                
                 char_index = cursor_index - text_index
                 part_font = part[1][0] 
-                x = part_font.size(part_text[0:char_index])[0]
+                x = get_font_metrics(part_font).get_width(part_text[0:char_index])
                 draw_cursor_in_surface(part_surf, x)
                 
                 return                                        
@@ -4932,7 +5594,7 @@ def hittest_text(text, x, y, font, additional_fonts, line_height, max_width, max
                         
     # Wrap the text in lines    
     result = wrap_text_in_lines(text, 
-        False, color, font, line_height, additional_fonts, max_line_width, max_height,
+        None, font, line_height, additional_fonts, max_line_width, max_height,
         break_text_into)    
     lines = result[0]    
                             
@@ -4942,7 +5604,7 @@ def hittest_text(text, x, y, font, additional_fonts, line_height, max_width, max
     index = 0
     while line_index < len(lines) - 1 and line_y + line_height < y:        
         for line_part in lines[line_index]:
-            index += len(line_part[2])
+            index += len(line_part[3])
         if index < len(text) and text[index] == '\n':
             index += 1
                 
@@ -4957,12 +5619,12 @@ def hittest_text(text, x, y, font, additional_fonts, line_height, max_width, max
         while part_index < len(line) and not found:
             part = line[part_index]
             char_index = 0
-            part_font = part[1][0] 
-            part_text = part[2]
+            part_text = part[3]
+            part_widths = get_font_metrics(part[1][0]).get_prefix_widths(part_text)
             char_width = 0
             while char_index < len(part_text):
                 char_index += 1
-                char_width = part_font.size(part_text[0:char_index])[0]                                
+                char_width = part_widths[char_index]
                                 
                 if line_x + char_width < x:                    
                     index += 1
@@ -4979,12 +5641,141 @@ def hittest_text(text, x, y, font, additional_fonts, line_height, max_width, max
             
     return index
     
-def wrap_text_in_lines(text, hit_test, color, font, line_height, additional_fonts, max_line_width, max_height,
+class TextLayout:
+    """
+    Layout of a long text in pages of the same size. The text is wrapped once
+    and the lines are distributed in the pages, so the text of each page is
+    only obtained (and rendered) when the page is shown. The texts of the pages
+    have the control characters of the colors and fonts used at the beginning
+    of the page, and the lines are already wrapped to fit in the page.
+    """
+
+    def __init__(self, text, font, additional_fonts, line_height, max_width, max_height, color):
+        """
+        Constructor.
+        - text: Text.
+        - font: Font used to render the text.
+        - additional_fonts: Dictionary with the additional fonts that can be
+          referenced in the text (see render_text).
+        - line_height: Line height.
+        - max_width: Maximum width of the lines. -1 if there is no maximum width.
+        - max_height: Height of the pages. -1 to put all the text in one page.
+        - color: Color used to render the text.
+        """
+        if max_width == -1:
+            max_width = sys.maxint
+        self.__color = color
+
+        # Wrap all the text, breaking the long words with '-' as if the text
+        # continued in other item
+        lines = wrap_text_in_lines(text, color, font, line_height, additional_fonts, max_width, -1, True)[0]
+        self.__lines = lines
+        self.__heights = [max([part[1][1] for part in line]) for line in lines]
+
+        # Distribute the lines in pages
+        pages = []
+        start = 0
+        page_height = 0
+        for i in xrange(len(lines)):
+            if i == start and len(pages) > 0 and self.__is_empty(lines[i]):
+                # Don't begin a page with empty lines
+                start += 1
+                continue
+            height = self.__heights[i]
+            if max_height != -1 and i > start and page_height + height > max_height:
+                pages.append((start, i))
+                start = i
+                page_height = 0
+            page_height += height
+        if start < len(lines) or len(pages) == 0:
+            pages.append((start, len(lines)))
+        self.__pages = pages
+        self.__texts = {}
+
+    def get_page_count(self):
+        """
+        Gets the number of pages.
+        """
+        return len(self.__pages)
+
+    def get_page_bounds(self):
+        """
+        Gets a list with the range of lines (first line, last line + 1) of
+        each page.
+        """
+        return list(self.__pages)
+
+    def get_line_metrics(self, index):
+        """
+        Gets a list with the width and the height of the lines of a page.
+        - index: Index of the page.
+        """
+        start, end = self.__pages[index]
+        metrics = []
+        for i in xrange(start, end):
+            width = 0
+            for part in self.__lines[i]:
+                width += get_font_metrics(part[1][0]).get_width(part[2])
+            metrics.append((width, self.__heights[i]))
+        return metrics
+
+    def get_page_text(self, index):
+        """
+        Gets the text of a page.
+        - index: Index of the page.
+        """
+        text = self.__texts.get(index)
+        if text != None:
+            return text
+
+        default_color = self.__color
+        color = default_color
+        font_name = None
+        start, end = self.__pages[index]
+        page_lines = []
+        for line in self.__lines[start:end]:
+            line_text = ''
+            for part_color, font_data, part_text, source_text in line:
+                if part_color != color:
+                    color = part_color
+                    if color == default_color:
+                        line_text += "&#c!"
+                    else:
+                        line_text += "&#c" + ','.join(map(str, color)) + '!'
+                if font_data[3] != font_name:
+                    font_name = font_data[3]
+                    if font_name == None:
+                        line_text += "&#f!"
+                    else:
+                        line_text += "&#f:" + font_name + '!'
+                line_text += part_text
+
+            # The line was wrapped with its ending space, remove it to avoid
+            # that the line is wrapped again
+            page_lines.append(line_text.rstrip(' '))
+        text = self.__texts[index] = "\n".join(page_lines)
+        return text
+
+    def __is_empty(self, line):
+        """
+        Determines if a line has only spaces.
+        - line: Line.
+        """
+        for part in line:
+            if part[2].strip(' \r\t') != '':
+                return False
+        return True
+
+def wrap_text_in_lines(text, color, font, line_height, additional_fonts, max_line_width, max_height,
                        break_text_into):
     """
-    Wrap the text in lines.
+    Wrap the text in lines. Returns a tuple with the list of lines, the list of
+    lines that don't fit, the color and the font at the end of the text. Each
+    line is a list of parts (color, font data, text, source text), where the
+    text is the text drawn (it can have extra characters like "..." or "-" when
+    a word is broken) and the source text is the part of the original text
+    (used to find the characters in the hit tests and to draw the cursor).
     - text: Text to wrap.
-    - hit_test: Indicates if wrap the text for hit test.
     - color: Color used to render the text.
     - font: Font used to render the text.
     - line_height: Line height for the font.
@@ -5000,19 +5791,18 @@ def wrap_text_in_lines(text, hit_test, color, font, line_height, additional_font
     current_color = [color]
     current_font = [font, line_height, 0, None]    
     for line in text.splitlines():
-        wrap_line(line, hit_test, font, line_height, additional_fonts, lines, current_height, 
+        wrap_line(line, font, line_height, additional_fonts, lines, current_height, 
                   max_line_width, max_height, remaining_lines, color, current_color, 
                   current_font, False, break_text_into)
         
     return lines, remaining_lines, current_color[0], (current_font[0], current_font[1]) 
     
-def wrap_line(line, hit_test, font, line_height, additional_fonts, lines, current_height, max_width, max_height, 
+def wrap_line(line, font, line_height, additional_fonts, lines, current_height, max_width, max_height, 
               remaining_lines, default_color, current_color, current_font, 
               add_ellipsis, break_text_into):
     """
     If the line is too long, split the line in multiple lines.
     - line: Line to wrap.
-    - hit_test: Indicates if wrap the text for hit test.
     - font: Font used to render the text.
     - line_height: Line height for the font.
     - additional_fonts: Dictionary with the additional fonts that can be
@@ -5033,20 +5823,22 @@ def wrap_line(line, hit_test, font, line_height, additional_fonts, lines, curren
         remaining_lines.append(line)
     else:
         # Calculate the width of the line
-        line_width = current_font[0].size(line)[0]
+        metrics = get_font_metrics(current_font[0])
+        line_width = metrics.get_width(line)
 
         # Check if the line is too long (and doesn't have control characters)
         if line_width <= max_width and line.find("&#") == - 1:
-            lines.append([(current_color[0], current_font[:], line)])
+            lines.append([(current_color[0], current_font[:], line, line)])
             current_height[0] += current_font[1]
         else:
             # The line contains control characters or is too long. Split the line in pats to
             # analyze the control chars, and then in words to shorten the line
             start = 0
             new_line = ''
+            new_line_source = ''
             empty_line = True
             line_width = 0
-            space_width = current_font[0].size(' ')[0]
+            space_width = metrics.get_width(' ')
             line_parts = []
             line_parts_height = 0
             while start < len(line):
@@ -5071,76 +5863,74 @@ def wrap_line(line, hit_test, font, line_height, additional_fonts, lines, curren
                     words = line_part.split(' ')
                     i = 0
                     new_line = ''
+                    new_line_source = ''
                     for i in xrange(len(words)):
                         add_word = words[i]      
                         add_space = True                  
                         while add_word != None:
                             word = add_word                            
                             add_word = None                         
-                            word_width = current_font[0].size(word)[0]
+                            word_width = metrics.get_width(word)
+                            source_word = word
     
                             if i == len(words) - 1:
-                                extra_width = current_font[0].size(next_word)[0]
+                                extra_width = metrics.get_width(next_word)
                             else:
                                 extra_width = 0
     
                             if word_width > max_width:                                                                
                                 if add_ellipsis:
                                     # The word is too long truncate it
-                                    end_width = current_font[0].size('...')[0]
+                                    end_width = metrics.get_width('...')
                                     if end_width > max_width:
                                         word = ''
+                                        source_word = ''
                                         word_width = 0
                                     else:
-                                        k = len(word)
-                                        while k >= 0 and word_width + end_width > max_width:
-                                            k -= 1
-                                            word_width = current_font[0].size(word[0:k])[0]
-                                        if hit_test:                                        
-                                            word = word[:k]
-                                        else:
-                                            word = word[:k] + '...'
+                                        k = metrics.fit(word, max_width - end_width)
+                                        word_width = metrics.get_width(word[0:k])
+                                        source_word = word[:k]
+                                        word = word[:k] + '...'
                                         word_width += end_width
                                 else:
                                     is_last_line = current_height[0] + current_font[1] * 2 >= max_height
                                     if not is_last_line or break_text_into != None:
                                         # There are more lines. Add a '-' to separate the word                                                                         
-                                        end_width = current_font[0].size('-')[0]
+                                        end_width = metrics.get_width('-')
                                         if end_width > max_width:
                                             word = ''
+                                            source_word = ''
                                             word_width = 0
                                         else:
-                                            k = len(word)
-                                            while k >= 0 and word_width + end_width > max_width:
-                                                k -= 1
-                                                word_width = current_font[0].size(word[0:k])[0]
+                                            k = metrics.fit(word, max_width - end_width)
+                                            word_width = metrics.get_width(word[0:k])
                                             add_word = word[k:]
-                                            if hit_test:                                        
-                                                word = word[:k]
-                                            else:
-                                                word = word[:k] + '-'
+                                            source_word = word[:k]
+                                            word = word[:k] + '-'
                                             word_width += end_width
                                     else:
                                         # Is the last line. Truncate the word
-                                        k = len(word)
-                                        while k >= 0 and word_width > max_width:
-                                            k -= 1
-                                            word_width = current_font[0].size(word[0:k])[0]
+                                        k = metrics.fit(word, max_width)
+                                        word_width = metrics.get_width(word[0:k])
                                         word = word[:k]                                    
+                                        source_word = word
                             
                             if (empty_line) and (line_width + word_width + extra_width <= max_width):                                
                                 new_line = word
+                                new_line_source = source_word
                                 line_width += word_width
                                 empty_line = False
                             elif (line_width + word_width + space_width + extra_width <= max_width):                                
                                 new_line += ' ' + word
+                                new_line_source += ' ' + source_word
                                 line_width += word_width + space_width
                             else:                                
                                 # The end of the line was found. Add it in the result
                                 if new_line != '':
                                     if word != '' and add_space:
                                         new_line += ' '
-                                    line_parts.append((current_color[0], current_font[:], new_line))
+                                        new_line_source += ' '
+                                    line_parts.append((current_color[0], current_font[:], new_line, new_line_source))
                                     line_parts_height = max(line_parts_height, current_font[1])
                                 if len(line_parts) > 0:
                                     lines.append(line_parts)
@@ -5151,10 +5941,12 @@ def wrap_line(line, hit_test, font, line_height, additional_fonts, lines, curren
                                 line_parts_height = 0
                                 if word == '':
                                     new_line = ''
+                                    new_line_source = ''
                                     line_width = 0
                                     empty_line = True
                                 else:
                                     new_line = word
+                                    new_line_source = source_word
                                     line_width = word_width
     
                                 # Check if the maximum height was reached
@@ -5180,9 +5972,10 @@ def wrap_line(line, hit_test, font, line_height, additional_fonts, lines, curren
                             # Add the line written until now with the current color before change
                             # the color
                             if new_line != '':
-                                line_parts.append((current_color[0], current_font[:], new_line))
+                                line_parts.append((current_color[0], current_font[:], new_line, new_line_source))
                                 line_parts_height = max(line_parts_height, current_font[1])
                                 new_line = ''
+                                new_line_source = ''
                                 empty_line = True
 
                             if next_control + 3 == next_control_end:
@@ -5206,12 +5999,14 @@ def wrap_line(line, hit_test, font, line_height, additional_fonts, lines, curren
                                     current_font[:] = [font_selected[0], font_selected[1], 0, font_name, None]
                                 if current_font[1] == 0:
                                     current_font[1] = current_font[0].get_linesize()
+                            if c == 'f':
+                                metrics = get_font_metrics(current_font[0])
 
                     start = next_control_end + 1
 
             # Add the last line
             if new_line != '':
-                line_parts.append((current_color[0], current_font[:], new_line))
+                line_parts.append((current_color[0], current_font[:], new_line, new_line_source))
                 line_parts_height = max(line_parts_height, current_font[1])
             if len(line_parts) > 0:
                 lines.append(line_parts)
@@ -5223,15 +6018,408 @@ def set_surface_alpha(surface, alpha):
     - surface: Surface.
     - alpha: Alpha value.
     """
-    surface = surface.copy()
-    if surface.get_bitsize() < 32:
-        surface.set_alpha(alpha)
-    elif surface.get_width() != 0:
-        alpha_matrix = pygame.surfarray.pixels_alpha(surface)
-        mult_alpha = alpha_matrix * (float(alpha) / 255)
-        alpha_matrix[:] = mult_alpha.astype('b')
+    return pixels.apply_alpha(surface, alpha)
+
+class DirtyRegion:
+    """
+    Accumulates the areas of the stage that must be redrawn.
+
+    The rects are kept without intersections (if a rect that intersects with
+    others is added they are joined), because a part of an item with alpha mid
+    levels drawn more than once is not painted as expected. The rects are
+    indexed in a grid, so adding a rect only checks the rects that are near.
+    """
+
+    def __init__(self, max_rects = DIRTY_RECTS_MAX, overdraw = DIRTY_RECTS_OVERDRAW, cell_size = DIRTY_CELL_SIZE):
+        """
+        Constructor.
+        - max_rects: Maximum number of rects returned by get_rects.
+        - overdraw: Maximum proportion of area not changed that is accepted to
+          join two rects when there are less than max_rects rects (0 to join
+          rects only to respect max_rects).
+        - cell_size: Size of the cells of the grid.
+        """
+        self.max_rects = max_rects
+        self.overdraw = overdraw
+        self.__cell_size = cell_size
+        self.__rects = {}
+        self.__cells = {}
+        self.__next_id = 0
+
+    def __len__(self):
+        """
+        Gets the number of rects.
+        """
+        return len(self.__rects)
+
+    def clear(self):
+        """
+        Removes all the rects.
+        """
+        self.__rects = {}
+        self.__cells = {}
+
+    def add(self, rect):
+        """
+        Adds a rect to the region. If the rect intersects with other rects of
+        the region they are joined. Returns the key of the resulting rect, or
+        None if the rect is empty.
+        - rect: Rect.
+        """
+        if rect.width <= 0 or rect.height <= 0:
+            return None
+
+        # Use a copy, the rect could be the rect of an item
+        rect = Rect(rect)
+        rects = self.__rects
+        joined = True
+        while joined:
+            joined = False
+            for key in self.__find(rect):
+                other = rects[key]
+                if rect.colliderect(other):
+                    rect.union_ip(other)
+                    self.__remove(key)
+                    joined = True
+
+        key = self.__next_id
+        self.__next_id += 1
+        rects[key] = rect
+        cells = self.__cells
+        for cell in self.__get_cells(rect):
+            if cell in cells:
+                cells[cell].add(key)
+            else:
+                cells[cell] = set([key])
+        return key
+
+    # Allows to use the region where a list of rects was used
+    append = add
+
+    def get_rects(self):
+        """
+        Gets the list of rects of the region. The rects are joined to return
+        at most max_rects rects, joining first the rects that produce less
+        area drawn but not changed.
+        """
+        if len(self.__rects) > 1:
+            self.__compact()
+
+        rects = self.__rects
+        keys = rects.keys()
+        keys.sort()
+        return [rects[key] for key in keys]
+
+    def __compact(self):
+        """
+        Joins the near rects while there are more than max_rects rects or the
+        area not changed is lower than the overdraw proportion.
+        """
+        rects = self.__rects
+        heap = []
+        for key in rects.keys():
+            self.__push_near_pairs(heap, key, False)
+        all_pairs = False
+
+        while len(rects) > 1:
+            if len(heap) == 0:
+                if len(rects) <= self.max_rects or all_pairs:
+                    break
+                # The remaining rects are far from each other, consider all the pairs
+                all_pairs = True
+                for key in rects.keys():
+                    self.__push_near_pairs(heap, key, True)
+                continue
+
+            waste, key1, key2 = heapq.heappop(heap)
+            if not key1 in rects or not key2 in rects:
+                # One of the rects was joined with another rect
+                continue
+
+            union = rects[key1].union(rects[key2])
+            if len(rects) <= self.max_rects and waste > self.overdraw * union.width * union.height:
+                break
+
+            self.__remove(key1)
+            self.__remove(key2)
+            key = self.add(union)
+            self.__push_near_pairs(heap, key, all_pairs)
+
+    def __push_near_pairs(self, heap, key, all_pairs):
+        """
+        Adds in the heap the pairs of the rect with the near rects, ordered by
+        the area not changed that is drawn if they are joined.
+        - heap: Heap.
+        - key: Key of the rect.
+        - all_pairs: True to add the pairs with all the rects.
+        """
+        rects = self.__rects
+        rect = rects[key]
+        if all_pairs:
+            keys = rects.keys()
+        else:
+            size = self.__cell_size
+            keys = self.__find(rect.inflate(size * 2, size * 2))
+        area = rect.width * rect.height
+        for other_key in keys:
+            if other_key != key:
+                other = rects[other_key]
+                union = rect.union(other)
+                waste = union.width * union.height - area - other.width * other.height
+                heapq.heappush(heap, (waste, min(key, other_key), max(key, other_key)))
+
+    def __find(self, rect):
+        """
+        Gets the keys of the rects that are in the cells covered by a rect.
+        - rect: Rect.
+        """
+        cells = self.__cells
+        keys = set()
+        for cell in self.__get_cells(rect):
+            if cell in cells:
+                keys.update(cells[cell])
+        return keys
+
+    def __remove(self, key):
+        """
+        Removes a rect from the region.
+        - key: Key of the rect.
+        """
+        rect = self.__rects.pop(key)
+        cells = self.__cells
+        for cell in self.__get_cells(rect):
+            keys = cells[cell]
+            keys.discard(key)
+            if len(keys) == 0:
+                del cells[cell]
+
+    def __get_cells(self, rect):
+        """
+        Gets the cells of the grid covered by a rect.
+        - rect: Rect.
+        """
+        size = self.__cell_size
+        rows = xrange(rect.top // size, (rect.bottom - 1) // size + 1)
+        return [(col, row) for col in xrange(rect.left // size, (rect.right - 1) // size + 1) for row in rows]
+
+class ItemGrid:
+    """
+    Index of the items of a layer by their area in a uniform grid. It is
+    used to find the items that must be drawn in a dirty rect or that are
+    below the mouse without check all the items of the layer.
+    """
+
+    def __init__(self, cell_size = ITEM_CELL_SIZE):
+        """
+        Constructor.
+        - cell_size: Size of the cells of the grid.
+        """
+        self.__cell_size = cell_size
+        self.__cells = {}
+        self.__areas = {}
+        self.__large_items = set()
+
+    def set(self, item, area):
+        """
+        Sets the area of an item.
+        - item: Item.
+        - area: Area of the item, None to remove the item from the grid.
+        """
+        areas = self.__areas
+        if item in areas:
+            if areas[item] == area:
+                return
+            self.remove(item)
+        if area == None:
+            return
+
+        areas[item] = area
+        cells = self.__get_cells(area)
+        if cells == None:
+            # The item covers a lot of cells, it is better to check it always
+            self.__large_items.add(item)
+        else:
+            grid_cells = self.__cells
+            for cell in cells:
+                if cell in grid_cells:
+                    grid_cells[cell].add(item)
+                else:
+                    grid_cells[cell] = set([item])
+
+    def remove(self, item):
+        """
+        Removes an item from the grid.
+        - item: Item.
+        """
+        area = self.__areas.pop(item, None)
+        if area == None:
+            return
+
+        cells = self.__get_cells(area)
+        if cells == None:
+            self.__large_items.discard(item)
+        else:
+            grid_cells = self.__cells
+            for cell in cells:
+                items = grid_cells[cell]
+                items.discard(item)
+                if len(items) == 0:
+                    del grid_cells[cell]
+
+    def find(self, rect):
+        """
+        Gets the set of items with an area that intersects with a rect.
+        - rect: Rect.
+        """
+        areas = self.__areas
+        found = set()
+        cells = self.__get_cells(rect)
+        if cells == None:
+            candidates = areas.keys()
+        else:
+            candidates = set(self.__large_items)
+            grid_cells = self.__cells
+            for cell in cells:
+                if cell in grid_cells:
+                    candidates.update(grid_cells[cell])
 
-    return surface
+        for item in candidates:
+            if areas[item].colliderect(rect):
+                found.add(item)
+        return found
+
+    def find_point(self, x, y):
+        """
+        Gets the set of items with an area that contains a point.
+        - x: X coordinate.
+        - y: Y coordinate.
+        """
+        areas = self.__areas
+        size = self.__cell_size
+        found = set()
+        cell = (int(x) // size, int(y) // size)
+        candidates = self.__large_items
+        if cell in self.__cells:
+            candidates = candidates.union(self.__cells[cell])
+        for item in candidates:
+            if areas[item].collidepoint(x, y):
+                found.add(item)
+        return found
+
+    def __get_cells(self, rect):
+        """
+        Gets the cells of the grid covered by a rect. Returns None if the
+        rect covers more than ITEM_GRID_MAX_CELLS cells.
+        - rect: Rect.
+        """
+        size = self.__cell_size
+        cols = xrange(rect.left // size, (rect.right - 1) // size + 1)
+        rows = xrange(rect.top // size, (rect.bottom - 1) // size + 1)
+        if len(cols) * len(rows) > ITEM_GRID_MAX_CELLS:
+            return None
+        return [(col, row) for col in cols for row in rows]
+
+class ItemCellIndex:
+    """
+    Index of the ItemCell items of a layer by the cells of the isometric grid
+    that their footprints cover, and by their type and position. It is used
+    to find the items of a position and to test collisions without check all
+    the items of the layer.
+    """
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.__cells = {}
+        self.__positions = {}
+        self.__entries = {}
+
+    def set(self, item):
+        """
+        Adds an item to the index, or updates it if its position, type or size
+        changed.
+        - item: ItemCell.
+        """
+        position = item.get_position()
+        definition = item.get_definition()
+        if position == None or definition == None:
+            self.remove(item)
+            return
+        row, col = position
+        rows, cols = definition.size
+        cells = self.__get_cells(row, col, rows, cols)
+        key = (item.get_type(), position)
+        entry = self.__entries.get(item)
+        if entry != None:
+            if entry[0] == cells and entry[1] == key:
+                return
+            self.remove(item)
+
+        self.__entries[item] = (cells, key)
+        grid_cells = self.__cells
+        for cell in cells:
+            if cell in grid_cells:
+                grid_cells[cell].add(item)
+            else:
+                grid_cells[cell] = set([item])
+        self.__positions.setdefault(key, []).append(item)
+
+    def remove(self, item):
+        """
+        Removes an item from the index.
+        - item: ItemCell.
+        """
+        entry = self.__entries.pop(item, None)
+        if entry == None:
+            return
+        cells, key = entry
+        grid_cells = self.__cells
+        for cell in cells:
+            items = grid_cells[cell]
+            items.discard(item)
+            if len(items) == 0:
+                del grid_cells[cell]
+        items = self.__positions[key]
+        items.remove(item)
+        if len(items) == 0:
+            del self.__positions[key]
+
+    def find(self, type, position):
+        """
+        Gets the list of items with the specified type and position.
+        - type: Type.
+        - position: Position (row, col).
+        """
+        return self.__positions.get((type, position), [])
+
+    def find_area(self, row, col, rows, cols):
+        """
+        Gets the set of items that cover any cell of an area of the grid.
+        - row: First row of the area.
+        - col: First column of the area.
+        - rows: Number of rows.
+        - cols: Number of columns.
+        """
+        found = set()
+        grid_cells = self.__cells
+        for cell in self.__get_cells(row, col, rows, cols):
+            if cell in grid_cells:
+                found.update(grid_cells[cell])
+        return found
+
+    def __get_cells(self, row, col, rows, cols):
+        """
+        Gets the cells (with integer row and column) covered by an area of the
+        grid. The rows and columns can be fractional.
+        - row: First row.
+        - col: First column.
+        - rows: Number of rows.
+        - cols: Number of columns.
+        """
+        row_range = xrange(int(math.floor(row)), int(math.ceil(row + rows)))
+        col_range = xrange(int(math.floor(col)), int(math.ceil(col + cols)))
+        return [(r, c) for r in row_range for c in col_range]
 
 class Layer:
     """
@@ -5255,9 +6443,18 @@ class Layer:
         self.__alpha = 255
         self.__alpha_buffer = None
         self.__alpha_blit = None
+        self.__alpha_blit_alpha = None
         self.__clip = None
         self.__drawn = False
 
+        # Initialize the index of the items by position, and the order of the items
+        # (it is calculated when it is needed)
+        self.__grid = ItemGrid()
+        self.__order = None
+
+        # Index of the ItemCell items by the cells of the isometric grid
+        self.__cells = ItemCellIndex()
+
         # Initialize dirty items
         self.dirty_rects = []
         self.dirty_items = []
@@ -5268,6 +6465,9 @@ class Layer:
         for item in self.items:
             item.exit()
         self.items = []
+        self.__grid = ItemGrid()
+        self.__order = None
+        self.__cells = ItemCellIndex()
         self.custom_draw = None
         self.__changed_handler = None
 
@@ -5277,6 +6477,12 @@ class Layer:
         """
         return item in self.items
 
+    def is_dirty(self):
+        """
+        Determines if the layer must be updated in the next render.
+        """
+        return self.dirty_layer or len(self.dirty_items) > 0 or len(self.dirty_rects) > 0
+
     def empty(self):
         """
         Remove all the items from the layer
@@ -5302,11 +6508,16 @@ class Layer:
         if index == - 1:
             index = len(self.items)
             self.items.append(item)
+            if self.__order != None:
+                self.__order[item] = index
         else:
             self.items.insert(index, item)
+            self.__order = None
 
         # If the item is an ItemCell mark that the index must be adjusted to show
         # it in the correct place according with its row an column
+        if isinstance(item, ItemCell):
+            self.__cells.set(item)
         if isinstance(item, ItemCell) and self.stage != None:
             definition = item.get_definition()
             if definition.size[0] > 1:
@@ -5340,6 +6551,9 @@ class Layer:
             
             self.items.remove(item)
             item.set_layer(None)
+            self.__grid.remove(item)
+            self.__cells.remove(item)
+            self.__order = None
 
             # Append the item's rectangle to force a redraw in this area
             if not item.rect in self.dirty_rects and item.rect.width != 0 and item.rect.height != 0:
@@ -5364,8 +6578,44 @@ class Layer:
         """
         Search the item in the layer and returns the index of the item in the layer.
         """
+        order = self.__order
+        if order != None and len(order) == len(self.items) and item in order:
+            return order[item]
         return self.items.index(item)
 
+    def move_item(self, item, index):
+        """
+        Moves an item of the layer to other position in the drawing order without
+        removing it from the layer, so only its area is redrawn. It must not be
+        used with the items ordered by the stage (ItemCell).
+        - item: Item.
+        - index: New index of the item.
+        """
+        items = self.items
+        order = self.__order
+        if order != None and len(order) == len(items) and item in order:
+            old_index = order[item]
+        else:
+            order = None
+            old_index = items.index(item)
+        if old_index == index:
+            return
+
+        del items[old_index]
+        items.insert(index, item)
+        if order != None:
+            # Only the indexes of the items between both positions change
+            for k in xrange(min(old_index, index), max(old_index, index) + 1):
+                order[items[k]] = k
+        else:
+            self.__order = None
+
+        # Redraw the area of the item, the items that overlap it are drawn again
+        item.set_dirty()
+        if self.stage != None:
+            # Update the item that is below the mouse
+            self.stage.update_mouse()
+
     def get_count(self):
         """
         Get the number of items added in the layer.
@@ -5393,7 +6643,7 @@ class Layer:
     def update(self, dirty_rects, frame_delay):
         """
         Updates the items before draw it in the stage.
-        - dirty_rects: List where the parts of the stage that must be updated
+        - dirty_rects: DirtyRegion where the parts of the stage that must be updated
               are added.
         - frame_delay: Milliseconds elapsed from the previous frame.
         """
@@ -5405,61 +6655,45 @@ class Layer:
         dirty_items_list = self.dirty_items
         self.dirty_items = []
 
+        # Add the rects in the region. If a rect intersects with another they are joined
+        # (see DirtyRegion)
         for rect in dirty_rects_list:
-            # If the rect intersects with another, join them. If we don't do this
-            # and a part of an item with alpha mid levels is drawn more than once and the
-            # resulting painting will not be as expected
-            k = rect.collidelist(dirty_rects)
-            while k != - 1:
-                rect.union_ip(dirty_rects[k])
-                del dirty_rects[k]
-                k = rect.collidelist(dirty_rects)
+            dirty_rects.add(rect)
 
-            dirty_rects.append(rect)
+        # Rects where the content of the layer changed (only used with an alpha value)
+        changed_rects = []
+        use_alpha = (self.__alpha != 255)
+        if use_alpha:
+            changed_rects.extend(dirty_rects_list)
 
         # If the layer is marked as dirty add a rect that cover all the items of the layer
         if self.dirty_layer:
             self.dirty_layer = False
 
+            if use_alpha:
+                changed_items = set(dirty_items_list)
             for item in self.items:
                 dirty_rect = item.update(frame_delay)
+                if use_alpha and dirty_rect != None and item in changed_items:
+                    changed_rects.append(dirty_rect)
                 if self.__clip != None and dirty_rect != None:
                     dirty_rect = dirty_rect.clip(self.__clip)
-                if dirty_rect != None and dirty_rect.width != 0 and dirty_rect.height != 0:
-                    k = dirty_rect.collidelist(dirty_rects)
-                    while k != - 1:
-                        dirty_rect.union_ip(dirty_rects[k])
-                        del dirty_rects[k]
-                        k = dirty_rect.collidelist(dirty_rects)
-                    dirty_rects.append(dirty_rect)
+                if dirty_rect != None:
+                    dirty_rects.add(dirty_rect)
         else:
             # Update the dirty items
             for item in dirty_items_list:
                 dirty_rect = item.update(frame_delay)
-                if self.__clip != None:
-                    dirty_rect = dirty_rect.clip(self.__clip)
-                    if dirty_rect.width == 0 or dirty_rect.height == 0:
-                        dirty_rect = None
-
                 if dirty_rect != None:
-                    # If the rect intersects with another, join them
-                    k = dirty_rect.collidelist(dirty_rects)
-                    while k != - 1:
-                        dirty_rect.union_ip(dirty_rects[k])
-                        del dirty_rects[k]
-                        k = dirty_rect.collidelist(dirty_rects)
-
-                    dirty_rects.append(dirty_rect)
+                    if use_alpha:
+                        changed_rects.append(dirty_rect)
+                    if self.__clip != None:
+                        dirty_rect = dirty_rect.clip(self.__clip)
+                    dirty_rects.add(dirty_rect)
 
-        # If the items of the layer changed and there is an alpha value, updates the alpha buffer
-        if self.__alpha != 255:
-            if (len(dirty_rects_list) != 0 or len(dirty_items_list) != 0 or \
-                (self.dirty_layer and self.__alpha_buffer == None)):
-                # Render the layer into a surface
-                self.__alpha_buffer, self.__alpha_bounds = self.render_into_surface()
-
-                # Calculate the surface with the alpha value
-                self.__alpha_blit = set_surface_alpha(self.__alpha_buffer, self.__alpha)
+        # If there is an alpha value, updates the alpha buffer where the items of the layer changed
+        if use_alpha:
+            self.__update_alpha_buffer(changed_rects)
 
     def draw(self, surface, dirty_rects):
         """
@@ -5489,9 +6723,14 @@ class Layer:
                     surface_blit(self.__alpha_blit, dirty_rect_clipped, dirty_rect_adj)
             else:
                 self.custom_draw.surface = surface
+                use_grid = len(self.items) >= ITEM_GRID_MIN_ITEMS
+                items = self.items
                 for dirty_rect in dirty_rects:
                     set_clip(dirty_rect)
-                    for item in self.items:
+                    if use_grid:
+                        # Only check the items that are near the rect
+                        items = self.get_items_in_rect(dirty_rect)
+                    for item in items:
                         # Check if the item intersects with one of the rect that must
                         # be redraw
                         rect = item.rect
@@ -5525,9 +6764,105 @@ class Layer:
         """
         if not item in self.dirty_items:
             self.dirty_items.append(item)
+        self.index_item(item)
         if self.__changed_handler != None:
             self.__changed_handler(self.stage)
 
+    def index_item(self, item):
+        """
+        Updates the position of an item in the index of the layer. The area indexed
+        includes the bounds of the item and the area where it was drawn. This function
+        is invoked by the item when its bounds or its drawing area change.
+        - item: Item.
+        """
+        area = item.get_bounds()
+        rect = item.rect
+        if rect.width != 0 and rect.height != 0:
+            if area.width != 0 and area.height != 0:
+                area = area.union(rect)
+            else:
+                area = rect
+        if area.width == 0 or area.height == 0:
+            area = None
+        self.__grid.set(item, area)
+
+    def index_cell_item(self, item):
+        """
+        Updates the cells of an ItemCell in the cell index of the layer. This
+        function is invoked by the item when its position changes.
+        - item: ItemCell.
+        """
+        self.__cells.set(item)
+
+    def find_cell_item(self, type, position):
+        """
+        Gets the first ItemCell of the layer with the specified type and position,
+        or None if there isn't.
+        - type: Type of the item.
+        - position: Position (row, col).
+        """
+        items = self.__cells.find(type, position)
+        if len(items) == 0:
+            return None
+        if len(items) == 1:
+            return items[0]
+        return self.__sort_items(set(items))[0]
+
+    def get_cell_items(self, row, col, rows, cols):
+        """
+        Gets the list of ItemCell items, in the same order that in the layer, that
+        cover any cell of an area of the grid. The list could include items that
+        are near but outside of the area.
+        - row: First row of the area.
+        - col: First column of the area.
+        - rows: Number of rows.
+        - cols: Number of columns.
+        """
+        items = self.__cells.find_area(row, col, rows, cols)
+        if len(items) <= 1:
+            return list(items)
+        return self.__sort_items(items)
+
+    def mark_items_order_changed(self):
+        """
+        Marks that the order of the items was changed directly in the list of
+        items of the layer (without using add or remove).
+        """
+        self.__order = None
+
+    def get_items_in_rect(self, rect):
+        """
+        Gets the list of items, in the same order that in the layer, that are drawn
+        or have their bounds in an area. The list could include items that are near
+        but outside of the area.
+        - rect: Area.
+        """
+        return self.__sort_items(self.__grid.find(rect))
+
+    def get_items_at(self, x, y):
+        """
+        Gets the list of items, in the same order that in the layer, that are drawn
+        or have their bounds over the specified coordinates. Use is_over to check
+        if an item is really below the coordinates.
+        - x: X coordinate.
+        - y: Y coordinate.
+        """
+        if len(self.items) < ITEM_GRID_MIN_ITEMS:
+            return self.items
+        return self.__sort_items(self.__grid.find_point(x, y))
+
+    def __sort_items(self, items):
+        """
+        Sorts a set of items of the layer in the same order that in the layer.
+        - items: Set of items.
+        """
+        order = self.__order
+        if order == None or len(order) != len(self.items):
+            order = self.__order = dict([(item, k) for k, item in enumerate(self.items)])
+        items = [(order[item], item) for item in items if item in order]
+        items.sort()
+        return [item for k, item in items]
+
     def get_alpha(self):
         """
         Gets the alpha value associated with the layer. If alpha value is 0 the layer
@@ -5547,10 +6882,8 @@ class Layer:
             if self.__alpha == 255:
                 self.__alpha_buffer = None
                 self.__alpha_blit = None
-            else:
-                if self.__alpha_buffer != None:
-                    self.__alpha_blit = set_surface_alpha(self.__alpha_buffer, self.__alpha)
 
+            # The alpha value is applied to the buffer in the next update
             self.set_dirty()
 
     def get_stage(self):
@@ -5685,6 +7018,9 @@ class Layer:
         custom_draw = CustomDrawDelta(buffer, - bounds.left, - bounds.top)
         custom_draw.surface = buffer
         for item in self.items:
+            if not item.visible:
+                continue
+
             # Draw the item
             draw_function = item.draw_function
             if draw_function == None:
@@ -5699,6 +7035,92 @@ class Layer:
 
         return buffer, bounds
 
+    def __update_alpha_buffer(self, changed_rects):
+        """
+        Updates the buffer where the layer is rendered to draw it with an alpha
+        value, and the copy of the buffer with the alpha value applied (if the
+        blits can't apply it). The buffers are kept between frames, only the
+        areas that changed are rendered again.
+        - changed_rects: Rects (in stage coordinates) where the items changed.
+        """
+        if self.__alpha_buffer != None and len(changed_rects) > 0 and \
+            not self.__alpha_bounds.contains(self.get_bounds()):
+            # The items are outside the buffer, it must be created again
+            self.__alpha_buffer = None
+
+        if self.__alpha_buffer == None:
+            # Render the layer into a surface
+            self.__alpha_buffer, self.__alpha_bounds = self.render_into_surface()
+            self.__alpha_blit = None
+        elif len(changed_rects) > 0:
+            # Render only the areas that changed
+            changed_rects = self.__render_into_alpha_buffer(changed_rects)
+
+        if pixels.USE_SURFACE_ALPHA:
+            # The alpha value is applied when the buffer is drawn
+            self.__alpha_buffer.set_alpha(self.__alpha)
+            self.__alpha_blit = self.__alpha_buffer
+            self.__alpha_blit_alpha = self.__alpha
+            return
+
+        # The alpha value is rounded, so in a fade the copy with the alpha value is
+        # calculated again only when the rounded value changes
+        alpha = pixels.round_alpha(self.__alpha)
+        if self.__alpha_blit == None or self.__alpha_blit_alpha != alpha:
+            # Calculate the surface with the alpha value
+            self.__alpha_blit = set_surface_alpha(self.__alpha_buffer, alpha)
+            self.__alpha_blit_alpha = alpha
+        else:
+            # Apply the alpha value only in the areas that changed
+            alpha_blit = self.__alpha_blit
+            alpha_color = (255, 255, 255, alpha)
+            alpha_blit.set_clip(Rect(0, 0, 9999, 9999)) # We use a big rect instead None because the None value doesn't work with Pysco in the X0
+            for area in changed_rects:
+                alpha_blit.fill((0, 0, 0, 0), area)
+                alpha_blit.blit(self.__alpha_buffer, area, area, BLEND_RGBA_ADD)
+                alpha_blit.fill(alpha_color, area, BLEND_RGBA_MULT)
+
+    def __render_into_alpha_buffer(self, rects):
+        """
+        Draws again the items of the layer in some areas of the alpha buffer.
+        Returns the list of areas drawn (in buffer coordinates).
+        - rects: Rects (in stage coordinates) to draw.
+        """
+        buffer = self.__alpha_buffer
+        bounds = self.__alpha_bounds
+        buffer_rect = buffer.get_rect()
+        surface_blit = buffer.blit
+        custom_draw = CustomDrawDelta(buffer, - bounds.left, - bounds.top)
+        custom_draw.surface = buffer
+
+        # Join the rects to avoid drawing twice the same area
+        region = DirtyRegion()
+        for rect in rects:
+            region.add(rect.move(- bounds.left, - bounds.top).clip(buffer_rect))
+        areas = region.get_rects()
+
+        for area in areas:
+            buffer.set_clip(area)
+            buffer.fill((0, 0, 0, 0), area)
+            for item in self.get_items_in_rect(area.move(bounds.left, bounds.top)):
+                if not item.visible:
+                    continue
+
+                # Draw the item
+                draw_function = item.draw_function
+                if draw_function == None:
+                    # The item is an image, draw the image
+                    if item.area == None:
+                        surface_blit(item.surface, item.rect.move(-bounds.left, - bounds.top))
+                    else:
+                        surface_blit(item.surface, item.rect.move(-bounds.left, - bounds.top), item.area)
+                else:
+                    # It has a custom drawing function, invoke the function
+                    draw_function(item, custom_draw)
+        buffer.set_clip(Rect(0, 0, 9999, 9999)) # We use a big rect instead None because the None value doesn't work with Pysco in the X0
+
+        return areas
+
     def __set_clip(self, rect):
         """
         Set the clip in the set_clip_surface using the clip region of the
@@ -5800,6 +7222,13 @@ class LayerRace(Layer):
         self.image_index2 = 0
         self.image_step = 0
 
+    def is_dirty(self):
+        """
+        Determines if the layer must be updated in the next render. The race is
+        updated in every frame.
+        """
+        return True
+
     def get_speed(self):
         """
         Gets current speed of the vehicle.
@@ -5834,14 +7263,14 @@ class LayerRace(Layer):
 
     def set_speed_item(self, item):
         """
-        Set an ItemText to set the speed when it changes.
+        Set an ItemText (or ItemGlyphText) to set the speed when it changes.
         - item: Item.
         """
         self.__speed_item = item
 
     def set_distance_traveled_item(self, item):
         """
-        Set an ItemText to set the distance traveled when it changes.
+        Set an ItemText (or ItemGlyphText) to set the distance traveled when it changes.
         - item: Item.
         """
         self.__distance_traveled_item = item
@@ -5939,7 +7368,7 @@ class LayerRace(Layer):
     def update(self, dirty_rects, frame_delay):
         """
         Updates the items before draw it in the stage.
-        - dirty_rects: List where the parts of the stage that must be updated
+        - dirty_rects: DirtyRegion where the parts of the stage that must be updated
               are added.
         - frame_delay: Milliseconds elapsed from the previous frame.
         """
@@ -6063,7 +7492,7 @@ class LayerBuffered(Layer):
     def update(self, dirty_rects, frame_delay):
         """
         Updates the items before draw it in the stage.
-        - dirty_rects: List where the parts of the stage that must be updated
+        - dirty_rects: DirtyRegion where the parts of the stage that must be updated
               are added.
         - frame_delay: Milliseconds elapsed from the previous frame.
         """
@@ -6076,11 +7505,16 @@ class LayerBuffered(Layer):
         dirty_items_list = self.dirty_items
         self.dirty_items = []
 
-        # Updates the items
+        # Updates the items. The rects are joined in a region to avoid drawing
+        # twice the areas where the rects intersect
+        region = DirtyRegion()
+        for rect in dirty_rects_list:
+            region.add(rect)
         for item in dirty_items_list:
             dirty_rect = item.update(frame_delay)
             if dirty_rect != None:
-                dirty_rects_list.append(dirty_rect)
+                region.add(dirty_rect)
+        dirty_rects_list = region.get_rects()
 
         if len(dirty_rects_list) > 0:
             buffer = self.__buffer
@@ -6095,16 +7529,9 @@ class LayerBuffered(Layer):
             # Draw the items
             Layer.draw(self, buffer, dirty_rects_list)
 
-            # Append the dirty rects to the global list
+            # Add the dirty rects to the region of the stage
             for rect in dirty_rects_list:
-                # If the rect intersects with another, join them
-                k = rect.collidelist(dirty_rects)
-                while k != - 1:
-                    rect.union_ip(dirty_rects[k])
-                    del dirty_rects[k]
-                    k = rect.collidelist(dirty_rects)
-
-                dirty_rects.append(rect)
+                dirty_rects.add(rect)
 
 
     def draw(self, surface, dirty_rects):
@@ -4,6 +4,141 @@
 # Todos los derechos reservados.
 # All rights reserved.
 
+import weakref
+from bisect import bisect_right
+from cache import LRUCache
+
+# Number of widths of texts kept for each font whose widths are measured by the
+# font (instead of adding the advances of the glyphs)
+WORD_WIDTH_CACHE_SIZE = 512
+
+# Texts used to check if the width of a text is the sum of the widths of its
+# characters. If the font applies kerning or the glyphs overhang the widths
+# are measured by the font
+METRICS_CHECK_TEXTS = ["AV", "To", "Wa", "Ty", "LT", "f.", "ff", "fj", "r,", "AVAWAToLTY"]
+
+# Metrics of the fonts, indexed by font
+__metrics = weakref.WeakKeyDictionary()
+
+def get_font_metrics(font):
+    """
+    Gets the metrics of a font. The metrics are created the first time and
+    shared while the font is alive.
+    - font: Font.
+    """
+    metrics = __metrics.get(font)
+    if metrics == None:
+        metrics = __metrics[font] = FontMetrics(font)
+    return metrics
+
+class FontMetrics:
+    """
+    Measures the width of the texts rendered with a font without rendering or
+    measuring them with the font each time. The widths of the latin-1 characters
+    are measured once and the width of a text is the sum of the widths of its
+    characters (for str and unicode texts). If the font applies kerning (the sum
+    is not the width measured by the font) or the text has control characters
+    or characters that are not latin-1, the widths are measured by the font and
+    the widths of the last texts are cached.
+    """
+
+    def __init__(self, font):
+        """
+        Constructor.
+        - font: Font. Only a weak reference is kept, so the metrics (that are
+          indexed by the font) don't keep the font alive.
+        """
+        self.__font = weakref.ref(font)
+        self.__widths = LRUCache(WORD_WIDTH_CACHE_SIZE, WORD_WIDTH_CACHE_SIZE)
+        advances = {}
+        for code in xrange(32, 256):
+            char = chr(code)
+            advances[char] = font.size(char)[0]
+        for text in METRICS_CHECK_TEXTS:
+            if sum([advances[char] for char in text]) != font.size(text)[0]:
+                # The characters can't be measured one by one
+                advances = None
+                break
+        self.__advances = advances
+
+        # The texts loaded from yaml files are unicode if they have accents. The
+        # advances of the unicode characters are kept in other dictionary, because
+        # the comparison of the str and unicode keys with the same hash fails
+        self.__unicode_advances = None
+        if advances != None:
+            self.__unicode_advances = dict([(char.decode("latin-1"), width) for char, width in advances.items()])
+
+    def get_width(self, text):
+        """
+        Gets the width of a text rendered with the font.
+        - text: Text.
+        """
+        advances = self.__get_advances(text)
+        if advances != None:
+            try:
+                return sum([advances[char] for char in text])
+            except KeyError:
+                # The text has control characters
+                pass
+
+        width = self.__widths.get(text)
+        if width == None:
+            width = self.__font().size(text)[0]
+            self.__widths.put(text, width)
+        return width
+
+    def get_prefix_widths(self, text):
+        """
+        Gets a list with the widths of the beginnings of a text. The item i of
+        the list is the width of the first i characters (the first item is 0).
+        - text: Text.
+        """
+        advances = self.__get_advances(text)
+        if advances != None:
+            try:
+                widths = [0]
+                width = 0
+                for char in text:
+                    width += advances[char]
+                    widths.append(width)
+                return widths
+            except KeyError:
+                # The text has control characters
+                pass
+
+        font = self.__font()
+        return [0] + [font.size(text[:i])[0] for i in xrange(1, len(text) + 1)]
+
+    def fit(self, text, max_width):
+        """
+        Gets the number of characters from the beginning of a text that fit in
+        a width.
+        - text: Text.
+        - max_width: Width.
+        """
+        if max_width < 0:
+            return 0
+        return bisect_right(self.get_prefix_widths(text), max_width) - 1
+
+    def uses_advances(self):
+        """
+        Determines if the widths are calculated by adding the widths of the
+        characters (the font doesn't apply kerning).
+        """
+        return self.__advances != None
+
+    def __get_advances(self, text):
+        """
+        Gets the dictionary with the widths of the characters for the type of a
+        text, or None if the widths of the text must be measured by the font.
+        - text: Text.
+        """
+        if isinstance(text, str):
+            return self.__advances
+        if isinstance(text, unicode):
+            return self.__unicode_advances
+        return None
+
 def to_upper(text):
     """    
     Convert a text to uppercase.
@@ -139,6 +139,12 @@ def download_file(to, path, parameters=None, key=None, callback=None):
             return TaskResult(None, error=True)
     __send_queue.put(__PendingTask(__get_file, key, callback))
             
+def has_callbacks():
+    """
+    Returns True if there are callbacks to execute
+    """
+    return not __callbacks.empty()
+
 def get_callback():
     """
     Returns a callback to execute
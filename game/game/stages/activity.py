@@ -8,7 +8,7 @@ from framework.stage import assets, Layer, ItemText, ItemEvent, ItemImage
 from yaml import load
 from widgets.textbox import TextBox
 from utils import DictClass
-from pagination import Paginator
+from pagination import Paginator, TextPages
 from framework import web
 from game.data.datastore import WEB_DIR_ACT, WEB_DIR_POST, WEB_DIR_NEW_POST
 import pygame 
@@ -383,21 +383,8 @@ class Activity():
         data = DictClass(result.data)
         self.layers.view_post.title.set_text(self.title)
         self.layers.view_post.author.set_text(data.author_name + ":")
-        # Usamos una clase que tiene el metodo set_text para saber si hay que dividir el texto
-        items = []
-        next = Next()
-        layer = Layer()
-        def create_text(stage, next, text, data):
-            text_item = stage.create_text(data)[0]
-            set_text(next, text, text_item)
-            return text_item
-        layer.add(create_text(self.stage, next, data.text, self.layers.view_post.post.data))
-        items.append(layer)
-        while next.text:
-            layer = Layer()
-            layer.add(create_text(self.stage, next, next.text, self.layers.view_post.post.data))
-            items.append(layer)
-        paginator = Paginator(self.stage, items, self.data.pager_post)
+        pages = TextPages(self.stage, self.layers.view_post.post.data, data.text)
+        paginator = pages.create_paginator(self.data.pager_post)
         self.change_layer([self.layers.view_post.layer] +  paginator.get_layers() + [self.layers.logged.layer])
 
     def handle_new_post(self, *args, **kwargs):
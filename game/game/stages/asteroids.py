@@ -5,7 +5,7 @@
 # All rights reserved.
 
 
-from framework.stage import assets, ItemEvent, ItemImage, ItemText, Layer, Stage
+from framework.stage import assets, ItemEvent, ItemImage, ItemGlyphText, Layer, Stage
 from utils import DictClass
 from yaml import load
 import random
@@ -28,7 +28,7 @@ class Asteroid():
         image = assets.load_image(src)
         self.item = ItemImage(left, top, image)
         self.item.add_event_handler(ItemEvent.CLICK, self.handle_click)
-        self.text = ItemText(left, top, stage.font, 0, str(value), width = self.item.get_width(), height = self.item.get_height(), h_align = 2, v_align = 2)
+        self.text = ItemGlyphText(left, top, stage.font, 0, str(value), width = self.item.get_width(), height = self.item.get_height(), h_align = 2, v_align = 2)
         self.value = value
     
     def set_left(self, left):
@@ -77,7 +77,7 @@ class AsteroidsMinigame(GameStage):
         self.timer = DictClass({})
         image = assets.load_image(self.data.time.src)
         self.timer['skin'] = ItemImage(self.data.time.left, self.data.time.top, image)
-        self.timer['value'] = ItemText(self.data.time.left, self.data.time.top, self.font, 0, format_time(self.time), width = image.get_width(), height = image.get_height(), h_align = 2, v_align = 2)
+        self.timer['value'] = ItemGlyphText(self.data.time.left, self.data.time.top, self.font, 0, format_time(self.time), width = image.get_width(), height = image.get_height(), h_align = 2, v_align = 2)
         self.top_layer.add(self.timer.skin)
         self.top_layer.add(self.timer.value)
         
@@ -85,7 +85,7 @@ class AsteroidsMinigame(GameStage):
         self.score_board = DictClass({})
         image = assets.load_image(self.data.score.src)
         self.score_board['skin'] = ItemImage(self.data.score.left, self.data.score.top, image)
-        self.score_board['value'] = ItemText(self.data.score.left, self.data.score.top, self.font, 0, str(self.score), width = image.get_width(), height = image.get_height(), h_align = 2, v_align = 2)
+        self.score_board['value'] = ItemGlyphText(self.data.score.left, self.data.score.top, self.font, 0, str(self.score), width = image.get_width(), height = image.get_height(), h_align = 2, v_align = 2)
         self.top_layer.add(self.score_board.skin)
         self.top_layer.add(self.score_board.value)
         
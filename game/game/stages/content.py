@@ -7,7 +7,7 @@
 
 from framework.stage import  Layer
 from gamestage import GameStage
-from pagination import Paginator
+from pagination import TextPages
 from yaml import load
 from utils import DictClass
 
@@ -22,38 +22,14 @@ class Content():
         text_top = title_item.get_top() + title_item.get_height() + 10
         text_height = data.container.height - (text_top - data.container.top) 
         self.close = stage.create_button(data.close, self)[0]
-        self.__load_items(text, data, text_top, text_height)
-        self.paginator = Paginator(self.stage, self.items, data.get("pagination", None))
+        self.pages = TextPages(stage, data.text, text, text_top, text_height)
+        self.items = self.pages.layers
+        self.paginator = self.pages.create_paginator(data.get("pagination", None))
         for item in self.stage.create_items_from_yaml(data.other):
             self.layer.add(item)
         self.layer.add(self.title_text)
         self.layer.add(self.close)
 
-    def __load_items(self, text, data, top, height):
-        self.items = []
-        def create_text(stage, next, text, top, height):
-            text_item = stage.create_text(data.text)[0]
-            text_item.break_text_into(next)
-            text_item.set_text(text)
-            text_item.set_top(top)
-            text_item.set_dimensions(data.text.width, height)
-            text_item.break_text_into(None)
-            return text_item
-        # Usamos una clase que tiene el metodo set_text para saber si hay que dividir el texto
-        class Next:
-            def __init__(self):
-                self.text = None
-            def set_text(self, text):
-                self.text = text
-        next = Next()
-        layer = Layer()
-        layer.add(create_text(self.stage, next, text, top, height))
-        self.items.append(layer)
-        while next.text:
-            layer = Layer()
-            layer.add(create_text(self.stage, next, next.text, top, height))
-            self.items.append(layer)
-
     def handle_close(self, item, args):
         self.stop()
 
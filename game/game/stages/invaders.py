@@ -5,10 +5,12 @@
 # All rights reserved.
 
 
-from pygame import KEYDOWN, KEYUP, K_LEFT, K_RIGHT, Rect
+from pygame import KEYDOWN, KEYUP, K_LEFT, K_RIGHT
 from framework.engine import SCREEN_HEIGHT, SCREEN_WIDTH
-from framework.stage import assets, ItemEvent, ItemImage, ItemRect, ItemText, Layer, Stage
+from framework.stage import assets, ItemEvent, ItemImage, ItemRect, ItemGlyphText, Layer, Stage
 from framework.animations import fade_out_item
+from framework.simulation import FixedStepLoop
+from framework.collision import CollisionBody, CollisionWorld, get_inset
 import random
 from utils import DictClass
 from yaml import load
@@ -28,6 +30,13 @@ def w_choice(lst):
 
 DEBUG = False
 
+# Categories of the bodies in the collision world
+CHARACTER_CATEGORY = 1
+INVADER_CATEGORY = 2
+
+# Indicate if the collisions are refined with the pixel masks of the invaders
+PIXEL_COLLISIONS = False
+
 class Invader():
     def __init__(self, left, top, min, max, velocity, good, src, points, collision):
         self.left = left
@@ -38,8 +47,12 @@ class Invader():
         self.good = good
         image = assets.load_image(src)
         self.item = ItemImage(0, 0, image)
+        self.x = self.prev_x = 0
+        self.y = self.prev_y = 0
         self.points = points
         self.collision = collision
+        self.body = CollisionBody(self, image.get_width(), image.get_height(), get_inset(collision),
+            INVADER_CATEGORY, 0, image.surface)
         if max:
             self.delta = random.choice([-1, 1])
             self.delta = random.choice([-1.5, -1, 1, 1.5])
@@ -51,20 +64,28 @@ class Invader():
     def set_left(self, left):
         self.min -= left / 2
         self.max += left / 2
+        self.x = self.prev_x = left
         self.item.set_left(left)
         if DEBUG:
             self.debug_item.set_left(left + self.collision.left)
     
+    def set_top(self, top):
+        self.y = self.prev_y = top
+        self.item.set_top(top)
+        if DEBUG:
+            self.debug_item.set_top(top + self.collision.top)
+    
     def exit(self):
         self.item.exit()
         self.item = None
         self.collision = None
+        self.body = None
     
     def get_left(self):
-        return self.item.get_left() + self.collision.left
+        return self.x + self.collision.left
     
     def get_top(self):
-        return self.item.get_top() + self.collision.top
+        return self.y + self.collision.top
     
     def get_width(self):
         return self.item.get_width() - self.collision.left - self.collision.right
@@ -73,21 +94,26 @@ class Invader():
         return self.item.get_height() - self.collision.top - self.collision.bottom
     
     def move(self, time, velocity):
+        self.prev_x = self.x
+        self.prev_y = self.y
         if self.delta:
-            left = self.item.get_left()
+            left = self.x
             if left + self.delta > self.max or left + self.delta + self.item.get_width() > SCREEN_WIDTH:
                 self.delta = -1
                 self.delta = random.choice([-1.5, -1])
             elif left + self.delta < self.min or left + self.delta < 0:
                 self.delta = 1
                 self.delta = random.choice([1, 1.5])
-            left += self.delta * time * velocity * self.velocity
-            self.item.set_left(left)
-            if DEBUG:
-                self.debug_item.set_left(left + self.collision.left)
-        top = self.item.get_top() + time * velocity * self.velocity
+            self.x = left + self.delta * time * velocity * self.velocity
+        self.y += time * velocity * self.velocity
+    
+    def interpolate(self, alpha):
+        left = self.prev_x + (self.x - self.prev_x) * alpha
+        top = self.prev_y + (self.y - self.prev_y) * alpha
+        self.item.set_left(left)
         self.item.set_top(top)
         if DEBUG:
+            self.debug_item.set_left(left + self.collision.left)
             self.debug_item.set_top(top + self.collision.top)
         
 class InvadersMinigame(GameStage):
@@ -133,7 +159,7 @@ class InvadersMinigame(GameStage):
         self.score_board = DictClass({})
         image = assets.load_image(self.data.score.src)
         self.score_board['skin'] = ItemImage(self.data.score.left, self.data.score.top, image)
-        self.score_board['value'] = ItemText(self.data.score.left, self.data.score.top, self.font, 0, str(self.score), width = image.get_width(), height = image.get_height(), h_align = 2, v_align = 2)
+        self.score_board['value'] = ItemGlyphText(self.data.score.left, self.data.score.top, self.font, 0, str(self.score), width = image.get_width(), height = image.get_height(), h_align = 2, v_align = 2)
         self.top_layer.add(self.score_board.skin)
         self.top_layer.add(self.score_board.value)
         
@@ -151,7 +177,11 @@ class InvadersMinigame(GameStage):
         if DEBUG:
             self.debug_character = ItemRect(left, top, width, height, border = (255, 255, 255))
         self.invaders = []
-
+        self.world = CollisionWorld(use_masks = PIXEL_COLLISIONS)
+        self.character_body = CollisionBody(self.character, self.character.get_width(), self.character.get_height(),
+            get_inset(self.data.collision), CHARACTER_CATEGORY, INVADER_CATEGORY)
+        self.world.add(self.character_body, self.character.get_left(), self.character.get_top())
+        self.simulation = FixedStepLoop(self, self.MOVE_INTERVAL, self.step, self.interpolate)
         
         # Load the sound
         self.item_found_sound = assets.load_sound('DGI_item_found.ogg')
@@ -187,52 +217,62 @@ class InvadersMinigame(GameStage):
         left = random.randint(0, SCREEN_WIDTH - invader.item.get_image().get_width())
         invader.set_left(left)
         top = -invader.item.get_image().get_height()
-        invader.item.set_top(top)
+        invader.set_top(top)
         self.invaders.append(invader)
+        self.world.add(invader.body, invader.x, invader.y)
         
         self.main_layer.add(invader.item)
         if DEBUG:
             self.main_layer.add(invader.debug_item)
     
-    def move_invaders(self, key, data):
+    def step(self, time):
+        self.move_invaders(time)
+        if self.simulation.is_running():
+            self.manage_key(time)
+    
+    def interpolate(self, alpha):
+        for invader in self.invaders:
+            invader.interpolate(alpha)
+    
+    def move_invaders(self, time):
         for item in self.text_indicators:
             item.set_top(item.get_top() - 2)
             
+        removed = []
         for invader in self.invaders:
-            invader.move(self.MOVE_INTERVAL, self.velocity)
-            if (invader.item.get_top() > SCREEN_HEIGHT):
-                self.remove_invader(invader)
+            invader.move(time, self.velocity)
+            if (invader.y > SCREEN_HEIGHT):
+                removed.append(invader)
+            else:
+                self.world.move(invader.body, invader.x, invader.y)
+        for invader in removed:
+            self.remove_invader(invader)
+        
+        self.world.move(self.character_body, self.character.get_left(), self.character.get_top())
+        for character_body, body in self.world.step():
+            invader = body.data
+            if invader.good:
+                self.character_animation.footsteps_concrete_sound.stop()
+                self.item_found_sound.play()
+                self.character_animation.first_walking = True
+                
+                self.score += invader.points
+                self.score_board.value.set_text(str(self.score))
+                self.top_layer.add(self.good_indicator)
+                item = ItemGlyphText(invader.get_left(), invader.get_top(), self.font, 0, "+" + str(invader.points), h_align = 2, v_align = 2)
+                self.text_indicators.append(item)
+                self.top_layer.add(item)
+                fade_out_item(item, True, self.GOOD_INDICATOR_INTERVAL)
+                self.start_timer(3, self.GOOD_INDICATOR_INTERVAL, self.remove_good_indicator)
             else:
-                left = self.character.get_left() + self.data.collision.left
-                top = self.character.get_top() + self.data.collision.top
-                width = self.character.get_width() - self.data.collision.left - self.data.collision.right
-                height = self.character.get_height() - self.data.collision.top - self.data.collision.bottom
-                character = Rect(left, top, width, height)
-                item = Rect(invader.get_left(), invader.get_top(), invader.get_width(), invader.get_height())
-                k = character.collidelist([item])
-                if k != -1:
-                    if invader.good:
-                        self.character_animation.footsteps_concrete_sound.stop()
-                        self.item_found_sound.play()
-                        self.character_animation.first_walking = True
-                        
-                        self.score += invader.points
-                        self.score_board.value.set_text(str(self.score))
-                        self.top_layer.add(self.good_indicator)
-                        item = ItemText(invader.get_left(), invader.get_top(), self.font, 0, "+" + str(invader.points), h_align = 2, v_align = 2)
-                        self.text_indicators.append(item)
-                        self.top_layer.add(item)
-                        fade_out_item(item, True, self.GOOD_INDICATOR_INTERVAL)
-                        self.start_timer(3, self.GOOD_INDICATOR_INTERVAL, self.remove_good_indicator)
-                    else:
-                        self.stop_timer(1)
-                        self.stop_timer(2)
-                        self.game_over()
-                        return
-                    self.remove_invader(invader)
+                self.stop_timer(1)
+                self.game_over()
+                return
+            self.remove_invader(invader)
     
     def remove_invader(self, invader):
         self.invaders.remove(invader)
+        self.world.remove(invader.body)
         self.main_layer.remove(invader.item)
         invader.exit()
         if DEBUG:
@@ -250,9 +290,8 @@ class InvadersMinigame(GameStage):
     
     def start_game(self):
         self.start_timer(1, self.interval, self.create_invader)
-        self.start_timer(2, self.MOVE_INTERVAL, self.move_invaders)
         self.start_timer(4, self.DIFFICULTY_INTERVAL, self.increase_difficulty)
-        self.start_timer(0, 30, self.manage_key)
+        self.simulation.start()
         
     def show_board(self):
         self.main_layer.add(self.character)
@@ -267,7 +306,7 @@ class InvadersMinigame(GameStage):
         if  e.type == KEYUP:
             self.key = None
             
-    def manage_key(self, key, data):
+    def manage_key(self, time):
         delta = 0
         if self.key == K_LEFT:
             delta = -8
@@ -278,7 +317,7 @@ class InvadersMinigame(GameStage):
             self.character.set_left(left)
             if DEBUG:
                 self.debug_character.set_left(left + self.data.collision.left)
-            self.character_animation.update(self.MOVE_INTERVAL, delta_left = delta)
+            self.character_animation.update(time, delta_left = delta)
             
     def game_over(self):
         self.good_indicator.set_visible(False)
@@ -286,9 +325,8 @@ class InvadersMinigame(GameStage):
         self.lose_hit_sound.play()
         self.lose_music_sound.play()
         
-        self.stop_timer(0)
+        self.simulation.stop()
         self.stop_timer(1)
-        self.stop_timer(2)
         self.stop_timer(3)
         self.stop_timer(4)
         self.top_layer.remove(self.good_indicator)
@@ -304,6 +342,7 @@ class InvadersMinigame(GameStage):
         for invader in self.invaders:
             invader.exit()
         self.invaders = None
+        self.world.clear()
     
     def go_back(self, *args, **kwargs):
         from game.stages.map import Map
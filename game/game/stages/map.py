@@ -13,9 +13,14 @@ from activity import Activity, ItemTextTab
 from math import sin, cos, fabs
 from utils import DictClass
 from framework.stage import assets, ItemImage, Layer
+from framework.cache import LRUCache
+import pygame
+import numpy
 from yaml import load
 from character import Character 
 from math import sqrt
+from bisect import bisect_left, bisect_right
+from timeit import default_timer
 
 
 class ExitDialog():
@@ -49,38 +54,230 @@ class ExitDialog():
      
 
 class MapManager():
+    """
+    Keeps the items of a layer sorted by depth (the bottom of the items). The
+    static items are sorted once, and when an item moves only that item is
+    placed again, searching its position in the sorted depths.
+    """
     
     def __init__(self, stage, character, layer):
         self.character = character
-        self.elements = list(layer.items)
-        self.sort_elements()
         self.layer = layer
-        layer.empty()
-        [layer.add(element) for element in self.elements]
         self.stage = stage
-        for element in self.elements:
-            self.layer.add(element)
+        elements = list(layer.items)
+        elements.sort(key = self.get_depth)
+        layer.empty()
+        for element in elements:
+            layer.add(element)
+        
+        # Depths of the items, in the same order that in the layer
+        self.depths = [self.get_depth(element) for element in elements]
+        self.character_index = layer.index_of(character)
     
-    def sort_elements(self):
-        self.elements.sort(lambda x, y: cmp(x.get_top() + x.get_height(), y.get_top() + y.get_height()))
+    def get_depth(self, element):
+        return element.get_top() + element.get_height()
 
     def update(self):
-        last_index = self.elements.index(self.character)
-        self.sort_elements()
-        new_index = self.elements.index(self.character)
-        if last_index != new_index:
-            self.layer.remove(self.character)
-            self.layer.add(self.character, new_index)
+        self.character_index = self.update_item(self.character, self.character_index)
+    
+    def update_item(self, item, index = None):
+        """
+        Moves an item of the layer to the position of its current depth. The
+        items with the same depth keep their order. Returns the new index of
+        the item.
+        - item: Item whose position changed.
+        - index: Current index of the item in the layer, None to search it.
+        """
+        layer = self.layer
+        if index == None or index >= len(layer.items) or layer.items[index] is not item:
+            index = layer.index_of(item)
+        depths = self.depths
+        depth = self.get_depth(item)
+        if depths[index] == depth:
+            return index
+        
+        del depths[index]
+        new_index = min(max(index, bisect_left(depths, depth)), bisect_right(depths, depth))
+        depths.insert(new_index, depth)
+        if new_index != index:
+            layer.move_item(item, new_index)
+        return new_index
     
     def exit(self):
         self.character = None
-        self.elements = None
+        self.depths = None
         self.layer = None
         self.stage = None
         
 
 COLLISION_COLOR = (0, 0, 0, 255)
 ENTRANCE_COLOR = (0, 0, 255, 255)
+
+# Maximum number of bytes used by the collision maps kept for the quadrants
+COLLISION_CACHE_MAX_BYTES = 4 * 1024 * 1024
+
+# Collision maps of the quadrants by (quadrant, unlocked level)
+__collision_maps = LRUCache(COLLISION_CACHE_MAX_BYTES)
+
+class CollisionMap():
+    """
+    Combines the collision images of a quadrant (with COLLISION_COLOR in the
+    pixels where the character can't walk) and its entrance image in boolean
+    grids, so each point is checked with a single lookup instead of reading
+    the pixels of every image. A point is blocked if it has COLLISION_COLOR in
+    any image that contains it, or if no image contains it.
+    """
+
+    def __init__(self, layers, entrance):
+        """
+        Constructor.
+        - layers: List of tuples (image, trans_x, trans_y) with the collision
+          images and the translation of each one.
+        - entrance: Image of the entrance, None if the quadrant doesn't have it.
+        """
+        if len(layers) > 0:
+            left = min([-trans_x for image, trans_x, trans_y in layers])
+            top = min([-trans_y for image, trans_x, trans_y in layers])
+            right = max([image.get_width() - trans_x for image, trans_x, trans_y in layers])
+            bottom = max([image.get_height() - trans_y for image, trans_x, trans_y in layers])
+        else:
+            left = top = right = bottom = 0
+        self.__left = left
+        self.__top = top
+        self.__width = right - left
+        self.__height = bottom - top
+
+        # The free points are in some image and they aren't blocked in any image
+        free = numpy.zeros((self.__width, self.__height), numpy.bool_)
+        blocked = numpy.zeros((self.__width, self.__height), numpy.bool_)
+        for image, trans_x, trans_y in layers:
+            x = -trans_x - left
+            y = -trans_y - top
+            width, height = image.get_size()
+            grid = self.__get_color_grid(image, COLLISION_COLOR)
+            blocked[x:x + width, y:y + height] |= grid
+            free[x:x + width, y:y + height] |= ~grid
+        free &= ~blocked
+        self.__free = free
+
+        if entrance != None:
+            self.__entrance = self.__get_color_grid(entrance, ENTRANCE_COLOR)
+        else:
+            self.__entrance = None
+
+    def is_blocked(self, left, top):
+        """
+        Determines if the character can't walk in a point.
+        - left: X coordinate (integer).
+        - top: Y coordinate (integer).
+        """
+        x = left - self.__left
+        y = top - self.__top
+        if x < 0 or y < 0 or x >= self.__width or y >= self.__height:
+            return True
+        return not self.__free.item(x, y)
+
+    def is_entrance(self, left, top):
+        """
+        Determines if a point is in the entrance of the quadrant.
+        - left: X coordinate.
+        - top: Y coordinate.
+        """
+        entrance = self.__entrance
+        if entrance is None:
+            return False
+        width, height = entrance.shape
+        return left >= 0 and top >= 0 and left < width and top < height \
+            and entrance.item(int(left), int(top))
+
+    def get_bytes(self):
+        """
+        Returns the number of bytes used by the grids.
+        """
+        size = self.__free.nbytes
+        if self.__entrance is not None:
+            size += self.__entrance.nbytes
+        return size
+
+    def __get_color_grid(self, image, color):
+        """
+        Returns a boolean grid (indexed by x, y) with the pixels of an image
+        that have the specified color.
+        - image: Surface.
+        - color: Color (r, g, b, a).
+        """
+        grid = (pygame.surfarray.array3d(image) == color[:3]).all(2)
+        grid &= pygame.surfarray.array_alpha(image) == color[3]
+        return grid
+
+def get_collision_map(quadrant, unlocked_level, data):
+    """
+    Gets the collision map of a quadrant, creating it if it isn't in the cache.
+    - quadrant: Index of the quadrant.
+    - unlocked_level: Unlocked level, it determines the collision images used.
+    - data: Data of the quadrant (loaded from its yaml file).
+    """
+    key = (quadrant, unlocked_level)
+    collision_map = __collision_maps.get(key)
+    if collision_map != None:
+        return collision_map
+
+    layers = []
+    if "collision" in data:
+        base_data = data.collision.base
+        layers.append((assets.load_mask(base_data.src), base_data.get("trans_x", 0), base_data.get("trans_y", 0)))
+        if unlocked_level >= 3:
+            layers.append((assets.load_mask(data.collision.trash.src), 0, 0))
+        if unlocked_level >= 4:
+            layers.append((assets.load_mask(data.collision.lights.src), 0, 0))
+        if unlocked_level >= 5 and "vegetation" in data.collision:
+            layers.append((assets.load_mask(data.collision.vegetation.src), 0, 0))
+    if "entrance" in data:
+        entrance = assets.load_mask(data.entrance.src)
+    else:
+        entrance = None
+    collision_map = CollisionMap(layers, entrance)
+    __collision_maps.put(key, collision_map, collision_map.get_bytes())
+    return collision_map
+
+# Quadrants that can be reached walking from each quadrant (the borders crossed in
+# Map.move_character)
+QUADRANT_NEIGHBOURS = {1: (2, 4), 2: (1, 3), 3: (2, 4), 4: (1, 3)}
+
+# Time in milliseconds between the attempts to prefetch the neighbours of the quadrant
+PREFETCH_INTERVAL = 100
+
+class Quadrant():
+    """
+    Built state of a quadrant of the map: its layers, collision map and the
+    class of the stage of its entrance. The quadrants adjacent to the current
+    one are built in advance, so crossing a border only swaps the layers.
+    """
+
+    def __init__(self, index, named_layers, layers, collision_map, entrance_class):
+        """
+        Constructor.
+        - index: Index of the quadrant.
+        - named_layers: Object with the layers that have name as attributes.
+        - layers: List of layers.
+        - collision_map: CollisionMap.
+        - entrance_class: Class of the stage of the entrance, None if the
+          quadrant doesn't have entrance.
+        """
+        self.index = index
+        self.named_layers = named_layers
+        self.layers = layers
+        self.collision_map = collision_map
+        self.entrance_class = entrance_class
+
+    def exit(self):
+        for layer in self.layers:
+            layer.exit()
+        self.named_layers = None
+        self.layers = None
+        self.collision_map = None
+        self.entrance_class = None
+
 class Map(GameStage):
     def __init__(self, game):
         GameStage.__init__(self, game)
@@ -94,8 +291,11 @@ class Map(GameStage):
         self.v_key = None
         self.map_character = None
         self.named_layers = None
-        self.collisions = None
+        self.collision_map = None
         self.map_manager = None
+        self.quadrant = None
+        self.quadrants = {}
+        self.reset_quadrant_stats()
         
         if self.game.datastore.datamodel.current_map_index:
             self.current_map_index = self.game.datastore.datamodel.current_map_index
@@ -110,17 +310,78 @@ class Map(GameStage):
     def set_up_background(self):
         return
 
+    def create_quadrant(self, index):
+        data = DictClass(load(file('data/map/quadrant_%d.yaml' % index)))
+        named_layers, layers = self.create_layers(data["layers"])
+        collision_map = get_collision_map(index, self.game.datastore.datamodel.unlocked_level, data)
+        entrance_class = None
+        if "entrance" in data:
+            to = data.entrance.to
+            index_class = to.rfind(".")
+            if (index_class > 1):
+                entrance_class = getattr(__import__(to[:index_class], globals(), locals(), to[index_class+1:]), to[index_class+1:])
+            else:
+                entrance_class = globals()[to]
+        return Quadrant(index, named_layers, layers, collision_map, entrance_class)
+
+    def prefetch_quadrant(self, key, data):
+        # Wait until the character stops, the quadrants are built while the
+        # player isn't walking
+        if self.h_key or self.v_key:
+            return
+        for index in QUADRANT_NEIGHBOURS[self.current_map_index]:
+            if not index in self.quadrants:
+                self.quadrants[index] = self.create_quadrant(index)
+                self.quadrant_stats["prefetched"] += 1
+                return
+        self.stop_timer("prefetch")
+
+    def get_quadrant_stats(self):
+        """
+        Gets the statistics of the quadrant changes as a dictionary with the
+        quadrants found already built (hits), the quadrants built when the
+        border is crossed (misses), the quadrants built in advance (prefetched),
+        the number of changes (swaps) and the total and maximum time of the
+        changes in milliseconds.
+        """
+        return dict(self.quadrant_stats)
+
+    def reset_quadrant_stats(self):
+        self.quadrant_stats = {"hits": 0, "misses": 0, "prefetched": 0, "swaps": 0,
+                               "swap_time": 0.0, "max_swap_time": 0.0}
+
     def load_quadrant(self):
-        # remove the character before it gets destroyed
+        start_time = default_timer()
+        # remove the character before the layers change
         if self.named_layers and hasattr(self.named_layers, "character"):
             self.named_layers.character.remove(self.map_character.item)
         if self.layers:
             self.remove_layer(self.gui)
+        previous = self.quadrant
         for layer in self.layers:
-            layer.exit()
+            if previous == None or not layer in previous.layers:
+                layer.exit()
         self.empty_layers()
-        data = DictClass(load(file('data/map/quadrant_%d.yaml' % self.current_map_index)))
-        self.named_layers, layers = self.create_layers(data["layers"])
+        if previous != None:
+            # The previous quadrant is a neighbour of the new one
+            self.quadrants[previous.index] = previous
+
+        quadrant = self.quadrants.pop(self.current_map_index, None)
+        if quadrant == None:
+            self.quadrant_stats["misses"] += 1
+            quadrant = self.create_quadrant(self.current_map_index)
+        else:
+            self.quadrant_stats["hits"] += 1
+        self.quadrant = quadrant
+
+        # Release the quadrants that aren't neighbours of the new one
+        neighbours = QUADRANT_NEIGHBOURS.get(self.current_map_index, ())
+        for index in self.quadrants.keys():
+            if not index in neighbours:
+                self.quadrants.pop(index).exit()
+
+        self.named_layers = quadrant.named_layers
+        layers = quadrant.layers
         self.named_layers.character.add(self.map_character.item)
         
         if self.game.datastore.datamodel.map_character_left:
@@ -129,56 +390,10 @@ class Map(GameStage):
         if self.game.datastore.datamodel.map_character_top:
             self.map_character.item.set_top(self.game.datastore.datamodel.map_character_top)
             self.game.datastore.datamodel.map_character_top = None
-            
-        class Collision():
-            def __init__(self, collision_map, trans_x = 0, trans_y = 0):
-                self.collision_map = collision_map
-                self.trans_x = trans_x
-                self.trans_y = trans_y
-            
-            def get_at(self, pos):
-                return self.collision_map.get_at((pos[0] + self.trans_x, pos[1] + self.trans_y))
-            
-            def bottom(self):
-                return self.collision_map.get_height() - self.trans_y
-            
-            def left(self):
-                return -self.trans_x
-            
-            def right(self):
-                return self.collision_map.get_width() - self.trans_x
-            
-            def top(self):
-                return -self.trans_y 
-             
-            def exit(self):
-                self.collision_map = None
-                
-        if "collision" in data:
-            if self.collisions:
-                for col in self.collisions:
-                    col.exit()
-            self.collisions = []
-            base_data = data.collision.base
-            self.collisions.append(Collision(assets.load_mask(base_data.src), base_data.get("trans_x", 0), base_data.get("trans_y", 0)))
-            if self.game.datastore.datamodel.unlocked_level >= 3:
-                self.collisions.append(Collision(assets.load_mask(data.collision.trash.src)))
-            if self.game.datastore.datamodel.unlocked_level >= 4:
-                self.collisions.append(Collision(assets.load_mask(data.collision.lights.src)))
-            if self.game.datastore.datamodel.unlocked_level >= 5  and "vegetation" in data.collision:
-                self.collisions.append(Collision(assets.load_mask(data.collision.vegetation.src)))
-        else:
-            self.collisions = []
-        if "entrance" in data:
-            self.entrance = assets.load_mask(data.entrance.src)
-            to = data.entrance.to
-            index = to.rfind(".")
-            if (index > 1):
-                self.entrance_class = getattr(__import__(to[:index], globals(), locals(), to[index+1:]), to[index+1:])
-            else:
-                self.entrance_class = globals()[to]
-        else:
-            self.entrance = None
+        
+        self.collision_map = quadrant.collision_map
+        if quadrant.entrance_class != None:
+            self.entrance_class = quadrant.entrance_class
         if self.map_manager:
             self.map_manager.exit()
         self.map_manager = MapManager(self, self.map_character.item, self.named_layers.character)
@@ -188,6 +403,13 @@ class Map(GameStage):
         
         # Start processing events after everything is loaded
         self.start_timer(0, self.INTERVAL, self.manage_key)
+        self.start_timer("prefetch", PREFETCH_INTERVAL, self.prefetch_quadrant)
+
+        swap_time = (default_timer() - start_time) * 1000.0
+        stats = self.quadrant_stats
+        stats["swaps"] += 1
+        stats["swap_time"] += swap_time
+        stats["max_swap_time"] = max(stats["max_swap_time"], swap_time)
 
     def prepare(self):
         data = DictClass(load(file('data/map/common.yaml')))
@@ -293,12 +515,12 @@ class Map(GameStage):
         self.tests = None
         self.map_character.exit()
         self.map_character = None
-        if self.collisions:
-            for col in self.collisions:
-                col.exit()
-        self.collisions = None
+        self.collision_map = None
         self.named_layers = None
-        self.entrance = None
+        for quadrant in self.quadrants.values():
+            quadrant.exit()
+        self.quadrants = None
+        self.quadrant = None
         if self.map_manager:
             self.map_manager.exit()
             self.map_manager = None
@@ -446,12 +668,7 @@ class Map(GameStage):
     def check_entrance(self, left, top):
         if self.game.datastore.levels[self.game.datastore.datamodel.level].place_quadrant != self.current_map_index - 1:
             return False
-        entrance = self.entrance
-        if not entrance: return False
-        c_width = entrance.get_width()
-        c_height = entrance.get_height()
-        return left >= 0 and top >= 0 and left < c_width and top < c_height \
-            and entrance.get_at((int(left), int(top))) == ENTRANCE_COLOR
+        return self.collision_map.is_entrance(left, top)
 
     def handle_level_change(self):
         if self.game.datastore.datamodel.level < 4:
@@ -463,14 +680,7 @@ class Map(GameStage):
             self.game.set_stage(Map(self.game))
 
     def check_collition_color(self, left, top):
-        exists = False
-        for collision in self.collisions:
-            if left < collision.right() and left >= collision.left() and top < collision.bottom()\
-                and top >= collision.top():
-                if collision.get_at((left, top)) == COLLISION_COLOR:
-                    return True
-                exists = True
-        return not exists
+        return self.collision_map.is_blocked(left, top)
             
     def check_collition(self, left, top, new_left, new_top):
         if self.check_collition_color(int(new_left), int(new_top)):
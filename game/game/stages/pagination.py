@@ -11,11 +11,13 @@ from framework.engine import SCREEN_WIDTH
 from math import ceil
 
 class Paginator():
-    def __init__(self, stage, items, optional_data = None):
+    def __init__(self, stage, items, optional_data = None, load_page = None):
         self.layer = Layer()
         self.items_layer = Layer()
         self.items = items
         self.stage = stage
+        # Function invoked with the index and the layer of a page before show it
+        self.load_page = load_page
         from yaml import load
         data = load(file('data/common/pagination.yaml'))
         if optional_data is not None:
@@ -58,6 +60,7 @@ class Paginator():
             item.exit()
         self.items = None
         self.stage = None
+        self.load_page = None
         self.previous.exit()
         self.previous = None
         self.next.exit()
@@ -79,6 +82,8 @@ class Paginator():
         self.current_layer.set_visible(False)
         if len(self.items) > 0:
             self.current_layer = self.items[self.current - 1]
+            if self.load_page:
+                self.load_page(self.current - 1, self.current_layer)
         self.current_layer.set_visible(True)
     
     def update_buttons(self):
@@ -134,6 +139,36 @@ class Paginator():
     def get_layers(self):
         return [self.layer] + self.items
 
+class TextPages():
+    # Pages of a long text shown with a Paginator. The text is wrapped once
+    # and the item of each page is created the first time the page is shown
+    def __init__(self, stage, data, text, top = None, height = None):
+        self.stage = stage
+        self.data = data
+        self.top = top
+        self.height = height
+        item = self.create_item()
+        self.layout = item.create_layout(text)
+        item.exit()
+        self.layers = [Layer() for i in xrange(self.layout.get_page_count())]
+
+    def create_item(self):
+        item = self.stage.create_text(self.data)[0]
+        if self.top is not None:
+            item.set_top(self.top)
+        if self.height is not None:
+            item.set_dimensions(self.data["width"], self.height)
+        return item
+
+    def load_page(self, index, layer):
+        if len(layer.items) == 0:
+            item = self.create_item()
+            item.set_text(self.layout.get_page_text(index))
+            layer.add(item)
+
+    def create_paginator(self, optional_data = None):
+        return Paginator(self.stage, self.layers, optional_data, self.load_page)
+
 class Pagination(GameStage):
     
     def initialize(self):
@@ -5,14 +5,16 @@
 # All rights reserved.
 
 
-from pygame import KEYDOWN, KEYUP, K_UP, Rect
+from pygame import KEYDOWN, KEYUP, K_UP
 from framework.engine import SCREEN_HEIGHT, SCREEN_WIDTH
-from framework.stage import assets, ItemEvent, ItemImage, ItemRect, ItemText, Layer, Stage
+from framework.stage import assets, ItemEvent, ItemImage, ItemRect, ItemGlyphText, Layer, Stage
 import random
 from utils import DictClass
 from yaml import load
 from character import Character
 from framework.animations import fade_out_item
+from framework.simulation import FixedStepLoop
+from framework.collision import CollisionBody, CollisionWorld
 from gameintro import Intro
 from game.stages.gamestage import GameStage
 from pygame import Color
@@ -27,6 +29,13 @@ def w_choice(lst):
 
 DEBUG = False
 
+# Categories of the bodies in the collision world
+CHARACTER_CATEGORY = 1
+INVADER_CATEGORY = 2
+
+# Indicate if the collisions are refined with the pixel masks of the invaders
+PIXEL_COLLISIONS = False
+
 class Invader():
     def __init__(self, good, src, left, right, top, points):
         self.good = good
@@ -36,10 +45,25 @@ class Invader():
         self.top = top
         image = assets.load_image(src)
         item = self.item = ItemImage(0, 0, image)
+        self.x = self.prev_x = 0
+        self.y = 0
+        self.body = CollisionBody(self, image.get_width(), image.get_height(), (left, top, right, 0),
+            INVADER_CATEGORY, 0, image.surface)
         if DEBUG:
             self.debug_item = ItemRect(item.get_left() + left, item.get_top() + top, item.get_width() - left - right, 
                 item.get_height() - top, border = (255, 255, 255))
     def set_left(self, left):
+        self.x = self.prev_x = left
+        self.item.set_left(left)
+        if DEBUG:
+            self.debug_item.set_left(left + self.left)
+    
+    def move(self, distance):
+        self.prev_x = self.x
+        self.x -= distance
+    
+    def interpolate(self, alpha):
+        left = self.prev_x + (self.x - self.prev_x) * alpha
         self.item.set_left(left)
         if DEBUG:
             self.debug_item.set_left(left + self.left)
@@ -48,15 +72,13 @@ class Invader():
         self.good = None
         self.item.exit()
         self.item = None
+        self.body = None
         
     def set_top(self, top):
+        self.y = top
         self.item.set_top(top)
         if DEBUG:
             self.debug_item.set_top(top + self.top)
-    def get_aabb(self):
-        item = self.item
-        return Rect(item.get_left() + self.left, item.get_top() + self.top, 
-            item.get_width() - self.left - self.right, item.get_height() - self.top)
         
 class RunningMinigame(GameStage):
     CREATE_INTERVAL = 1000.0
@@ -94,7 +116,7 @@ class RunningMinigame(GameStage):
         self.score_board = DictClass({})
         image = assets.load_image(self.data.score.src)
         self.score_board['skin'] = ItemImage(self.data.score.left, self.data.score.top, image)
-        self.score_board['value'] = ItemText(self.data.score.left, self.data.score.top, self.font, 
+        self.score_board['value'] = ItemGlyphText(self.data.score.left, self.data.score.top, self.font, 
             0, str(self.score), width = image.get_width(), height = image.get_height(),
             h_align = 2, v_align = 2)
         self.score_layer.add(self.score_board.skin)
@@ -115,9 +137,15 @@ class RunningMinigame(GameStage):
         self.character_start_top = SCREEN_HEIGHT - self.character.get_height()
         self.character.set_top(self.character_start_top)
         self.character.set_left(25)
+        self.character_y = self.character_prev_y = self.character_start_top
         self.invaders = []
         self.velocity = self.data.start.velocity
         self.jumping = False
+        self.world = CollisionWorld(use_masks = PIXEL_COLLISIONS)
+        self.character_body = CollisionBody(self.character, self.character.get_width(), self.character.get_height(),
+            (0, 0, 0, 0), CHARACTER_CATEGORY, INVADER_CATEGORY)
+        self.world.add(self.character_body, self.character.get_left(), self.character_y)
+        self.simulation = FixedStepLoop(self, self.MOVE_INTERVAL, self.step, self.interpolate)
         
         # Load the sound
         self.item_found_sound = assets.load_sound('DGI_item_found.ogg')
@@ -137,7 +165,7 @@ class RunningMinigame(GameStage):
             inv = self.data.invaders.good[index]
         else:
             if self.last_bad_invader and \
-                SCREEN_WIDTH - (self.last_bad_invader.item.get_left() + \
+                SCREEN_WIDTH - (self.last_bad_invader.x + \
                 self.last_bad_invader.item.get_width()) < self.bad_distance:
                 return
             index = random.randint(0, len(self.data.invaders.bad) - 1)
@@ -157,44 +185,59 @@ class RunningMinigame(GameStage):
         invader.set_left(left)
         invader.set_top(top)
         self.invaders.append(invader)
+        self.world.add(invader.body, invader.x, invader.y)
         self.main_layer.add(invader.item)
         if DEBUG:
             self.main_layer.add(invader.debug_item)
     
-    def move_invaders(self, key, data):
+    def step(self, time):
+        self.move_invaders(time)
+        if self.simulation.is_running():
+            self.manage_key(time)
+    
+    def interpolate(self, alpha):
+        for invader in self.invaders:
+            invader.interpolate(alpha)
+        self.character.set_top(self.character_prev_y + (self.character_y - self.character_prev_y) * alpha)
+    
+    def move_invaders(self, time):
         for item in self.text_indicators:
             item.set_top(item.get_top() - 2)
+        removed = []
         for invader in self.invaders:
-            invader.set_left(invader.item.get_left() - self.MOVE_INTERVAL * self.velocity)
-            if (invader.item.get_left() + invader.item.get_width() < 0):
-                self.remove_invader(invader)
+            invader.move(time * self.velocity)
+            if (invader.x + invader.item.get_width() < 0):
+                removed.append(invader)
             else:
-                character = Rect(self.character.get_left(), self.character.get_top(), 
-                    self.character.get_width(), self.character.get_height())
-                item = invader.get_aabb()
-                k = character.collidelist([item])
-                if k != -1:
-                    if invader.good:
-                        self.character_animation.footsteps_concrete_sound.stop()
-                        self.item_found_sound.play()
-                        self.character_animation.first_walking = True
-                        
-                        self.score += invader.points
-                        self.score_board.value.set_text(str(self.score))
-                        self.good_indicator.set_visible(True)
-                        item = ItemText(invader.item.get_left(), invader.item.get_top(), 
-                            self.font, 0, "+" + str(invader.points), h_align = 2, v_align = 2)
-                        self.text_indicators.append(item)
-                        self.main_layer.add(item)
-                        fade_out_item(item, True, self.GOOD_INDICATOR_INTERVAL, self.remove_indicator)
-                        self.start_timer(4, self.GOOD_INDICATOR_INTERVAL, self.remove_good_indicator)
-                    else:
-                        self.stop_timer(1)
-                        self.stop_timer(2)
-                        self.stop_timer(3)
-                        self.game_over()
-                        return
-                    self.remove_invader(invader)
+                self.world.move(invader.body, invader.x, invader.y)
+        for invader in removed:
+            self.remove_invader(invader)
+        
+        # The size of the character changes with the image (for example, when it jumps)
+        self.character_body.set_size(self.character.get_width(), self.character.get_height())
+        self.world.move(self.character_body, self.character.get_left(), self.character_y)
+        for character_body, body in self.world.step():
+            invader = body.data
+            if invader.good:
+                self.character_animation.footsteps_concrete_sound.stop()
+                self.item_found_sound.play()
+                self.character_animation.first_walking = True
+                
+                self.score += invader.points
+                self.score_board.value.set_text(str(self.score))
+                self.good_indicator.set_visible(True)
+                item = ItemGlyphText(invader.x, invader.y, 
+                    self.font, 0, "+" + str(invader.points), h_align = 2, v_align = 2)
+                self.text_indicators.append(item)
+                self.main_layer.add(item)
+                fade_out_item(item, True, self.GOOD_INDICATOR_INTERVAL, self.remove_indicator)
+                self.start_timer(4, self.GOOD_INDICATOR_INTERVAL, self.remove_good_indicator)
+            else:
+                self.stop_timer(1)
+                self.stop_timer(3)
+                self.game_over()
+                return
+            self.remove_invader(invader)
     
     def remove_indicator(self, item):
         item.exit()
@@ -202,6 +245,7 @@ class RunningMinigame(GameStage):
         
     def remove_invader(self, invader):
         self.invaders.remove(invader)
+        self.world.remove(invader.body)
         self.main_layer.remove(invader.item)
         if invader != self.last_bad_invader:
             invader.exit()
@@ -219,9 +263,8 @@ class RunningMinigame(GameStage):
 
     def start_game(self):
         self.start_timer(1, self.CREATE_INTERVAL, self.create_invader)
-        self.start_timer(2, self.MOVE_INTERVAL, self.move_invaders)
         self.start_timer(3, self.DIFICULTY_INTERVAL, self.update_dificulty)
-        self.start_timer(0, 30, self.manage_key)
+        self.simulation.start()
         
     def show_board(self):
         self.main_layer.add(self.character)
@@ -234,7 +277,7 @@ class RunningMinigame(GameStage):
         if  e.type == KEYUP:
             self.key = None
             
-    def manage_key(self, key, data):
+    def manage_key(self, time):
         self.gravity = self.data.jump.gravity
         max_character_y_velocity = -self.data.jump.max_impulse
         character_y_velocity_increment = self.data.jump.impulse_increment
@@ -244,21 +287,24 @@ class RunningMinigame(GameStage):
             self.jumping = True
             self.character_y_velocity = -character_y_velocity_increment
         if self.jumping:
-            self.velocity_increment_timer += self.MOVE_INTERVAL
+            self.velocity_increment_timer += time
             if self.key == K_UP and self.velocity_increment_timer < max_velocity_time:
                 self.character_y_velocity -= character_y_velocity_increment
                 if self.character_y_velocity < max_character_y_velocity:
                     self.character_y_velocity = max_character_y_velocity
                     self.velocity_incerement_timer = max_velocity_time
-            top = self.character.get_top()
-            self.character_y_velocity += self.gravity * self.MOVE_INTERVAL/1000.0
-            top += self.character_y_velocity * self.MOVE_INTERVAL/1000.0
+            top = self.character_y
+            self.character_y_velocity += self.gravity * time/1000.0
+            top += self.character_y_velocity * time/1000.0
             if top + self.character.get_height() >= SCREEN_HEIGHT:
                 self.character_y_velocity = 0
                 self.jumping = False
                 top = self.character_start_top
-            self.character.set_top(top)
-        self.character_animation.update(self.MOVE_INTERVAL, delta_left = 1, jumping = self.jumping)
+            self.character_prev_y = self.character_y
+            self.character_y = top
+        else:
+            self.character_prev_y = self.character_y
+        self.character_animation.update(time, delta_left = 1, jumping = self.jumping)
             
     def game_over(self):
         self.good_indicator.set_visible(False)
@@ -266,9 +312,8 @@ class RunningMinigame(GameStage):
         self.lose_hit_sound.play()
         self.lose_music_sound.play()
         
-        self.stop_timer(0)
+        self.simulation.stop()
         self.stop_timer(1)
-        self.stop_timer(2)
         self.stop_timer(3)
         self.stop_timer(4)
         self.add_layer(self.game_over_layer)
@@ -283,6 +328,7 @@ class RunningMinigame(GameStage):
         self.character = None
         for invader in self.invaders:
             invader.exit()
+        self.world.clear()
         self.data = None
         for text in self.text_indicators:
             text.exit()
@@ -1,13 +1,111 @@
 # -*- coding: latin-1 -*-
 
 from framework.stage import Item, ItemEvent
+from framework.text import get_font_metrics
+from framework.cache import LRUCache
 from pygame.locals import *
 from pygame import Surface
-from collections import deque
+from bisect import bisect_right
 
 SEPARATOR = " "
 PARAGRAPH_SEPARATOR = "\n"
 MAX_WORD_CACHE = 200
+# Maximum number of bytes of the surfaces of the words kept in the cache
+MAX_WORD_CACHE_BYTES = 512 * 1024
+# Maximum number of chars of a chunk of a TextBuffer, bigger chunks are split
+BUFFER_CHUNK_SIZE = 1024
+
+class TextBuffer():
+    # Text kept in chunks, so inserting or deleting a char only copies the
+    # chunk where it is instead of the whole text
+    def __init__(self, text = ""):
+        self.set_text(text)
+
+    def set_text(self, text):
+        size = BUFFER_CHUNK_SIZE
+        self._chunks = [text[i:i + size] for i in xrange(0, len(text), size)] or [""]
+        self._length = len(text)
+        self._update_starts()
+
+    def _update_starts(self):
+        starts = []
+        char = 0
+        for chunk in self._chunks:
+            starts.append(char)
+            char += len(chunk)
+        self._starts = starts
+
+    def _find_chunk(self, position):
+        return max(0, bisect_right(self._starts, position) - 1)
+
+    def __len__(self):
+        return self._length
+
+    def insert(self, position, text):
+        i = self._find_chunk(position)
+        chunk = self._chunks[i]
+        offset = position - self._starts[i]
+        chunk = chunk[:offset] + text + chunk[offset:]
+        size = BUFFER_CHUNK_SIZE
+        if len(chunk) > 2 * size:
+            self._chunks[i:i + 1] = [chunk[k:k + size] for k in xrange(0, len(chunk), size)]
+        else:
+            self._chunks[i] = chunk
+        self._length += len(text)
+        self._update_starts()
+
+    def delete(self, position, count = 1):
+        count = min(count, self._length - position)
+        if count <= 0:
+            return
+        self._length -= count
+        while count > 0:
+            i = self._find_chunk(position)
+            chunk = self._chunks[i]
+            offset = position - self._starts[i]
+            if offset >= len(chunk):
+                # The position is at the end of the chunk, continue in the next one
+                i += 1
+                chunk = self._chunks[i]
+                offset = 0
+            removed = min(count, len(chunk) - offset)
+            chunk = chunk[:offset] + chunk[offset + removed:]
+            if chunk == "" and len(self._chunks) > 1:
+                del self._chunks[i]
+            else:
+                self._chunks[i] = chunk
+            count -= removed
+            self._update_starts()
+
+    def get_text(self, start = 0, end = None):
+        if end is None or end > self._length:
+            end = self._length
+        if start >= end:
+            return ""
+        first = self._find_chunk(start)
+        last = self._find_chunk(end - 1)
+        starts = self._starts
+        if first == last:
+            return self._chunks[first][start - starts[first]:end - starts[first]]
+        parts = [self._chunks[first][start - starts[first]:]]
+        parts += self._chunks[first + 1:last]
+        parts.append(self._chunks[last][:end - starts[last]])
+        return "".join(parts)
+
+    def find(self, char, start = 0):
+        # Index of the first occurrence of a char after start, -1 if there is not
+        if start >= self._length:
+            return -1
+        i = self._find_chunk(start)
+        offset = start - self._starts[i]
+        while i < len(self._chunks):
+            k = self._chunks[i].find(char, offset)
+            if k != -1:
+                return self._starts[i] + k
+            offset = 0
+            i += 1
+        return -1
+
 class Cursor():
     def __init__(self, textbox):
         self.char = 0
@@ -18,7 +116,7 @@ class Cursor():
             self.char -= 1
     
     def move_right(self,):
-        if self.char < len(self._textbox._text):
+        if self.char < len(self._textbox._buffer):
             self.char += 1
     
     def at_begining(self):
@@ -32,10 +130,9 @@ class Line():
         self._color = color
         self._line_height = 0
         self._words = words
-        self._space_width = font.size(" ")[0]
+        self._space_width = get_font_metrics(font).get_width(" ")
         self.char = char
         self.len = len
-        self.paragraph = None
 
     def render(self, item, target, left, top, word_cache):
         for word in self._words:
@@ -49,43 +146,31 @@ class Line():
             ret = ret + word + " "
         return ret
 
-class Paragraph():
-    def __init__(self, lines):
-        self._lines = lines
-        for line in lines:
-            line.paragraph = self
-
 class Word():
     def __init__(self, word, font, color):
         self.font = font
         self.word = word
         self.color = color
         self.surface = font.render(word, True, color)
-        current = ""
-        lengths = [0]
-        for l in word:
-            current = current + l
-            lengths.append(font.size(current)[0])
-        self.lengths = lengths
+        self.lengths = get_font_metrics(font).get_prefix_widths(word)
 
-class RenderCache(dict):
-    
+class RenderCache():
+    # Words rendered, the least recently used are removed
     def __init__(self, font, color):
-        dict.__init__(self)
         self._font = font
         self._color = color
-        self.queue = deque()
+        self._words = LRUCache(MAX_WORD_CACHE_BYTES, MAX_WORD_CACHE)
     
     def get(self, name):
-        if name in self:
-            return self[name]
-        else:
-            value = self[name] = Word(name, self._font, self._color)
-            self.queue.append(name)
-            if len(self.queue) > MAX_WORD_CACHE:
-                word = self.queue.popleft()
-                del self[word]
-            return value
+        value = self._words.get(name)
+        if value is None:
+            value = Word(name, self._font, self._color)
+            surface = value.surface
+            self._words.put(name, value, surface.get_width() * surface.get_height() * surface.get_bytesize())
+        return value
+
+    def get_stats(self):
+        return self._words.get_stats()
 
 class TextBox(Item):
     VALID_UNICODE_CHARS = ['','','','','','','','','','','','','','','','']
@@ -95,14 +180,15 @@ class TextBox(Item):
         self._w = w
         self._h = h
         self._cursor = Cursor(self)
-        self._text = ""
+        self._buffer = TextBuffer()
         self._font = font
+        self._metrics = get_font_metrics(font)
         self._color = color
         Item.__init__(self, left, top, w, h)
-        self._paragraphs = []
-        self._separator_width = font.size(SEPARATOR)[0]
+        self._separator_width = self._metrics.get_width(SEPARATOR)
         self._line_height = font.size(SEPARATOR)[1]
         self._lines = []
+        self._line_chars = []
         self.draw_function = self.render
         self._first_rendered_line = 0
         self._word_render_cache = RenderCache(self._font, self._color)
@@ -118,34 +204,27 @@ class TextBox(Item):
         self.get_stage().set_focus(self)
 
     def text(self, text):
-        self._text = text
+        self._buffer.set_text(text)
         self._update_text()
         self._cursor.char = 0
     
     def get_text(self):
-        return self._text
+        return self._buffer.get_text()
     
     def _update_text(self):
-        self._paragraphs = []
         self._lines = []
-        for p in self._text.split("\n"):
-            words = p.split(SEPARATOR)
-            lines = self.get_lines(words)
-            self._paragraphs.append(Paragraph(lines))
+        self.reflow(0)
 
     def break_word(self, word):
-        i = 0
-        len_word = len(word)
         sub_words = []
-        current_word = ""
-        while i < len_word:
-            if self._font.size(current_word + word[i])[0] > self._w:
-                sub_words.append(current_word)
-                current_word = ""
-            else:
-                current_word = current_word + word[i]
-                i += 1
-        return sub_words, current_word
+        start = 0
+        while True:
+            # At least one char per line, even if it doesn't fit
+            count = max(1, self._metrics.fit(word[start:], self._w))
+            if start + count >= len(word):
+                return sub_words, word[start:]
+            sub_words.append(word[start:start + count])
+            start += count
             
     def get_lines(self, text, total_char = 0, separator = 1):
         lines = []
@@ -154,7 +233,7 @@ class TextBox(Item):
         current_char = 0
         words = []
         for word in text:
-            word_width = self._font.size(word)[0]
+            word_width = self._metrics.get_width(word)
             if word_width > self._w:
                 if words:
                     lines.append(Line(self._font, self._color, words, total_char, current_char))
@@ -169,7 +248,7 @@ class TextBox(Item):
                 if last_word:
                     words = [last_word]
                     current_char = len(last_word) + separator
-                    current_length = self._font.size(last_word)[0] + self._separator_width
+                    current_length = self._metrics.get_width(last_word) + self._separator_width
                 continue
             current_length += word_width
             if current_length > self._w:
@@ -233,26 +312,62 @@ class TextBox(Item):
             self.render_cursor(item, target, self._left, top, None)
         self._first_rendered_line = first_rendered_line
             
-    def reflow(self, from_line):
+    def reflow(self, from_line, position = None, delta = 0):
+        # Wrap again the lines from from_line. If the position and the number
+        # of chars inserted (or deleted, if it is negative) are specified, the
+        # wrap ends when a line begins in the same char (after the change) that
+        # a line of the previous wrap, and the next lines are reused
         if from_line < 0:
             from_line = 0
         if from_line < len(self._lines):
             from_char = self._lines[from_line].char
         else:
+            from_line = 0
             from_char = 0
-        self._lines = self._lines[:from_line]
-        paragraphs = self._text[from_char:].split(PARAGRAPH_SEPARATOR)
-        for paragraph in paragraphs:
-            words = paragraph.split(SEPARATOR)
-            self._lines = self._lines + self.get_lines(words, from_char)
-            from_char = self._lines[-1].len + self._lines[-1].char
-            self.set_dirty()
+            position = None
+        old_lines = self._lines
+        old_chars = self._line_chars
+        old_index = from_line + 1
+        lines = old_lines[:from_line]
+        buffer = self._buffer
+        while True:
+            end = buffer.find(PARAGRAPH_SEPARATOR, from_char)
+            if end == -1:
+                end = len(buffer)
+            words = buffer.get_text(from_char, end).split(SEPARATOR)
+            for line in self.get_lines(words, from_char):
+                if position is not None and line.char - delta > position + 1 and old_index < len(old_chars):
+                    # The chars before the line didn't change, check if the
+                    # previous wrap had a line that begins in the same char
+                    old_char = line.char - delta
+                    old_index = bisect_right(old_chars, old_char, old_index) - 1
+                    if old_chars[old_index] == old_char:
+                        for old_line in old_lines[old_index:]:
+                            old_line.char += delta
+                        lines += old_lines[old_index:]
+                        self._set_lines(lines)
+                        return
+                    old_index += 1
+                lines.append(line)
+            if end >= len(buffer):
+                break
+            from_char = end + 1
+        self._set_lines(lines)
+
+    def _set_lines(self, lines):
+        self._lines = lines
+        self._line_chars = [line.char for line in lines]
+        self.set_dirty()
 
     def _delete_char(self, position):
-        self._text = self._text[:position] + self._text[position + 1:]
+        line = self.cursor_line_index(position)
+        self._buffer.delete(position)
+        self.reflow(line - 1, position, -1)
 
     def _add_char(self, position, char):
-        self._text = self._text[:position] + char + self._text[position:]
+        line = self.cursor_line_index(position)
+        self._buffer.insert(position, char)
+        self.reflow(line - 1, position, len(char))
 
     def __handle_key(self, key, unicode, data):        
         updated = False
@@ -260,22 +375,17 @@ class TextBox(Item):
                 
         if key == K_RETURN:
             self.__reset_cursor_timer()
-            line = self.cursor_line_index()
             self._add_char(self._cursor.char, '\n')
-            self.reflow(line - 1)
             self._cursor.move_right()
         elif key == K_BACKSPACE:
             self.__reset_cursor_timer()
             if not self._cursor.at_begining():
                 self._cursor.move_left()
-                line = self.cursor_line_index()
                 self._delete_char(self._cursor.char)
-                self.reflow(line - 1)
         elif key == K_DELETE:
             self.__reset_cursor_timer()
-            line = self.cursor_line_index()
-            self._delete_char(self._cursor.char)
-            self.reflow(line - 1)
+            if self._cursor.char < len(self._buffer):
+                self._delete_char(self._cursor.char)
         elif key == K_RIGHT:
             self.__reset_cursor_timer()
             self._cursor.move_right()
@@ -295,7 +405,7 @@ class TextBox(Item):
             self.set_dirty()
         elif key == K_END:
             self.__reset_cursor_timer()
-            self._cursor.char = len(self._text)
+            self._cursor.char = len(self._buffer)
             self.set_dirty()
             pass
         elif key == K_DOWN:
@@ -308,9 +418,7 @@ class TextBox(Item):
                 (ord(unicode) < 255 and unicode.encode('latin-1') in self.VALID_UNICODE_CHARS)) \
                 ):
                 self.__reset_cursor_timer()
-                line = self.cursor_line_index()
                 self._add_char(self._cursor.char, unicode.encode('latin-1'))
-                self.reflow(line - 1)
                 self._cursor.move_right()
         return handled
     
@@ -330,13 +438,12 @@ class TextBox(Item):
             self._cursor.char = self._lines[i + 1].char + char
         self.set_dirty()
     
-    def cursor_line_index(self):
+    def cursor_line_index(self, char = None):
         if not self._lines:
             return 0
-        for line in self._lines:
-            if self._cursor.char < line.char:
-                return self._lines.index(line) - 1
-        return len(self._lines) - 1
+        if char is None:
+            char = self._cursor.char
+        return max(0, bisect_right(self._line_chars, char) - 1)
             
 
     def handle_event_focused(self, event, data):